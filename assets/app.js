@@ -0,0 +1,38 @@
+// Live test point voltages and charge curve from the /stream events
+(function () {
+    if (!window.EventSource) {
+        return;
+    }
+    var stream = new EventSource('/stream');
+
+    stream.addEventListener('tp', function (event) {
+        var values = JSON.parse(event.data);
+        for (var i = 1; i <= 3; i++) {
+            var element = document.getElementById('tp' + i);
+            if (element && values.length > i) {
+                element.textContent = (values[i] / 1000000).toFixed(3);
+            }
+        }
+    });
+
+    // A part was inserted, changed or removed; the page shows its results
+    stream.addEventListener('measurement', function () {
+        window.location.reload();
+    });
+
+    stream.addEventListener('curve_end', function (event) {
+        var curve = JSON.parse(event.data);
+        var line = document.getElementById('charge-curve');
+        var count = curve.t_us.length;
+        if (!line || count < 2) {
+            return;
+        }
+        var span = curve.t_us[count - 1] || 1;
+        var points = [];
+        for (var i = 0; i < count; i++) {
+            points.push(Math.round(curve.t_us[i] * 400 / span) + ',' +
+                        Math.round(100 - curve.uv[i] * 100 / 3300000));
+        }
+        line.setAttribute('points', points.join(' '));
+    });
+})();
@@ -0,0 +1,91 @@
+"""
+Host-side build of the web assets served by the firmware.
+
+Minifies the CSS, SVG and JS sources in this directory, gzips them and
+writes them to src/static/ together with manifest.json, which the
+firmware loads to serve them (see src/static.py). Upload src/static/ with
+the rest of src/ after running it.
+
+Run from the repository root:
+    python assets/build.py
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+
+ASSETS = os.path.dirname(os.path.abspath(__file__))
+OUTPUT = os.path.join(os.path.dirname(ASSETS), 'src', 'static')
+
+CONTENT_TYPES = {
+    '.css': 'text/css',
+    '.svg': 'image/svg+xml',
+    '.js': 'application/javascript',
+}
+
+
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{}:;,>])\s*', r'\1', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_svg(text):
+    text = re.sub(r'<!--.*?-->', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    return re.sub(r'>\s+<', '><', text).strip()
+
+
+def minify_js(text):
+    # Line based so automatic semicolon insertion is never affected
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.svg': minify_svg,
+    '.js': minify_js,
+}
+
+
+def build():
+    """
+    Returns:
+        dict: The manifest, URL path -> file, type, ETag and length.
+    """
+    os.makedirs(OUTPUT, exist_ok=True)
+    manifest = {}
+    for name in sorted(os.listdir(ASSETS)):
+        extension = os.path.splitext(name)[1]
+        if extension not in MINIFIERS:
+            continue
+        with open(os.path.join(ASSETS, name), encoding='utf-8') as file:
+            source = file.read()
+        minified = MINIFIERS[extension](source).encode()
+        # mtime=0 keeps the output, and so the ETag, reproducible
+        compressed = gzip.compress(minified, 9, mtime=0)
+        with open(os.path.join(OUTPUT, name + '.gz'), 'wb') as file:
+            file.write(compressed)
+        manifest['/static/' + name] = {
+            'file': 'static/' + name + '.gz',
+            'type': CONTENT_TYPES[extension],
+            'etag': hashlib.sha1(minified).hexdigest()[:16],
+            'length': len(compressed),
+        }
+        print('{0:>16} {1:>7} -> {2:>6} minified -> {3:>6} gzip'.format(
+            name, len(source.encode()), len(minified), len(compressed)))
+    with open(os.path.join(OUTPUT, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    build()
@@ -0,0 +1,224 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# The value checked against the tolerance, per component type, and its unit
+PRIMARY_VALUES = {
+    'resistor': ('resistance', 'Ω'),
+    'capacitor': ('capacitance_uf', 'uF'),
+    'diode': ('forward_voltage', 'V'),
+    'inductor': ('inductance_mh', 'mH'),
+}
+
+COMPONENT_CODES = {None: 0, 'resistor': 1, 'capacitor': 2, 'diode': 3, 'inductor': 4}
+
+# Column name and dtype of the result log, one file per column
+LOG_COLUMNS = (
+    ('time', '<f8'),
+    ('seq', '<i8'),
+    ('component', 'u1'),
+    ('value', '<f8'),
+    ('duration_us', '<i8'),
+    ('passed', 'u1'),
+)
+
+
+class BatchSpec:
+    def __init__(self, lot, part, component, nominal, tolerance_pct):
+        """
+        What the parts of a lot should measure.
+
+        Args:
+            lot (str): The lot number.
+            part (str): The part number.
+            component (str): The expected component type, a key of PRIMARY_VALUES.
+            nominal (float): The nominal value, in the unit of PRIMARY_VALUES.
+            tolerance_pct (float): Allowed deviation from nominal in percent.
+        """
+        self.lot = lot
+        self.part = part
+        self.component = component
+        self.nominal = nominal
+        self.tolerance_pct = tolerance_pct
+
+    def limits(self):
+        deviation = abs(self.nominal) * self.tolerance_pct / 100
+        return self.nominal - deviation, self.nominal + deviation
+
+    def check(self, result):
+        """
+        Pass/fail of one measurement result.
+
+        Returns:
+            tuple: (passed, measured value), the value is nan if the part
+                is not of the expected type or has no value.
+        """
+        if result.get('component') != self.component:
+            return False, float('nan')
+        value = result.get('values', {}).get(PRIMARY_VALUES[self.component][0])
+        if value is None:
+            return False, float('nan')
+        low, high = self.limits()
+        return low <= value <= high, float(value)
+
+    def to_dict(self):
+        return {'lot': self.lot, 'part': self.part, 'component': self.component,
+                'nominal': self.nominal, 'tolerance_pct': self.tolerance_pct}
+
+
+def new_lot_directory(root, lot):
+    """
+    A log directory for a new run of a lot: root/lot, or root/lot-2,
+    root/lot-3 and so on if the lot was run before, so the log and spec of
+    an earlier run are never written over.
+
+    Returns:
+        str: The path, not created yet.
+    """
+    path = os.path.join(root, lot)
+    run = 2
+    while os.path.exists(path):
+        path = os.path.join(root, '{0}-{1}'.format(lot, run))
+        run += 1
+    return path
+
+
+class ResultLog:
+    def __init__(self, directory, chunk_rows=1):
+        """
+        Append-only columnar log of a lot: one raw little endian file per
+        column, kept open and appended chunk_rows at a time. Every row is
+        written and flushed to the operating system by default, so a crash
+        of host_app loses none. Reloading thousands of rows is one
+        np.fromfile per column.
+
+        Args:
+            directory (str): The log directory, created if missing.
+            chunk_rows (int): Rows buffered before they are appended.
+        """
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.pending = {name: [] for name, _ in LOG_COLUMNS}
+        self.files = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.bin')
+
+    def write_spec(self, spec):
+        # Refuses to replace the spec of another run, see new_lot_directory()
+        with open(os.path.join(self.directory, 'spec.json'), 'x') as file:
+            json.dump(spec.to_dict(), file)
+
+    def append(self, **row):
+        for name, _ in LOG_COLUMNS:
+            self.pending[name].append(row[name])
+        if len(self.pending['time']) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pending['time']:
+            return
+        for name, dtype in LOG_COLUMNS:
+            file = self.files.get(name)
+            if file is None:
+                file = self.files[name] = open(self.path(name), 'ab')
+            file.write(np.asarray(self.pending[name], dtype=dtype).tobytes())
+            file.flush()
+            self.pending[name] = []
+
+    def close(self):
+        self.flush()
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+    def load(self):
+        """
+        All rows, flushed and pending.
+
+        Returns:
+            dict: One array per column. A chunk cut short by a crash is
+                dropped from every column, so they stay aligned.
+        """
+        columns = {}
+        for name, dtype in LOG_COLUMNS:
+            path = self.path(name)
+            stored = np.fromfile(path, dtype=dtype) if os.path.exists(path) else np.zeros(0, dtype=dtype)
+            columns[name] = stored
+        rows = min(len(column) for column in columns.values())
+        for name, dtype in LOG_COLUMNS:
+            columns[name] = np.concatenate((columns[name][:rows], np.asarray(self.pending[name], dtype=dtype)))
+        return columns
+
+
+class BatchRun:
+    def __init__(self, spec, log, ppm_window=20):
+        """
+        A running batch: turns the stream of measurement results into
+        tested parts. A part is recorded on the first result with a
+        component after a result without one from the same tester, so a
+        part left in a tester is counted once.
+
+        Args:
+            spec (BatchSpec): Expected value and tolerance.
+            log (ResultLog): Where the parts are recorded.
+            ppm_window (int): Parts the parts-per-minute rate is taken over.
+        """
+        self.spec = spec
+        self.log = log
+        self.ppm_window = ppm_window
+        self.present = {}
+        self.tested = 0
+        self.passed = 0
+        self.times = []
+        self.durations_us = []
+        log.write_spec(spec)
+
+    def add_result(self, result, now=None, device=None):
+        """
+        Args:
+            result (dict): The measurement result.
+            now (float): Time of the result, time.time() by default.
+            device (str): The tester that measured it.
+
+        Returns:
+            tuple: (passed, value) of a newly tested part, None if the
+                result is not a new part.
+        """
+        present = result.get('component') is not None
+        new_part = present and not self.present.get(device, False)
+        self.present[device] = present
+        if not new_part:
+            return None
+        now = time.time() if now is None else now
+        passed, value = self.spec.check(result)
+        duration_us = result.get('duration_us') or 0
+        self.log.append(time=now, seq=result.get('seq', 0), component=COMPONENT_CODES.get(result.get('component'), 0),
+                        value=value, duration_us=duration_us, passed=passed)
+        self.tested += 1
+        self.passed += passed
+        self.times.append(now)
+        self.durations_us.append(duration_us)
+        return passed, value
+
+    def parts_per_minute(self):
+        times = self.times[-self.ppm_window:]
+        if len(times) < 2 or times[-1] <= times[0]:
+            return 0.0
+        return (len(times) - 1) * 60 / (times[-1] - times[0])
+
+    def yield_pct(self):
+        return 100 * self.passed / self.tested if self.tested else 0.0
+
+    def duration_histogram(self, bins=20):
+        """
+        Returns:
+            tuple: (counts, bin edges in ms) of the measurement times.
+        """
+        return np.histogram(np.asarray(self.durations_us, dtype=float) / 1000, bins=bins)
+
+    def finish(self):
+        self.log.close()
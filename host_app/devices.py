@@ -0,0 +1,193 @@
+import queue
+import threading
+
+from link import DeviceLink, LinkReader, MSG_RESULT
+
+# USB serial bridges found on ESP32 boards: CP210x, CH340, FTDI and the
+# native USB of the S2/S3
+TESTER_USB_IDS = (
+    (0x10C4, 0xEA60),
+    (0x1A86, 0x7523),
+    (0x0403, 0x6001),
+    (0x303A, None),
+)
+
+
+def discover_ports(comports):
+    """
+    The serial ports that look like testers.
+
+    Args:
+        comports (callable): serial.tools.list_ports.comports.
+
+    Returns:
+        list: Device paths, sorted.
+    """
+    found = []
+    for port in comports():
+        for vid, pid in TESTER_USB_IDS:
+            if port.vid == vid and (pid is None or port.pid == pid):
+                found.append(port.device)
+                break
+    return sorted(found)
+
+
+class DeviceWorker(threading.Thread):
+    def __init__(self, device, port, results, refresh_hz):
+        """
+        Reads one tester on its own thread and puts its message batches on
+        the shared results queue. Ends when the port fails, e.g. when the
+        tester is unplugged.
+
+        Args:
+            device (str): The port path, names the tester.
+            port: The open port, see DeviceLink.
+            results (queue.Queue): Receives (device, batch) tuples.
+            refresh_hz (int): Most batches per second, see LinkReader.
+        """
+        super(DeviceWorker, self).__init__(daemon=True)
+        self.device = device
+        self.port = port
+        self.results = results
+        self.link = DeviceLink(port)
+        self.reader = LinkReader(self.link, self.deliver, refresh_hz)
+        self.running = True
+        self.error = None
+        self.last_result = None
+        self.results_received = 0
+
+    def deliver(self, batch):
+        for kind, value in batch:
+            if kind == MSG_RESULT:
+                self.last_result = value
+                self.results_received += 1
+        self.results.put((self.device, batch))
+
+    def run(self):
+        try:
+            while self.running:
+                self.reader.poll()
+        except OSError as error:
+            # pyserial's SerialException is an OSError too
+            self.error = str(error) or error.__class__.__name__
+        finally:
+            try:
+                self.port.close()
+            except OSError:
+                pass
+
+    def stop(self):
+        self.running = False
+
+    def status(self):
+        counters = self.reader.counters()
+        last = self.last_result or {}
+        return {
+            'device': self.device,
+            'state': 'connected' if self.is_alive() and self.error is None else 'disconnected: ' + str(self.error),
+            'results': self.results_received,
+            'component': last.get('component'),
+            'values': last.get('values'),
+            'messages_s': counters['messages_s'],
+            'bad_frames': counters['bad_frames'],
+        }
+
+
+class DeviceManager:
+    def __init__(self, open_port, refresh_hz=60):
+        """
+        Connects to every tester it is given and merges their messages into
+        one queue, so the UI thread only drains that queue once per
+        refresh however many testers there are.
+
+        Args:
+            open_port (callable): Opens a port path, e.g. a serial.Serial
+                with a timeout of one refresh interval.
+            refresh_hz (int): Most batches per second and tester.
+        """
+        self.open_port = open_port
+        self.refresh_hz = refresh_hz
+        self.results = queue.Queue()
+        self.workers = {}
+        self.failures = {}
+
+    def scan(self, paths):
+        """
+        Connects to the ports not connected yet and forgets testers that
+        went away. A tester whose worker ended is reconnected if its port
+        is still listed.
+
+        Args:
+            paths (list): The port paths present now.
+
+        Returns:
+            list: The newly connected port paths.
+        """
+        for device, worker in list(self.workers.items()):
+            if not worker.is_alive() and device in paths:
+                del self.workers[device]
+            elif device not in paths:
+                worker.stop()
+                del self.workers[device]
+        connected = []
+        for device in paths:
+            if device in self.workers:
+                continue
+            try:
+                port = self.open_port(device)
+            except OSError as error:
+                self.failures[device] = str(error)
+                continue
+            self.failures.pop(device, None)
+            worker = DeviceWorker(device, port, self.results, self.refresh_hz)
+            self.workers[device] = worker
+            worker.start()
+            connected.append(device)
+        return connected
+
+    def devices(self):
+        return sorted(self.workers.keys())
+
+    def link(self, device):
+        return self.workers[device].link
+
+    def measure(self, devices=None, curve=True):
+        for device in devices if devices is not None else self.devices():
+            worker = self.workers.get(device)
+            if worker is None or not worker.is_alive():
+                continue
+            try:
+                worker.link.measure()
+                if curve:
+                    worker.link.request_curve()
+            except OSError as error:
+                worker.error = str(error)
+
+    def drain(self, limit=1000):
+        """
+        Takes what arrived since the last call without blocking.
+
+        Returns:
+            list: (device, batch) tuples in arrival order.
+        """
+        drained = []
+        while len(drained) < limit:
+            try:
+                drained.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        return drained
+
+    def status(self):
+        rows = [self.workers[device].status() for device in self.devices()]
+        for device in sorted(self.failures):
+            rows.append({'device': device, 'state': 'failed: ' + self.failures[device], 'results': 0,
+                         'component': None, 'values': None, 'messages_s': 0.0, 'bad_frames': 0})
+        return rows
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+        for worker in self.workers.values():
+            worker.join()
+        self.workers = {}
@@ -0,0 +1,219 @@
+import json
+import os
+import sys
+import time
+
+# The framing is shared with the firmware
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from protocol import *
+from history import RECORD_SIZE, unpack_record
+
+MAX_PAYLOAD = 4096
+# Host side message for a block of a charge curve as it arrives, never sent
+# over the link
+MSG_CURVE_BLOCK = -1
+
+
+class DeviceLink:
+    def __init__(self, port, max_payload=MAX_PAYLOAD):
+        """
+        Host end of the framed serial protocol. Has no Qt dependency, so it
+        also runs against a pty in the simulator.
+
+        Args:
+            port: A pyserial Serial, or any raw stream with readinto()
+                and write().
+            max_payload (int): Largest frame payload accepted.
+        """
+        self.port = port
+        self.decoder = FrameDecoder(max_payload)
+        self.curve = {CHANNEL_CURVE_TIME: [], CHANNEL_CURVE_VALUE: []}
+        self.bytes_read = 0
+        self.reads = 0
+
+    def send(self, kind, payload=b''):
+        write_frame(self.port, kind, payload)
+
+    def measure(self):
+        self.send(MSG_MEASURE)
+
+    def request_curve(self):
+        self.send(MSG_GET_CURVE)
+
+    def configure(self, **settings):
+        self.send(MSG_CONFIGURE, json.dumps(settings).encode())
+
+    def request_history(self, start=0, limit=30):
+        """
+        Asks for stored measurements from sequence number start on, the
+        newest ones if start is 0. The tester caps limit to what fits in
+        one frame.
+        """
+        self.send(MSG_GET_HISTORY, struct.pack(HISTORY_REQUEST, start, limit))
+
+    def request_trace(self):
+        self.send(MSG_GET_TRACE)
+
+    def set_trace_levels(self, **levels):
+        """
+        Sets the level of single trace channels, e.g. capacitor=5.
+        """
+        self.configure(trace_levels=levels)
+
+    def calibrate(self, step, reference_ohm=None):
+        """
+        Runs one step of the ADC calibration: 'open', 'short', 'reference'
+        (with the resistor between TP1 and TP2) or 'clear'. The tester
+        answers with an ACK once the step is done.
+        """
+        request = {'step': step}
+        if reference_ohm is not None:
+            request['ohm'] = reference_ohm
+        self.send(MSG_CALIBRATE, json.dumps(request).encode())
+
+    def set_wifi(self, ssid, password):
+        self.send(MSG_SET_WIFI, json.dumps({'ssid': ssid, 'password': password}).encode())
+
+    def read(self):
+        """
+        Reads what the port has buffered, at least enough to complete the
+        frame being received, into the decoder buffer in one call.
+
+        Returns:
+            list: The decoded messages, see decode().
+        """
+        space = self.decoder.space()
+        waiting = getattr(self.port, 'in_waiting', len(space))
+        n = self.port.readinto(space[:max(self.decoder.wanted(), min(waiting, len(space)))])
+        if n:
+            self.decoder.commit(n)
+            self.bytes_read += n
+            self.reads += 1
+        messages = []
+        frame = self.decoder.next()
+        while frame is not None:
+            message = self.decode(frame[0], frame[1])
+            if message is not None:
+                messages.append(message)
+            frame = self.decoder.next()
+        return messages
+
+    def decode(self, kind, payload):
+        """
+        Turns a frame into a (type, value) message: the result dict for
+        MSG_RESULT, (acked type, status) for MSG_ACK, the text of MSG_LOG,
+        (first seq, next seq, records) for MSG_HISTORY and (times, values)
+        once both channels of a charge curve arrived. The times come first,
+        every block of values before the last one gives MSG_CURVE_BLOCK
+        with (times, values, offset) of that block, so the curve can be
+        drawn as it arrives; time blocks give None. History records with a
+        bad CRC are dropped.
+        """
+        if kind == MSG_RESULT:
+            return kind, json.loads(bytes(payload))
+        if kind == MSG_ACK:
+            return kind, (payload[0], payload[1])
+        if kind == MSG_HISTORY:
+            first, following = struct.unpack_from(HISTORY_HEADER, payload, 0)
+            records = []
+            for offset in range(HISTORY_HEADER_SIZE, len(payload) - RECORD_SIZE + 1, RECORD_SIZE):
+                record = unpack_record(payload, offset)
+                if record is not None:
+                    records.append(record)
+            return kind, (first, following, records)
+        if kind == MSG_LOG:
+            return kind, bytes(payload).decode('utf-8', 'replace')
+        if kind == MSG_SAMPLES:
+            channel, last, offset, samples = parse_samples(payload)
+            if channel not in self.curve:
+                return None
+            if offset == 0:
+                self.curve[channel] = []
+            self.curve[channel].extend(samples)
+            if channel != CHANNEL_CURVE_VALUE:
+                return None
+            if last:
+                return kind, (self.curve[CHANNEL_CURVE_TIME], self.curve[CHANNEL_CURVE_VALUE])
+            return MSG_CURVE_BLOCK, (self.curve[CHANNEL_CURVE_TIME][offset:offset + len(samples)], samples, offset)
+        return kind, bytes(payload)
+
+
+class LinkReader:
+    def __init__(self, link, emit, refresh_hz=60, poll_ms=2):
+        """
+        Reads a DeviceLink as data arrives and hands the messages on in
+        batches, at most one batch per display refresh. A message arriving
+        after a quiet period is handed on at once; bursts are collected
+        until the next refresh instead of costing one UI update each.
+
+        Args:
+            link (DeviceLink): The link; its port timeout is set to poll_ms
+                once here, pyserial reconfigures the port on every change.
+            emit (callable): Called with a list of (type, value) messages.
+            refresh_hz (int): Most batches handed on per second.
+            poll_ms (int): Longest a read waits for data, and so the most a
+                due batch is held back.
+        """
+        self.link = link
+        self.emit = emit
+        self.interval = 1 / refresh_hz
+        self.link.port.timeout = poll_ms / 1000
+        self.pending = []
+        self.first_arrival = 0.0
+        self.last_emit = 0.0
+        self.messages = 0
+        self.batches = 0
+        self.queued_ms_max = 0.0
+        self.queued_ms_total = 0.0
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.window_messages = 0
+
+    def poll(self):
+        """
+        One read of the link, then a flush if a refresh interval passed
+        since the last batch.
+        """
+        messages = self.link.read()
+        now = time.monotonic()
+        if messages:
+            if not self.pending:
+                self.first_arrival = now
+            self.pending.extend(messages)
+        if self.pending and now - self.last_emit >= self.interval:
+            self.flush(now)
+
+    def flush(self, now):
+        batch = self.pending
+        self.pending = []
+        queued_ms = (now - self.first_arrival) * 1000
+        self.queued_ms_total += queued_ms
+        self.queued_ms_max = max(self.queued_ms_max, queued_ms)
+        self.messages += len(batch)
+        self.batches += 1
+        self.last_emit = now
+        self.emit(batch)
+
+    def counters(self):
+        """
+        Throughput since the previous call and the time messages waited
+        for their batch.
+
+        Returns:
+            dict: bytes_s, messages_s, batches, bad_frames, queued_ms_mean
+                and queued_ms_max.
+        """
+        now = time.monotonic()
+        elapsed = max(now - self.window_start, 1e-9)
+        counters = {
+            'bytes_s': (self.link.bytes_read - self.window_bytes) / elapsed,
+            'messages_s': (self.messages - self.window_messages) / elapsed,
+            'batches': self.batches,
+            'bad_frames': self.link.decoder.errors,
+            'queued_ms_mean': self.queued_ms_total / self.batches if self.batches else 0.0,
+            'queued_ms_max': self.queued_ms_max,
+        }
+        self.window_start = now
+        self.window_bytes = self.link.bytes_read
+        self.window_messages = self.messages
+        return counters
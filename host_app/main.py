@@ -1,112 +1,294 @@
 import sys
-import random
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QPushButton, QLabel, QCheckBox, QWidget, \
-    QInputDialog, QDialog, QLineEdit, QFormLayout
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QMutex, QWaitCondition
+    QInputDialog, QDialog, QLineEdit, QFormLayout, QHBoxLayout, QComboBox, QDoubleSpinBox, QTableWidget, \
+    QTableWidgetItem, QHeaderView, QMessageBox
+from PyQt5.QtCore import Qt, QTimer
 import serial
 import serial.tools.list_ports
 import base64
 import pickle
 import os
 
-
-class SerialThread(QThread):
-    signal = pyqtSignal('PyQt_PyObject')
-
-    def __init__(self):
-        QThread.__init__(self)
-        self.dummy_mode = True
-        self.serial_port = None
-        self.mutex = QMutex()
-        self.condition = QWaitCondition()
-        self.should_run = True
-
-    def run(self):
-        while self.should_run:
-            if self.dummy_mode:
-                data = str(random.randint(0, 100))
-            else:
-                if self.serial_port is not None:
-                    data = self.serial_port.readline().decode('utf-8').strip()
-                else:
-                    data = "No serial port selected"
-            self.signal.emit(data)
-            self.mutex.lock()
-            self.condition.wait(self.mutex, 1000)  # Wait for 1 second or until stopped
-            self.mutex.unlock()
-
-    def send_data(self, data):
-        if not self.dummy_mode and self.serial_port is not None:
-            self.serial_port.write(data.encode())
-
-    def set_dummy_mode(self, dummy_mode):
-        self.dummy_mode = dummy_mode
-
-    def set_serial_port(self, port):
-        if self.serial_port is not None:
-            self.serial_port.close()
-        self.serial_port = serial.Serial(port, 115200)
-
-    def stop(self):
-        self.mutex.lock()
-        self.should_run = False
-        self.condition.wakeAll()
-        self.mutex.unlock()
+from plot import CurvePlot, Histogram
+from batch import BatchSpec, BatchRun, ResultLog, PRIMARY_VALUES, new_lot_directory
+from link import MSG_RESULT, MSG_ACK, MSG_SAMPLES, MSG_LOG, MSG_CALIBRATE, MSG_CURVE_BLOCK, STATUS_OK
+from devices import DeviceManager, discover_ports
+
+# Most UI updates per second
+REFRESH_HZ = 60
+# New and unplugged testers are picked up this often
+SCAN_INTERVAL_MS = 2000
+# The device grid is redrawn this often
+GRID_INTERVAL_MS = 500
+GRID_COLUMNS = ("Device", "State", "Results", "Component", "Values", "msg/s", "Bad frames")
+# Batch logs are kept in one directory per lot under this one
+BATCH_DIRECTORY = "batches"
+# Steps of the ADC calibration and what to do before each
+CALIBRATION_STEPS = (
+    ("open", "Remove everything from the test points."),
+    ("short", "Short TP1, TP2 and TP3 together."),
+    ("reference", "Connect the reference resistor between TP1 and TP2, nothing on TP3."),
+)
+DEFAULT_REFERENCE_OHM = 47
+
+
+def describe(kind, value):
+    if kind == MSG_RESULT:
+        return "{0}: {1}".format(value.get('component') or 'nothing found', value.get('values'))
+    if kind == MSG_ACK:
+        return "Device: " + ("OK" if value[1] == STATUS_OK else "request failed")
+    if kind == MSG_SAMPLES:
+        return "Charge curve: {0} samples".format(len(value[1]))
+    if kind == MSG_CURVE_BLOCK:
+        return "Charge curve: {0} samples so far".format(value[2] + len(value[1]))
+    if kind == MSG_LOG:
+        return value
+    return "Unknown message {0}".format(kind)
+
+
+def open_serial(device):
+    # The read timeout is one refresh interval, so a batch waiting for more
+    # data is still handed on in time
+    return serial.Serial(device, 115200, timeout=1 / REFRESH_HZ)
 
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super(MainWindow, self).__init__()
 
+        self.credentials_file = ".cache"
+        self.batch = None
+        self.manual_ports = []
+        # Calibration in progress: devices, step index, reference ohm and
+        # the devices the step is still running on
+        self.calibration = None
+
         self.ui_init()
 
-        self.serial_init()
-
-        self.credentials_file = ".cache"
+        self.devices_init()
 
     def ui_init(self):
         self.setWindowTitle("Serial Reader")
         self.setFixedSize(1280, 900)
 
         self.label = QLabel("Waiting for data...")
+        self.stats_label = QLabel("")
+        self.plot = CurvePlot()
         self.measure_button = QPushButton("Measure Component")
-        self.port_button = QPushButton("Select COM Port")
+        self.port_button = QPushButton("Add COM Port")
         self.wifi_button = QPushButton("Set WiFi Credentials")
+        self.calibrate_button = QPushButton("Calibrate")
 
         self.measure_button.setFixedWidth(200)
         self.port_button.setFixedWidth(200)
         self.wifi_button.setFixedWidth(200)
+        self.calibrate_button.setFixedWidth(200)
+
+        self.lot_edit = QLineEdit()
+        self.part_edit = QLineEdit()
+        self.component_box = QComboBox()
+        self.component_box.addItems(list(PRIMARY_VALUES.keys()))
+        self.nominal_spin = QDoubleSpinBox()
+        self.nominal_spin.setDecimals(4)
+        self.nominal_spin.setRange(0, 1e9)
+        self.tolerance_spin = QDoubleSpinBox()
+        self.tolerance_spin.setRange(0, 100)
+        self.tolerance_spin.setValue(5)
+        self.tolerance_spin.setSuffix(" %")
+        self.batch_button = QPushButton("Start Batch")
+        self.batch_label = QLabel("")
+        self.histogram = Histogram("Measurement time (ms)")
+        self.grid = QTableWidget(0, len(GRID_COLUMNS))
+        self.grid.setHorizontalHeaderLabels(GRID_COLUMNS)
+        self.grid.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.grid.horizontalHeader().setStretchLastSection(True)
+        self.grid.setSelectionBehavior(QTableWidget.SelectRows)
+        self.grid.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.grid.setMaximumHeight(200)
+
+        batch_layout = QHBoxLayout()
+        for text, widget in (("Lot:", self.lot_edit), ("Part:", self.part_edit), ("Type:", self.component_box),
+                             ("Nominal:", self.nominal_spin), ("Tolerance:", self.tolerance_spin)):
+            batch_layout.addWidget(QLabel(text))
+            batch_layout.addWidget(widget)
+        batch_layout.addWidget(self.batch_button)
 
         layout = QVBoxLayout()
         layout.addWidget(self.label)
+        layout.addWidget(self.stats_label)
+        layout.addWidget(self.grid)
+        layout.addWidget(self.plot, 1)
+        layout.addLayout(batch_layout)
+        layout.addWidget(self.batch_label)
+        layout.addWidget(self.histogram)
         layout.addWidget(self.measure_button)
         layout.addWidget(self.port_button)
         layout.addWidget(self.wifi_button)
+        layout.addWidget(self.calibrate_button)
 
         container = QWidget()
         container.setLayout(layout)
         self.setCentralWidget(container)
 
-        self.measure_button.clicked.connect(lambda: self.send_data("Measure object"))
+        self.measure_button.clicked.connect(self.measure)
         self.port_button.clicked.connect(self.select_port)
         self.wifi_button.clicked.connect(self.set_wifi_credentials)
-
-    def serial_init(self):
-        self.serial_thread = SerialThread()
-        self.serial_thread.signal.connect(self.update_label)
-        self.serial_thread.start()
-
-    def update_label(self, data):
-        self.label.setText(data)
-
-    def send_data(self, data):
-        self.serial_thread.send_data(data)
+        self.batch_button.clicked.connect(self.toggle_batch)
+        self.calibrate_button.clicked.connect(self.start_calibration)
+
+    def devices_init(self):
+        self.devices = DeviceManager(open_serial, REFRESH_HZ)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.update_messages)
+        self.refresh_timer.start(1000 // REFRESH_HZ)
+        self.scan_timer = QTimer(self)
+        self.scan_timer.timeout.connect(self.scan_devices)
+        self.scan_timer.start(SCAN_INTERVAL_MS)
+        self.grid_timer = QTimer(self)
+        self.grid_timer.timeout.connect(self.update_grid)
+        self.grid_timer.start(GRID_INTERVAL_MS)
+        self.scan_devices()
+
+    def scan_devices(self):
+        ports = discover_ports(serial.tools.list_ports.comports)
+        for port in self.manual_ports:
+            if port not in ports:
+                ports.append(port)
+        for device in self.devices.scan(ports):
+            self.label.setText("Connected to " + device)
+            if self.batch is not None:
+                self.devices.measure([device], curve=False)
+
+    def update_messages(self):
+        # Everything the testers sent since the last refresh, newest message
+        # of the newest batch shown
+        drained = self.devices.drain()
+        for device, batch in drained:
+            for kind, value in batch:
+                if kind == MSG_CURVE_BLOCK:
+                    # Drawn as the blocks arrive, fitted once complete
+                    if value[2] == 0:
+                        self.plot.clear()
+                    self.plot.append(value[0], value[1])
+                elif kind == MSG_SAMPLES:
+                    self.plot.show_curve(value[0], value[1])
+                elif kind == MSG_RESULT and self.batch is not None:
+                    self.batch_result(device, value)
+                elif kind == MSG_ACK and value[0] == MSG_CALIBRATE and self.calibration is not None:
+                    self.calibration_ack(device, value[1])
+        if drained:
+            device, batch = drained[-1]
+            kind, value = batch[-1]
+            self.label.setText(device + ": " + describe(kind, value))
+
+    def update_grid(self):
+        rows = self.devices.status()
+        self.grid.setRowCount(len(rows))
+        total = 0.0
+        for i, row in enumerate(rows):
+            cells = (row['device'], row['state'], str(row['results']), row['component'] or "-",
+                     str(row['values'] or "-"), "{0:.1f}".format(row['messages_s']), str(row['bad_frames']))
+            for column, text in enumerate(cells):
+                item = self.grid.item(i, column)
+                if item is None:
+                    self.grid.setItem(i, column, QTableWidgetItem(text))
+                elif item.text() != text:
+                    item.setText(text)
+            total += row['messages_s']
+        self.stats_label.setText("{0} testers, {1:.1f} msg/s".format(len(rows), total))
+
+    def selected_devices(self):
+        """
+        The testers selected in the grid, all of them if none is selected.
+        """
+        rows = sorted(set(index.row() for index in self.grid.selectedIndexes()))
+        devices = [self.grid.item(row, 0).text() for row in rows if self.grid.item(row, 0) is not None]
+        return devices or self.devices.devices()
+
+    def measure(self):
+        self.devices.measure(self.selected_devices())
+
+    def toggle_batch(self):
+        if self.batch is not None:
+            self.batch.finish()
+            self.batch = None
+            self.batch_button.setText("Start Batch")
+            return
+        lot = self.lot_edit.text().strip() or "unnamed"
+        spec = BatchSpec(lot, self.part_edit.text().strip(), self.component_box.currentText(),
+                         self.nominal_spin.value(), self.tolerance_spin.value())
+        directory = new_lot_directory(BATCH_DIRECTORY, lot)
+        self.batch = BatchRun(spec, ResultLog(directory))
+        self.batch_button.setText("Stop Batch")
+        self.batch_label.setText("Batch {0}, logged to {1}: insert the first part".format(lot, directory))
+        self.devices.measure(curve=False)
+
+    def batch_result(self, device, result):
+        # Every requested result asks for the next measurement, so exactly
+        # one is outstanding per tester while the batch runs. Results the
+        # tester pushes when a part is inserted come on top of that chain
+        outcome = self.batch.add_result(result, device=device)
+        if result.get('trigger') != 'presence':
+            self.devices.measure([device], curve=False)
+        if outcome is None:
+            return
+        passed, value = outcome
+        batch = self.batch
+        self.batch_label.setText("{0} {1}: {2:g} {3} | {4} parts, yield {5:.1f} %, {6:.1f} parts/min".format(
+            device, "PASS" if passed else "FAIL", value, PRIMARY_VALUES[batch.spec.component][1],
+            batch.tested, batch.yield_pct(), batch.parts_per_minute()))
+        self.histogram.set_histogram(*batch.duration_histogram())
+
+    def start_calibration(self):
+        devices = self.selected_devices()
+        if not devices:
+            return
+        ohm, ok = QInputDialog.getDouble(self, "Calibrate", "Reference resistor (ohm):", DEFAULT_REFERENCE_OHM,
+                                         1, 10000, 2)
+        if not ok:
+            return
+        self.calibration = {'devices': devices, 'step': 0, 'ohm': ohm, 'pending': set()}
+        self.calibration_step()
+
+    def calibration_step(self):
+        # Asks for the setup of the next step and runs it on every device,
+        # the step after it follows once all of them acknowledged
+        calibration = self.calibration
+        step, text = CALIBRATION_STEPS[calibration['step']]
+        if QMessageBox.information(self, "Calibrate", text, QMessageBox.Ok | QMessageBox.Cancel) != QMessageBox.Ok:
+            self.calibration = None
+            return
+        calibration['pending'] = set(calibration['devices'])
+        for device in calibration['devices']:
+            self.devices.link(device).calibrate(step, calibration['ohm'] if step == "reference" else None)
+
+    def calibration_ack(self, device, status):
+        calibration = self.calibration
+        if device not in calibration['pending']:
+            return
+        if status != STATUS_OK:
+            self.calibration = None
+            step = CALIBRATION_STEPS[calibration['step']][0]
+            QMessageBox.warning(self, "Calibrate", "{0}: the {1} step failed, check the test points and start "
+                                                   "again.".format(device, step))
+            return
+        calibration['pending'].discard(device)
+        if calibration['pending']:
+            return
+        calibration['step'] += 1
+        if calibration['step'] < len(CALIBRATION_STEPS):
+            self.calibration_step()
+        else:
+            self.calibration = None
+            QMessageBox.information(self, "Calibrate", "Calibration stored on " + ", ".join(calibration['devices']))
 
     def select_port(self):
+        # For testers behind a USB bridge discover_ports does not know
         ports = [port.device for port in serial.tools.list_ports.comports()]
-        port, ok = QInputDialog.getItem(self, "Select COM Port", "COM Port:", ports, 0, False)
-        if ok and port:
-            self.serial_thread.set_serial_port(port)
+        port, ok = QInputDialog.getItem(self, "Add COM Port", "COM Port:", ports, 0, False)
+        if ok and port and port not in self.manual_ports:
+            self.manual_ports.append(port)
+            self.scan_devices()
 
     def set_wifi_credentials(self):
         dialog = QDialog(self)
@@ -127,12 +309,19 @@ class MainWindow(QMainWindow):
         if dialog.exec_() == QDialog.Accepted:
             ssid = ssid_edit.text()
             password = password_edit.text()
-            self.send_data(f"SSID:{ssid},PASSWORD:{password}")
+            for device in self.selected_devices():
+                self.devices.link(device).set_wifi(ssid, password)
 
             credentials = base64.b64encode(ssid.encode()).decode() + "::" + base64.b64encode(password.encode()).decode()
             with open(self.credentials_file, "w") as f:
                 f.write(credentials)
 
+    def closeEvent(self, event):
+        self.devices.stop()
+        if self.batch is not None:
+            self.batch.finish()
+        super(MainWindow, self).closeEvent(event)
+
 
 def main():
     app = QApplication(sys.argv)
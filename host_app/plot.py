@@ -0,0 +1,261 @@
+import numpy as np
+from PyQt5.QtWidgets import QWidget
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPainter, QPen, QPolygonF
+
+
+class RingBuffer:
+    def __init__(self, capacity):
+        """
+        Fixed size store of (time, value) samples; once full the oldest
+        samples are overwritten.
+
+        Args:
+            capacity (int): Number of samples kept.
+        """
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def extend(self, times, values):
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if len(times) > self.capacity:
+            times = times[-self.capacity:]
+            values = values[-self.capacity:]
+        n = len(times)
+        end = self.head + n
+        if end <= self.capacity:
+            self.times[self.head:end] = times
+            self.values[self.head:end] = values
+        else:
+            first = self.capacity - self.head
+            self.times[self.head:] = times[:first]
+            self.values[self.head:] = values[:first]
+            self.times[:n - first] = times[first:]
+            self.values[:n - first] = values[first:]
+        self.head = end % self.capacity
+        self.count = min(self.capacity, self.count + n)
+
+    def segments(self):
+        """
+        The samples in time order as at most two (times, values) views,
+        without copying.
+        """
+        if self.count < self.capacity:
+            return [(self.times[:self.count], self.values[:self.count])]
+        if self.head == 0:
+            return [(self.times, self.values)]
+        return [(self.times[self.head:], self.values[self.head:]),
+                (self.times[:self.head], self.values[:self.head])]
+
+    def arrays(self):
+        segments = self.segments()
+        if len(segments) == 1:
+            return segments[0]
+        return np.concatenate((segments[0][0], segments[1][0])), np.concatenate((segments[0][1], segments[1][1]))
+
+
+def decimate_minmax(times, values, t0, t1, width):
+    """
+    Reduces samples to the lowest and highest value per pixel column, so
+    drawing costs at most two points per column however many samples
+    there are. Peaks and glitches stay visible, unlike with plain
+    subsampling.
+
+    Args:
+        times (ndarray): Sample times, ascending.
+        values (ndarray): Sample values.
+        t0 (float): Time at the left edge.
+        t1 (float): Time at the right edge.
+        width (int): Number of pixel columns.
+
+    Returns:
+        tuple: (columns, lows, highs), one entry per column with samples.
+    """
+    if not len(times):
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    scale = (width - 1) / (t1 - t0) if t1 > t0 else 0.0
+    columns = ((times - t0) * scale).astype(np.int64)
+    np.clip(columns, 0, width - 1, out=columns)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(columns)) + 1))
+    return columns[starts], np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)
+
+
+def fit_exponential(times, values):
+    """
+    Fits v = final - amplitude * exp(-t / tau) to a uniformly sampled
+    charge, discharge or inductor current curve. The final value comes
+    from the means of three equally spaced windows, which form a geometric
+    sequence for any exponential; tau and the amplitude from a least
+    squares line through ln|final - v|.
+
+    Returns:
+        tuple: (final, amplitude, tau), None if the curve is not exponential.
+    """
+    if len(times) < 16:
+        return None
+    window = len(times) // 5
+    y1 = values[:window].mean()
+    y2 = values[2 * window:3 * window].mean()
+    y3 = values[4 * window:5 * window].mean()
+    denominator = y1 + y3 - 2 * y2
+    if abs(denominator) < 1e-12 * max(abs(y1), abs(y3), 1):
+        return None
+    final = (y1 * y3 - y2 * y2) / denominator
+    sign = 1.0 if final > y1 else -1.0
+    remaining = sign * (final - values)
+    # Samples within 5 % of the final value are dominated by noise in the log
+    used = remaining > 0.05 * abs(final - y1)
+    if used.sum() < 3:
+        return None
+    slope, intercept = np.polyfit(times[used], np.log(remaining[used]), 1)
+    if slope >= 0:
+        return None
+    return final, sign * np.exp(intercept), -1 / slope
+
+
+def polygon(x, y):
+    """
+    A QPolygonF filled from two arrays through its memory, without a
+    QPointF per point.
+    """
+    points = QPolygonF(len(x))
+    memory = points.data()
+    memory.setsize(16 * len(x))
+    coordinates = np.frombuffer(memory, dtype=np.float64)
+    coordinates[0::2] = x
+    coordinates[1::2] = y
+    return points
+
+
+def exponential(times, fit):
+    final, amplitude, tau = fit
+    return final - amplitude * np.exp(-times / tau)
+
+
+class CurvePlot(QWidget):
+    def __init__(self, capacity=131072, parent=None):
+        """
+        Live plot of streamed samples with the fitted exponential drawn
+        over them.
+
+        Args:
+            capacity (int): Samples kept in the ring buffer.
+            parent (QWidget): The parent widget.
+        """
+        super(CurvePlot, self).__init__(parent)
+        self.ring = RingBuffer(capacity)
+        self.fit = None
+        self.setMinimumHeight(300)
+
+    def clear(self):
+        self.ring.clear()
+        self.fit = None
+        self.update()
+
+    def append(self, times, values):
+        """
+        Adds streamed samples. The repaint is only scheduled, Qt merges
+        the requests into one per frame.
+        """
+        self.ring.extend(times, values)
+        self.update()
+
+    def show_curve(self, times, values):
+        """
+        Replaces the plot with a complete curve and fits it.
+        """
+        self.ring.clear()
+        self.ring.extend(times, values)
+        self.fit = fit_exponential(*self.ring.arrays())
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        segments = self.ring.segments()
+        if len(self.ring) < 2:
+            return
+        width = max(2, self.width())
+        height = self.height()
+        t0 = segments[0][0][0]
+        t1 = segments[-1][0][-1]
+
+        columns = []
+        lows = []
+        highs = []
+        for times, values in segments:
+            decimated = decimate_minmax(times, values, t0, t1, width)
+            columns.append(decimated[0])
+            lows.append(decimated[1])
+            highs.append(decimated[2])
+        columns = np.concatenate(columns)
+        lows = np.concatenate(lows)
+        highs = np.concatenate(highs)
+        v0 = lows.min()
+        v1 = highs.max()
+        if v1 <= v0:
+            v1 = v0 + 1
+        scale = (height - 20) / (v1 - v0)
+
+        # Down to the column minimum and up to its maximum, column by column
+        x = np.repeat(columns, 2).astype(float)
+        y = np.empty(len(x))
+        y[0::2] = height - 10 - (lows - v0) * scale
+        y[1::2] = height - 10 - (highs - v0) * scale
+        painter.setPen(QPen(Qt.darkBlue, 1))
+        painter.drawPolyline(polygon(x, y))
+
+        if self.fit is not None:
+            times = np.linspace(t0, t1, width)
+            y = height - 10 - (exponential(times, self.fit) - v0) * scale
+            painter.setPen(QPen(Qt.red, 1, Qt.DashLine))
+            painter.drawPolyline(polygon(np.arange(width), y))
+            painter.drawText(10, 20, "fit: tau = {0:.1f} us".format(self.fit[2]))
+
+
+class Histogram(QWidget):
+    def __init__(self, title, parent=None):
+        """
+        Bar chart of a histogram, e.g. of the measurement times of a batch.
+
+        Args:
+            title (str): Drawn above the bars, with the unit of the bins.
+            parent (QWidget): The parent widget.
+        """
+        super(Histogram, self).__init__(parent)
+        self.title = title
+        self.counts = np.zeros(0)
+        self.edges = np.zeros(0)
+        self.setMinimumHeight(120)
+
+    def set_histogram(self, counts, edges):
+        self.counts = counts
+        self.edges = edges
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        painter.drawText(10, 15, self.title)
+        if not len(self.counts) or self.counts.max() == 0:
+            return
+        width = self.width() / len(self.counts)
+        scale = (self.height() - 40) / self.counts.max()
+        painter.setPen(Qt.darkBlue)
+        for i, count in enumerate(self.counts.tolist()):
+            height = count * scale
+            painter.fillRect(int(i * width), int(self.height() - 20 - height), max(1, int(width) - 1), int(height), Qt.darkBlue)
+        painter.setPen(Qt.black)
+        painter.drawText(2, self.height() - 4, "{0:.2f}".format(self.edges[0]))
+        painter.drawText(self.width() - 60, self.height() - 4, "{0:.2f}".format(self.edges[-1]))
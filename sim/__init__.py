@@ -0,0 +1,6 @@
+"""
+Host-side stand-ins for running the firmware in src/ under CPython.
+
+The modules in sim/stubs replace the MicroPython-only imports (machine,
+network, ujson, uos) and sim.runtime loads conf.py and main.py against them.
+"""
@@ -0,0 +1,70 @@
+"""
+Bytes and requests per second for a client polling the result: the HTML
+page, the JSON API, and the JSON API with If-None-Match while nothing
+changes. A single keep-alive connection against the firmware server.
+
+Run from the repository root:
+    python -m sim.bench_api
+"""
+
+import asyncio
+import os
+import time
+
+from sim.bench_http import read_response
+from sim.circuit import board, Resistor
+from sim.runtime import SRC, load_firmware
+
+POLLS = 500
+
+
+async def poll(port, request, etag=False):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    received = 0
+    tag = None
+    start = time.perf_counter()
+    for _ in range(POLLS):
+        if etag and tag is not None:
+            writer.write(request + b'If-None-Match: ' + tag + b'\r\n\r\n')
+        else:
+            writer.write(request + b'\r\n')
+        head, body = await read_response(reader, True)
+        received += len(head) + len(body)
+        for line in head.split(b'\r\n'):
+            if line.lower().startswith(b'etag:'):
+                tag = line.split(b':', 1)[1].strip()
+    elapsed = time.perf_counter() - start
+    writer.close()
+    await writer.wait_closed()
+    return received / POLLS, POLLS / elapsed
+
+
+async def run(firmware):
+    server = await firmware.start_server('127.0.0.1', 0)
+    port = server.server.sockets[0].getsockname()[1]
+    rows = [
+        ('HTML page', await poll(port, b'GET / HTTP/1.1\r\nHost: tester\r\n')),
+        ('JSON', await poll(port, b'GET /api/v1/measurement HTTP/1.1\r\nHost: tester\r\n')),
+        ('JSON + ETag', await poll(port, b'GET /api/v1/measurement HTTP/1.1\r\nHost: tester\r\n', True)),
+    ]
+    while server.open_connections:
+        await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+    return rows
+
+
+def main():
+    conf, firmware = load_firmware()
+    os.chdir(SRC)
+    board.insert(0, 1, Resistor(1000))
+    firmware.measure_phase()
+    print(firmware.measurement_json.decode())
+
+    print('{0:>12} {1:>15} {2:>12}'.format('poll', 'bytes/poll', 'polls/s'))
+    for name, (size, rate) in asyncio.run(run(firmware)):
+        print('{0:>12} {1:>15.0f} {2:>12.0f}'.format(name, size, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Batch mode result log: appends and reloads of the columnar log, flushed
+every row and in chunks, against a CSV file with the same rows, rows kept
+when host_app dies without closing the log, recovery from a torn chunk,
+a lot run twice getting a second directory, and the batch statistics over
+a simulated lot with a part swapped every 3 s.
+
+Run from the repository root:
+    python -m sim.bench_batch
+"""
+
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'host_app'))
+from batch import BatchSpec, BatchRun, ResultLog, LOG_COLUMNS, new_lot_directory
+
+ROWS = 100000
+
+
+def rows(n, rng):
+    for i in range(n):
+        value = 1000 * rng.gauss(1, 0.03)
+        yield {'time': 1700000000 + i * 3.0, 'seq': i, 'component': 1, 'value': value,
+               'duration_us': rng.randint(5000, 9000), 'passed': abs(value - 1000) <= 50}
+
+
+def bench_log(directory):
+    rng = random.Random(1)
+    data = list(rows(ROWS, rng))
+
+    chunked = ResultLog(os.path.join(directory, 'chunked'), 256)
+    start = time.perf_counter()
+    for row in data:
+        chunked.append(**row)
+    chunked.close()
+    chunked_s = time.perf_counter() - start
+
+    log = ResultLog(os.path.join(directory, 'columnar'))
+    start = time.perf_counter()
+    for row in data:
+        log.append(**row)
+    log.close()
+    append_s = time.perf_counter() - start
+    start = time.perf_counter()
+    columns = ResultLog(os.path.join(directory, 'columnar')).load()
+    load_s = time.perf_counter() - start
+    assert len(columns['value']) == ROWS and columns['seq'][-1] == ROWS - 1
+    size = sum(os.path.getsize(log.path(name)) for name, _ in LOG_COLUMNS)
+
+    path = os.path.join(directory, 'log.csv')
+    names = [name for name, _ in LOG_COLUMNS]
+    start = time.perf_counter()
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, names)
+        for row in data:
+            writer.writerow(row)
+    csv_append_s = time.perf_counter() - start
+    start = time.perf_counter()
+    with open(path, newline='') as file:
+        parsed = [(float(r[0]), int(r[1]), int(r[2]), float(r[3]), int(r[4]), r[5] == 'True') for r in csv.reader(file)]
+    csv_load_s = time.perf_counter() - start
+    assert len(parsed) == ROWS
+
+    print('{0} rows        append      reload    size'.format(ROWS))
+    print('columnar log   {0:6.0f} ms  {1:7.1f} ms  {2:5.0f} kB'.format(append_s * 1000, load_s * 1000, size / 1000))
+    print('  256 row chunks {0:4.0f} ms'.format(chunked_s * 1000))
+    print('CSV            {0:6.0f} ms  {1:7.1f} ms  {2:5.0f} kB'.format(csv_append_s * 1000, csv_load_s * 1000,
+                                                                      os.path.getsize(path) / 1000))
+
+    # Rows appended by a host_app that then dies are on disk without a close
+    crashed = ResultLog(os.path.join(directory, 'crashed'))
+    for row in data[:10]:
+        crashed.append(**row)
+    assert len(ResultLog(os.path.join(directory, 'crashed')).load()['seq']) == 10
+    crashed.close()
+    print('no close: 10 of 10 appended rows reloaded')
+
+    # A crash while a chunk was being appended leaves the columns uneven
+    with open(log.path('value'), 'ab') as file:
+        file.write(b'\0' * 8 * 3)
+    columns = ResultLog(os.path.join(directory, 'columnar')).load()
+    assert all(len(column) == ROWS for column in columns.values())
+    print('torn chunk: extra rows in one column dropped, {0} rows aligned'.format(ROWS))
+
+
+def bench_batch(directory):
+    rng = random.Random(2)
+    spec = BatchSpec('L42', 'RC0805-1K', 'resistor', 1000, 5)
+    run = BatchRun(spec, ResultLog(new_lot_directory(directory, 'L42')))
+    now = 0.0
+    seq = 0
+    for part in range(200):
+        # Empty fixture while the part is swapped, then a few results of
+        # the same part until the next swap
+        for present in [False] * 2 + [True] * 4:
+            seq += 1
+            now += 0.5
+            value = 1000 * rng.gauss(1, 0.03)
+            result = {'seq': seq, 'component': 'resistor' if present else None,
+                      'values': {'resistance': value}, 'duration_us': rng.randint(5000, 9000)}
+            run.add_result(result, now)
+    run.finish()
+    counts, edges = run.duration_histogram(8)
+    print('lot of {0} parts, {1} results: yield {2:.1f} %, {3:.1f} parts/min'.format(
+        run.tested, seq, run.yield_pct(), run.parts_per_minute()))
+    print('measurement time histogram (ms): ' + ' '.join('{0:.1f}:{1}'.format(edge, count)
+                                                       for edge, count in zip(edges[:-1], counts)))
+    assert len(run.log.load()['passed']) == 200
+
+    # The same lot again gets its own directory, the first spec is kept
+    again = new_lot_directory(directory, 'L42')
+    assert again == os.path.join(directory, 'L42-2')
+    try:
+        BatchRun(spec, ResultLog(os.path.join(directory, 'L42')))
+    except FileExistsError:
+        pass
+    else:
+        raise AssertionError('spec.json of a lot replaced')
+    BatchRun(spec, ResultLog(again)).finish()
+    print('lot run twice: logged to {0}, the first run left alone'.format(os.path.basename(again)))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        bench_log(directory)
+        bench_batch(directory)
+
+
+if __name__ == '__main__':
+    main()
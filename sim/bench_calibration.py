@@ -0,0 +1,256 @@
+"""
+ADC calibration of the test points: ADCs with offset, gain, bow and a
+compressed top, and pins of different output resistance, read and
+measured before and after the open, short and reference steps. Prints the
+ADC error over the range, the resistor and diode accuracy, the size of the
+stored calibration, the time to load it at boot, the cost of correcting a
+sample, and runs the steps over serial as host_app does.
+
+Run from the repository root:
+    python -m sim.bench_calibration
+"""
+
+import asyncio
+import io
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import timeit
+import tty
+
+from sim.circuit import board, Resistor, Short, Diode, VCC
+from sim.runtime import load_firmware
+
+from host_app.link import DeviceLink
+from protocol import MSG_ACK, MSG_CALIBRATE, STATUS_OK, STATUS_ERROR
+
+# Transfer error of each ADC: offset, gain and bow in microvolts, the slope
+# halves above the knee
+ADC_ERRORS = ((60000, 1.02, 40000), (-30000, 0.97, -25000), (20000, 1.05, 60000))
+KNEE_UV = 3000000
+PIN_RES = (28, 46, 35)
+REFERENCE_OHM = 47
+PAIRS = ((0, 1), (1, 2), (2, 0), (1, 0), (2, 1), (0, 2))
+RESISTORS = (10, 22, 47, 100, 220, 470, 1000, 2200, 4700, 10000, 22000, 47000, 100000)
+DIODES = ((0.3, 10), (0.65, 10), (0.7, 25), (1.8, 5), (2.1, 8))
+CALLS = 200000
+
+
+def adc_sweep(firmware, conf):
+    """
+    Largest and RMS difference in mV between get_uv() and the node voltage
+    of each test point, over a resistor divider swept across the range.
+    Raw readings in the first table entry are left out: below its offset an
+    ADC reads 0 whatever the voltage, and the table maps 0 to 0.
+    """
+    from calibration import CAL_SHIFT
+    tps = (firmware.tp1, firmware.tp2, firmware.tp3)
+    adc_pins = (conf.adc_tp1, conf.adc_tp2, conf.adc_tp3)
+    errors = [[], [], []]
+    for step in range(60):
+        resistance = 10 ** (step / 12)
+        for x, y in PAIRS[:3]:
+            board.insert(x, y, Resistor(resistance))
+            for high, low in ((x, y), (y, x)):
+                tps[high].drive(0, 1, 0)
+                tps[low].drive(-1, 0, 0)
+                for i in (high, low):
+                    tps[i].settle()
+                    if tps[i].adc.read_uv() >= 1 << CAL_SHIFT:
+                        errors[i].append(tps[i].get_uv() - board.read_uv(adc_pins[i]))
+                tps[high].set_pins_floating()
+                tps[low].set_pins_floating()
+    board.remove()
+    return [(max(abs(e) for e in tp) / 1000, math.sqrt(sum(e * e for e in tp) / len(tp)) / 1000) for tp in errors]
+
+
+def diode_truth(x, y, forward_voltage, on_resistance):
+    current = (VCC - forward_voltage) / (on_resistance + 680 + PIN_RES[x] + PIN_RES[y])
+    return forward_voltage + on_resistance * current
+
+
+def accuracy(firmware):
+    """
+    measure_phase() over RESISTORS and DIODES on every pair.
+
+    Returns:
+        tuple: (resistors found, worst relative error of those, diodes
+            found, worst forward voltage error of those in mV).
+    """
+    found_r, worst_r = 0, 0.0
+    found_d, worst_vf = 0, 0.0
+    for x, y in PAIRS:
+        for resistance in RESISTORS:
+            board.insert(x, y, Resistor(resistance))
+            firmware.measure_phase()
+            result = json.loads(firmware.measurement_json)
+            if result['component'] == 'resistor':
+                found_r += 1
+                worst_r = max(worst_r, abs(result['values']['resistance'] - resistance) / resistance)
+        for forward_voltage, on_resistance in DIODES:
+            board.insert(x, y, Diode(forward_voltage, on_resistance))
+            firmware.measure_phase()
+            result = json.loads(firmware.measurement_json)
+            if result['component'] == 'diode':
+                found_d += 1
+                error = abs(result['values']['forward_voltage'] - diode_truth(x, y, forward_voltage, on_resistance))
+                worst_vf = max(worst_vf, error * 1000)
+    board.remove()
+    return found_r, worst_r, found_d, worst_vf
+
+
+def calibrate(firmware):
+    board.remove()
+    assert firmware.calibrate('open') == STATUS_OK
+    board.connect(0, 1, Short())
+    board.connect(1, 2, Short())
+    assert firmware.calibrate('short') == STATUS_OK
+    # Readings without an estimate of a pin resistance solve into nothing
+    from calibration import solve
+    readings = firmware.calibration_readings
+    assert solve(readings['open'], readings['short'], [], REFERENCE_OHM, firmware.pin_res, firmware.supply_uv)[0] is None
+    board.remove()
+    board.insert(0, 1, Resistor(REFERENCE_OHM))
+    assert firmware.calibrate('reference', REFERENCE_OHM) == STATUS_OK
+    board.remove()
+
+
+def correction_cost(firmware):
+    """ns per sample to correct a reading: table, float map, nothing."""
+    from calibration import CAL_SHIFT, CAL_MASK, correct
+    tp = firmware.tp1
+    knots = firmware.calibration.points[0][1]
+    values = [int(i * 3300000 / 1000) for i in range(1000)]
+    setup = {'values': values, 'table': tp.table, 'shift': CAL_SHIFT, 'mask': CAL_MASK, 'knots': knots,
+             'correct': correct}
+    table = timeit.timeit('for uv in values:\n k = uv >> shift\n low = table[k]\n'
+                          ' x = low + (((table[k + 1] - low) * (uv & mask)) >> shift)',
+                          globals=setup, number=CALLS // 1000)
+    float_map = timeit.timeit('for uv in values:\n x = correct(knots, uv)', globals=setup, number=CALLS // 1000)
+    raw = timeit.timeit('for uv in values:\n x = uv', globals=setup, number=CALLS // 1000)
+    return [seconds * 1e9 / CALLS for seconds in (table, float_map, raw)]
+
+
+def serial_steps(firmware):
+    """
+    The steps sent by host_app, the board changed after every ACK. Also a
+    reference step without the ones before it, which is refused.
+    """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    link = DeviceLink(io.FileIO(master, 'r+b', closefd=False))
+    acks = []
+    setups = (
+        ('reference', lambda: board.insert(0, 1, Resistor(REFERENCE_OHM))),
+        ('open', board.remove),
+        ('short', lambda: (board.connect(0, 1, Short()), board.connect(1, 2, Short()))),
+        ('reference', lambda: (board.remove(), board.insert(0, 1, Resistor(REFERENCE_OHM)))),
+    )
+
+    def host():
+        for step, setup in setups:
+            setup()
+            link.calibrate(step, REFERENCE_OHM if step == 'reference' else None)
+            start = time.perf_counter()
+            while len(acks) < len(setups) and time.perf_counter() - start < 10:
+                done = False
+                for kind, value in link.read():
+                    if kind == MSG_ACK and value[0] == MSG_CALIBRATE:
+                        acks.append((step, value[1], time.perf_counter() - start))
+                        done = True
+                if done:
+                    break
+
+    async def run():
+        task = asyncio.create_task(firmware.serial_loop(io.FileIO(slave, 'rb', closefd=False),
+                                                        io.FileIO(slave, 'wb', closefd=False)))
+        thread = threading.Thread(target=host)
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    firmware.init_serial()
+    asyncio.run(run())
+    os.close(master)
+    os.close(slave)
+    board.remove()
+    return acks
+
+
+def main():
+    conf, firmware = load_firmware()
+    import machine
+    adc_pins = (conf.adc_tp1, conf.adc_tp2, conf.adc_tp3)
+    directory = tempfile.mkdtemp()
+    firmware.calibration_file = os.path.join(directory, 'calibration.bin')
+    firmware.init_calibration()
+
+    ideal = accuracy(firmware)
+    for i in range(3):
+        offset_uv, gain, bow_uv = ADC_ERRORS[i]
+        machine.adc_errors[adc_pins[i]] = machine.AdcError(offset_uv, gain, bow_uv, KNEE_UV)
+        board.set_pin_res(i, PIN_RES[i])
+    raw_adc = adc_sweep(firmware, conf)
+    uncalibrated = accuracy(firmware)
+
+    start = time.perf_counter()
+    calibrate(firmware)
+    solve_ms = (time.perf_counter() - start) * 1000
+    size = os.path.getsize(firmware.calibration_file)
+    pin_res = [tp.pin_res for tp in (firmware.tp1, firmware.tp2, firmware.tp3)]
+
+    # As at boot, from the file
+    for tp in (firmware.tp1, firmware.tp2, firmware.tp3):
+        tp.set_calibration(None, conf.pin_res)
+    start = time.perf_counter()
+    firmware.init_calibration()
+    load_ms = (time.perf_counter() - start) * 1000
+    assert [tp.pin_res for tp in (firmware.tp1, firmware.tp2, firmware.tp3)] == [
+        firmware.calibration.points[i][0] for i in range(3)]
+    calibrated_adc = adc_sweep(firmware, conf)
+    calibrated = accuracy(firmware)
+
+    print('ADC error above 16 mV, max / rms mV    uncalibrated      calibrated')
+    for i in range(3):
+        print('  TP{0}                             {1:7.1f} / {2:5.1f}   {3:6.1f} / {4:5.1f}'.format(
+            i + 1, raw_adc[i][0], raw_adc[i][1], calibrated_adc[i][0], calibrated_adc[i][1]))
+    print('pin resistance: set {0}, found {1}'.format(list(PIN_RES), [round(r, 2) for r in pin_res]))
+    total_r = len(PAIRS) * len(RESISTORS)
+    total_d = len(PAIRS) * len(DIODES)
+    print('{0} resistors 10 ohm - 100k and {1} diodes, found / worst error of those found'.format(total_r, total_d))
+    for name, (found_r, worst_r, found_d, worst_vf) in (('ideal ADC', ideal), ('uncalibrated', uncalibrated),
+                                                        ('calibrated', calibrated)):
+        print('  {0:<14} resistors {1:3} / {2:6.2%}   diodes {3:3} / {4:5.1f} mV'.format(
+            name, found_r, worst_r, found_d, worst_vf))
+    print('calibration: {0} bytes in flash, {1} knots, solved in {2:.0f} ms, loaded at boot in {3:.1f} ms '
+          '(wall, CPython)'.format(size, [len(p[1]) for p in firmware.calibration.points], solve_ms, load_ms))
+    table_ns, float_ns, raw_ns = correction_cost(firmware)
+    print('correcting a sample: table {0:.0f} ns, float map {1:.0f} ns, uncorrected {2:.0f} ns (CPython)'.format(
+        table_ns, float_ns, raw_ns))
+
+    acks = serial_steps(firmware)
+    print('over serial: ' + ', '.join('{0} {1} in {2:.0f} ms'.format(step, 'OK' if status == STATUS_OK else 'refused',
+                                                                      seconds * 1000)
+                                      for step, status, seconds in acks))
+    assert [status for _, status, _ in acks] == [STATUS_ERROR, STATUS_OK, STATUS_OK, STATUS_OK]
+
+    assert all(abs(pin_res[i] - PIN_RES[i]) < 1 for i in range(3))
+    assert max(error[0] for error in calibrated_adc) < 10
+    assert calibrated[0] == total_r and calibrated[2] == total_d
+    assert calibrated[1] < 0.02 and calibrated[3] < 10
+
+    assert firmware.calibrate('clear') == STATUS_OK
+    assert not firmware.tp1.is_calibrated() and not os.path.exists(firmware.calibration_file)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
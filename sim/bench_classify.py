@@ -0,0 +1,92 @@
+"""
+Virtual time to a result for the probe-first measure_phase() against the
+previous pipeline (resistance, diode and capacitance passes on every
+pair), with the class and confidence the probe reports.
+
+Run from the repository root:
+    python -m sim.bench_classify
+"""
+
+import contextlib
+import io
+
+from sim.circuit import board, Resistor, Capacitor, Diode
+from sim.clock import clock
+from sim.runtime import load_firmware
+
+PARTS = [
+    ('open', None, None),
+    ('short TP1-TP2', (0, 1), Resistor(0.05)),
+    ('100R TP1-TP2', (0, 1), Resistor(100)),
+    ('1k TP1-TP2', (0, 1), Resistor(1000)),
+    ('47k TP2-TP3', (1, 2), Resistor(47000)),
+    ('1M TP1-TP3', (0, 2), Resistor(1000000)),
+    ('diode TP1-TP2', (0, 1), Diode(0.65)),
+    ('diode TP3-TP1', (2, 0), Diode(0.65)),
+    ('LED TP2-TP3', (1, 2), Diode(1.9)),
+    ('1nF TP1-TP2', (0, 1), Capacitor(1 * 10**-9)),
+    ('100nF TP1-TP3', (0, 2), Capacitor(100 * 10**-9)),
+    ('10uF TP2-TP3', (1, 2), Capacitor(10 * 10**-6)),
+    ('1000uF TP1-TP2', (0, 1), Capacitor(1000 * 10**-6)),
+]
+
+
+def full_pipeline(firmware):
+    """
+    The previous pipeline: the auto-ranging resistance and the diode test
+    on every pair, then a charge curve on the pairs that read open until
+    one holds a capacitor.
+    """
+    tps = (firmware.tp1, firmware.tp2, firmware.tp3)
+    open_pairs = []
+    for x, y in firmware.scan_pair_indices:
+        resistance = firmware.measure_resistance_auto(tps[x], tps[y]).get_resistance()
+        readings = {}
+        firmware.run_scan_plan([(x, 1, y, 0), (y, 1, x, 0)], readings)
+        if resistance >= firmware.resistance_range_limit and not firmware.pair_diode(readings, x, y)[0]:
+            open_pairs.append((x, y))
+    for tp in tps:
+        tp.set_pins_floating()
+    for x, y in open_pairs:
+        if firmware.measure_capacitance_test(tps[x], tps[y]):
+            break
+
+
+def quiet(function, *args):
+    # The firmware prints results and curves on the serial console
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def fresh(pair, part):
+    if part is None:
+        board.remove()
+        return
+    if isinstance(part, Capacitor):
+        part.voltage = 0.0
+    board.insert(pair[0], pair[1], part)
+
+
+def main():
+    conf, firmware = load_firmware()
+    print('{0:>15} {1:>14} {2:>12} {3:>11} {4:>10} {5:>11} {6:>6}'.format(
+        'part', 'previous (us)', 'probes (us)', 'total (us)', 'class', 'component', 'conf'))
+    for name, pair, part in PARTS:
+        fresh(pair, part)
+        start = clock.now_us
+        quiet(full_pipeline, firmware)
+        previous = clock.now_us - start
+
+        fresh(pair, part)
+        start = clock.now_us
+        result = quiet(firmware.measure_phase)
+        total = clock.now_us - start
+
+        probe = result.get_probe()
+        print('{0:>15} {1:>14} {2:>12} {3:>11} {4:>10} {5:>11} {6:>6.2f}'.format(
+            name, previous, result.get_probe_time_us(), total, probe.get_kind(),
+            str(result.get_component()), result.get_confidence()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+host_app DeviceManager with simulated testers on pty pairs. Each tester
+answers MSG_MEASURE after 5 to 15 ms; the main thread plays the UI: it
+drains the merged queue once per 60 Hz refresh and asks every tester for
+its next measurement, as batch mode does. Prints the result rate and the
+time the UI spends per refresh for 4, 16 and 32 testers, then unplugs one.
+
+Run from the repository root:
+    python -m sim.bench_devices
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'host_app'))
+from devices import DeviceManager
+from link import MSG_MEASURE, MSG_RESULT, FrameDecoder, write_frame
+from sim.bench_host_link import PtyPort, SlaveStream
+
+REFRESH_HZ = 60
+RUN_S = 3
+
+
+class TesterPort(PtyPort):
+    def close(self):
+        os.close(self.fd)
+
+
+def tester(fd, seed):
+    """A simulated tester: answers every MSG_MEASURE with a result."""
+    rng = random.Random(seed)
+    decoder = FrameDecoder(1024)
+    stream = SlaveStream(fd)
+    seq = 0
+    try:
+        while True:
+            n = os.readv(fd, [decoder.space()])
+            if not n:
+                return
+            decoder.commit(n)
+            frame = decoder.next()
+            while frame is not None:
+                if frame[0] == MSG_MEASURE:
+                    duration = rng.uniform(0.005, 0.015)
+                    time.sleep(duration)
+                    seq += 1
+                    result = {'seq': seq, 'component': 'resistor', 'values': {'resistance': rng.gauss(1000, 10)},
+                              'duration_us': int(duration * 1e6)}
+                    write_frame(stream, MSG_RESULT, json.dumps(result).encode())
+                frame = decoder.next()
+    except OSError:
+        # The host closed its end
+        return
+
+
+def run(count):
+    pairs = {}
+    for i in range(count):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        pairs['/dev/sim{0}'.format(i)] = (master, slave)
+        threading.Thread(target=tester, args=(slave, i), daemon=True).start()
+
+    manager = DeviceManager(lambda device: TesterPort(pairs[device][0], 1 / REFRESH_HZ), REFRESH_HZ)
+    manager.scan(sorted(pairs))
+    manager.measure(curve=False)
+
+    results = 0
+    ticks = []
+    start = time.perf_counter()
+    next_tick = start
+    while time.perf_counter() - start < RUN_S:
+        next_tick += 1 / REFRESH_HZ
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+        tick = time.perf_counter()
+        for device, batch in manager.drain():
+            for kind, value in batch:
+                if kind == MSG_RESULT:
+                    results += 1
+                    manager.measure([device], curve=False)
+        if len(ticks) % (REFRESH_HZ // 2) == 0:
+            manager.status()
+        ticks.append((time.perf_counter() - tick) * 1000)
+    elapsed = time.perf_counter() - start
+    ticks.sort()
+    print('{0:>2} testers: {1:6.0f} results/s ({2:.1f} per tester), UI per refresh p50 {3:.2f} ms, max {4:.2f} ms'.format(
+        count, results / elapsed, results / elapsed / count, ticks[len(ticks) // 2], ticks[-1]))
+    return manager, pairs
+
+
+def main():
+    for count in (4, 16):
+        manager, pairs = run(count)
+        manager.stop()
+    manager, pairs = run(32)
+
+    # Unplug one tester
+    device = sorted(pairs)[3]
+    os.close(pairs[device][1])
+    time.sleep(0.2)
+    state = [row for row in manager.status() if row['device'] == device][0]['state']
+    print('unplugged {0}: {1}'.format(device, state))
+    remaining = [d for d in sorted(pairs) if d != device]
+    manager.scan(remaining)
+    print('after rescan: {0} testers, {1} connected'.format(
+        len(manager.devices()), sum(row['state'] == 'connected' for row in manager.status())))
+    manager.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Part discharge before and between capacitance measurements: virtual time,
+polls and the charge left for capacitors of 1 nF to 4700 uF charged either
+way round, TP2 positive as the charge curve leaves them, next to the
+previous loop of 200 ms sleeps through 680 ohm. Also the highest current
+through the shunted pins, how fast a part that does not discharge is given
+up on, and measure_phase() of large electrolytics.
+
+Run from the repository root:
+    python -m sim.bench_discharge
+"""
+
+import json
+
+from sim.circuit import board, Capacitor, Source, VCC
+from sim.clock import clock, sleep_ms
+from sim.runtime import load_firmware
+
+CAPACITORS = (1 * 10**-9, 100 * 10**-9, 10 * 10**-6, 100 * 10**-6, 470 * 10**-6, 1000 * 10**-6, 4700 * 10**-6)
+# Charge left by capture_charge_curve(), one time constant
+CHARGE_V = 2.0856
+ELECTROLYTICS = (100 * 10**-6, 470 * 10**-6, 1000 * 10**-6)
+
+
+def legacy_discharge(tp_x, tp_y):
+    """The previous capacitor_discharge(): 200 ms sleeps through 680 ohm, at most 64."""
+    tp_x.set_r0_low()
+    tp_y.set_r1_low()
+    polls = 0
+    while tp_x.get_uv() > 160000 or tp_y.get_uv() > 160000:
+        sleep_ms(200)
+        polls += 1
+        if polls > 64:
+            return False, polls
+    return True, polls
+
+
+def label(capacitance):
+    if capacitance >= 10**-6:
+        return '{0:g}uF'.format(capacitance * 10**6)
+    return '{0:g}nF'.format(capacitance * 10**9)
+
+
+def discharge_times(firmware):
+    tp1, tp2 = firmware.tp1, firmware.tp2
+    peak = [0.0]
+    drive = tp2.drive
+
+    def watched_drive(r0, r1, r2):
+        # The part voltage when tp2 joins tp1 on the shunted pins
+        if r0 == -1 and (0, 1) in board.parts:
+            board.update()
+            peak[0] = max(peak[0], abs(board.v[1] - board.v[0]) / (tp1.pin_res + tp2.pin_res))
+        drive(r0, r1, r2)
+
+    tp2.drive = watched_drive
+    print('{0:>8} {1:>9}  {2:>22}  {3:>22}  {4:>10}'.format(
+        'part', 'TP2-TP1', 'discharge_part', 'previous loop', 'speedup'))
+    for capacitance in CAPACITORS:
+        for voltage in (CHARGE_V, -CHARGE_V):
+            # Capacitor voltages are TP1 - TP2
+            part = Capacitor(capacitance, -voltage)
+            board.insert(0, 1, part)
+            start = clock.now_us
+            result = firmware.discharge_part(tp1, tp2, firmware.log_capacitor)
+            new_us = clock.now_us - start
+            assert result.is_discharged(), result.get_summary()
+            assert abs(part.voltage) * 1000000 <= firmware.discharge_target_uv * 1.01
+
+            # The previous loop only ever saw a positive tp2
+            if voltage > 0:
+                board.insert(0, 1, Capacitor(capacitance, -voltage))
+                start = clock.now_us
+                legacy_ok, legacy_polls = legacy_discharge(tp1, tp2)
+                old_us = clock.now_us - start
+                legacy = '{0:9.1f} ms {1:3} polls'.format(old_us / 1000, legacy_polls)
+                speedup = '{0:9.1f}x'.format(old_us / new_us) if new_us else '-'
+            else:
+                legacy, speedup = '-', '-'
+            print('{0:>8} {1:>7.2f} V  {2:9.1f} ms {3:3} polls  {4:>22}  {5:>10}'.format(
+                label(capacitance), voltage, new_us / 1000, result.get_polls(), legacy, speedup))
+    tp2.drive = drive
+    board.remove()
+    limit = firmware.discharge_max_current_ua / 1000
+    print('highest current through the shunted pins: {0:.1f} mA (limit {1:.0f} mA)'.format(peak[0] * 1000, limit))
+    assert peak[0] * 1000 <= limit * 1.01
+
+
+def stuck(firmware):
+    """Parts that cannot be discharged: status and the time to find out."""
+    tp1, tp2 = firmware.tp1, firmware.tp2
+    for name, part in (('1.5 V cell', Source(1.5, 0.5)), ('2.5 V behind 1k', Source(2.5, 1000)),
+                       ('3.3 V rail', Source(VCC, 0.1)), ('1 F supercap', Capacitor(1.0, 2.0))):
+        board.insert(1, 0, part)
+        start = clock.now_us
+        result = firmware.discharge_part(tp1, tp2, firmware.log_capacitor)
+        print('{0:<16} {1:<13} after {2:8.1f} ms, {3} polls'.format(name, result.get_status(),
+                                                                 (clock.now_us - start) / 1000, result.get_polls()))
+        assert not result.is_discharged()
+        assert clock.now_us - start < 1000000
+    board.remove()
+
+
+def measure_phase(firmware):
+    for capacitance in ELECTROLYTICS:
+        board.insert(0, 1, Capacitor(capacitance, 0.0, 0.5))
+        start = clock.now_us
+        firmware.measure_phase()
+        elapsed = clock.now_us - start
+        result = json.loads(firmware.measurement_json)
+        measured = result['values']['capacitance_uf']
+        print('measure_phase {0:>7}: {1:7.1f} ms virtual, {2:.1f} uF ({3:+.2%})'.format(
+            label(capacitance), elapsed / 1000, measured, measured / (capacitance * 10**6) - 1))
+    board.remove()
+
+
+def main():
+    conf, firmware = load_firmware()
+    discharge_times(firmware)
+    stuck(firmware)
+    measure_phase(firmware)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Count Pin allocations and transitions per measure_phase().
+
+Run from the repository root:
+    python -m sim.bench_drive
+"""
+
+from sim.circuit import board, Resistor
+from sim.runtime import load_firmware
+
+
+def main():
+    conf, firmware = load_firmware()
+    import machine
+
+    board.insert(0, 1, Resistor(1000))
+    machine.reset_stats()
+    firmware.measure_phase()
+
+    stats = machine.stats
+    print('measure_phase() with 1k between TP1 and TP2')
+    print('  Pin allocations: {0}'.format(stats['pin_alloc']))
+    print('  Pin.init() calls: {0}'.format(stats['pin_init']))
+    print('  Pin.value() calls: {0}'.format(stats['pin_value']))
+    print('  Transitions: {0}'.format(stats['pin_init'] + stats['pin_value']))
+    print('  ADC reads: {0}'.format(stats['adc_read']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Measurement history on the local file system: appends through segment
+rotation, the RAM held by the index, boot time scan, page reads, recovery
+from a torn last write and a corrupted record, then pages fetched from the
+firmware over HTTP and over the serial protocol.
+
+Run from the repository root:
+    python -m sim.bench_history
+"""
+
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import tty
+
+from sim.bench_http import read_response
+from sim.circuit import board, Resistor
+from sim.runtime import SRC, load_firmware
+
+from host_app.link import DeviceLink
+from history import History, RECORD_SIZE, unpack_record
+from protocol import MSG_HISTORY
+
+APPENDS = 40000
+SEGMENT_RECORDS = 1024
+SEGMENTS = 32
+PAGE = 100
+MEASUREMENTS = 25
+
+
+def append_records(history, first, count):
+    for seq in range(first, first + count):
+        history.append(seq, 1700000000 + seq, 1500, 'capacitor', 'reactive', 0, 1, 10.0 + seq * 1e-4, 0.5, 40.0)
+
+
+def bench_store(directory):
+    tracemalloc.start()
+    history = History(directory, SEGMENT_RECORDS, SEGMENTS)
+    history.open()
+    start = time.perf_counter()
+    append_records(history, 1, APPENDS)
+    append_us = (time.perf_counter() - start) * 1e6 / APPENDS
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    kept = history.get_count()
+    assert SEGMENT_RECORDS * (SEGMENTS - 1) < kept <= SEGMENT_RECORDS * SEGMENTS
+    assert len(os.listdir(directory)) == SEGMENTS
+    print('append:            {0} records, {1:.1f} us each, {2} kept in {3} segments'.format(
+        APPENDS, append_us, kept, len(history.segments)))
+    print('history in RAM:    {0} bytes (index and buffers)'.format(index_bytes))
+
+    start = time.perf_counter()
+    reopened = History(directory, SEGMENT_RECORDS, SEGMENTS)
+    reopened.open()
+    open_ms = (time.perf_counter() - start) * 1000
+    assert reopened.segments == history.segments
+    print('boot scan:         {0:.2f} ms for {1} segments'.format(open_ms, len(reopened.segments)))
+
+    records = []
+    handler = lambda page, offset: records.append(unpack_record(page, offset))
+    start = time.perf_counter()
+    n = reopened.read(reopened.get_next_seq() - PAGE, PAGE, handler)
+    page_ms = (time.perf_counter() - start) * 1000
+    assert n == PAGE and records[-1]['seq'] == APPENDS
+    records = []
+    start = time.perf_counter()
+    n = reopened.read(reopened.get_first_seq() + SEGMENT_RECORDS - PAGE // 2, PAGE, handler)
+    cross_ms = (time.perf_counter() - start) * 1000
+    assert n == PAGE and [r['seq'] for r in records] == list(range(records[0]['seq'], records[0]['seq'] + PAGE))
+    count = [0]
+    start = time.perf_counter()
+    reopened.read(0, APPENDS, lambda page, offset: count.__setitem__(0, count[0] + 1))
+    scan_ms = (time.perf_counter() - start) * 1000
+    print('read {0} records:  newest {1:.2f} ms, across segments {2:.2f} ms; all {3} in {4:.0f} ms'.format(
+        PAGE, page_ms, cross_ms, count[0], scan_ms))
+    print('record size:       {0} bytes, as JSON {1} bytes'.format(RECORD_SIZE, len(json.dumps(records[0]))))
+
+    # Power lost in the middle of a record
+    last = reopened.path(reopened.segments[-1][0])
+    with open(last, 'ab') as file:
+        file.write(b'\x01' * 13)
+    torn = History(directory, SEGMENT_RECORDS, SEGMENTS)
+    torn.open()
+    assert torn.get_next_seq() == APPENDS + 1
+    append_records(torn, APPENDS + 1, 10)
+    records = []
+    torn.read(APPENDS - 4, 15, handler)
+    assert [r['seq'] for r in records] == list(range(APPENDS - 4, APPENDS + 11))
+    print('torn last write:   whole records kept, appends continue in a new segment')
+
+    # A flipped bit in a stored record
+    with open(last, 'r+b') as file:
+        file.seek(5 * RECORD_SIZE + 20)
+        byte = file.read(1)
+        file.seek(5 * RECORD_SIZE + 20)
+        file.write(bytes((byte[0] ^ 0x10,)))
+    records = []
+    torn.read(torn.get_first_seq(), APPENDS, handler)
+    print('corrupted record:  {0} of {1} records rejected by the CRC'.format(records.count(None), len(records)))
+    assert records.count(None) == 1
+
+
+async def fetch(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET ' + path + b' HTTP/1.1\r\nHost: tester\r\n\r\n')
+    start = time.perf_counter()
+    response = await reader.read()
+    elapsed = (time.perf_counter() - start) * 1000
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return head, json.loads(body), elapsed
+
+
+async def bench_http(firmware):
+    server = await firmware.start_server('127.0.0.1', 0)
+    port = server.server.sockets[0].getsockname()[1]
+    head, page, elapsed = await fetch(port, b'/api/v1/history?limit=10')
+    assert head.startswith(b'HTTP/1.1 200')
+    assert [r['seq'] for r in page['records']] == list(range(page['next'] - 10, page['next']))
+    assert page['records'][-1]['values']['resistance'] > 900
+    print('HTTP newest 10:    {0:.1f} ms, seq {1}..{2}, {3}'.format(
+        elapsed, page['records'][0]['seq'], page['records'][-1]['seq'], page['records'][-1]['values']))
+    head, page, elapsed = await fetch(port, b'/api/v1/history?start=1&limit=1000')
+    assert len(page['records']) == min(firmware.history_page_max, page['next'] - page['first'])
+    print('HTTP start=1:      {0:.1f} ms, all {1} records'.format(elapsed, len(page['records'])))
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET /api/v1/history?limit=x HTTP/1.1\r\nHost: tester\r\n\r\n')
+    assert (await read_response(reader))[0] == 400
+    writer.close()
+    while server.open_connections:
+        await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+
+
+def bench_serial(firmware):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    link = DeviceLink(io.FileIO(master, 'r+b', closefd=False))
+    report = {}
+
+    def host():
+        link.request_history(0, 200)
+        start = time.perf_counter()
+        while 'history' not in report:
+            for kind, value in link.read():
+                if kind == MSG_HISTORY:
+                    report['history'] = value
+        report['ms'] = (time.perf_counter() - start) * 1000
+
+    async def run():
+        task = asyncio.create_task(firmware.serial_loop(io.FileIO(slave, 'rb', closefd=False),
+                                                        io.FileIO(slave, 'wb', closefd=False)))
+        thread = threading.Thread(target=host)
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    firmware.init_serial()
+    asyncio.run(run())
+    os.close(master)
+    os.close(slave)
+    first, following, records = report['history']
+    assert len(records) == min(firmware.history_frame_records, following - first)
+    assert records[-1]['seq'] == following - 1
+    print('serial newest:     {0:.1f} ms, {1} records in one frame, log {2}..{3}'.format(
+        report['ms'], len(records), first, following - 1))
+
+
+def bench_firmware(directory):
+    conf, firmware = load_firmware()
+    os.chdir(SRC)
+    firmware.history_directory = directory
+    firmware.init_history()
+    board.insert(0, 1, Resistor(1000))
+    for _ in range(MEASUREMENTS):
+        firmware.measure_phase()
+    last = firmware.measurement_sequence
+    # A reset: the sequence continues from the stored records
+    firmware.measurement_sequence = 0
+    firmware.init_history()
+    assert firmware.measurement_sequence == last
+    firmware.measure_phase()
+    assert json.loads(firmware.measurement_json)['seq'] == last + 1
+    print('firmware:          {0} measurements stored, seq {1} after a reset'.format(last, last + 1))
+    asyncio.run(bench_http(firmware))
+    bench_serial(firmware)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as scratch:
+        bench_store(os.path.join(scratch, 'store'))
+        bench_firmware(os.path.join(scratch, 'firmware'))
+
+
+if __name__ == '__main__':
+    main()
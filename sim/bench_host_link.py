@@ -0,0 +1,156 @@
+"""
+host_app serial reader over a pty loopback: a device thread writes result
+frames stamped with their write time, the LinkReader on the other end hands
+them on in batches. Prints the latency from device write to batch emission
+for sparse messages and for a burst, and the same for the previous
+readline() loop with its one second wait.
+
+Run from the repository root:
+    python -m sim.bench_host_link
+"""
+
+import fcntl
+import json
+import os
+import select
+import struct
+import termios
+import threading
+import time
+import tty
+
+from host_app.link import DeviceLink, LinkReader, MSG_RESULT, write_frame
+
+SPARSE = 100
+SPARSE_GAPS_S = (0.05, 0.01)
+BURST = 20000
+LEGACY = 4
+
+
+class PtyPort:
+    """The master end of a pty with the parts of pyserial DeviceLink uses."""
+
+    def __init__(self, fd, timeout):
+        self.fd = fd
+        self._timeout = timeout
+        self.timeout_changes = 0
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        # pyserial reconfigures the port on every assignment
+        self._timeout = value
+        self.timeout_changes += 1
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('i', fcntl.ioctl(self.fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def readinto(self, buffer):
+        if not select.select([self.fd], [], [], self.timeout)[0]:
+            return 0
+        return os.readv(self.fd, [buffer])
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+
+class SlaveStream:
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write(self, data):
+        view = memoryview(data).cast('B')
+        while view:
+            view = view[os.write(self.fd, view):]
+
+
+def device(fd, count, gap_s):
+    stream = SlaveStream(fd)
+    for i in range(count):
+        write_frame(stream, MSG_RESULT, json.dumps({'seq': i, 'sent': time.perf_counter()}).encode())
+        if gap_s:
+            time.sleep(gap_s)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_reader(master, slave, count, gap_s):
+    latencies = []
+    batches = []
+
+    def emit(batch):
+        now = time.perf_counter()
+        batches.append(len(batch))
+        for kind, value in batch:
+            latencies.append((now - value['sent']) * 1000)
+
+    port = PtyPort(master, 1 / 60)
+    link = DeviceLink(port)
+    reader = LinkReader(link, emit, 60)
+    writer = threading.Thread(target=device, args=(slave, count, gap_s))
+    start = time.perf_counter()
+    writer.start()
+    while len(latencies) < count:
+        reader.poll()
+    elapsed = time.perf_counter() - start
+    writer.join()
+    assert port.timeout_changes == 1, port.timeout_changes
+    return latencies, batches, elapsed, reader.counters()
+
+
+def run_legacy(master, slave, count):
+    """The previous SerialThread loop: per-byte readline, then a 1 s wait."""
+    latencies = []
+    sent = []
+
+    def write_lines():
+        for i in range(count):
+            sent.append(time.perf_counter())
+            os.write(slave, b'resistor: 1000\n')
+
+    writer = threading.Thread(target=write_lines)
+    writer.start()
+    for i in range(count):
+        line = b''
+        while not line.endswith(b'\n'):
+            line += os.read(master, 1)
+        latencies.append((time.perf_counter() - sent[i]) * 1000)
+        time.sleep(1.0)
+    writer.join()
+    return latencies
+
+
+def main():
+    master, slave = os.openpty()
+    tty.setraw(slave)
+
+    for gap_s in SPARSE_GAPS_S:
+        latencies, batches, elapsed, counters = run_reader(master, slave, SPARSE, gap_s)
+        print('sparse, {0} messages {1:.0f} ms apart: latency p50 {2:.2f} ms, p99 {3:.2f} ms, {4} batches'.format(
+            SPARSE, gap_s * 1000, percentile(latencies, 0.5), percentile(latencies, 0.99), len(batches)))
+
+    latencies, batches, elapsed, counters = run_reader(master, slave, BURST, 0)
+    print('burst, {0} messages: {1:.0f} msg/s, {2:.0f} kB/s, {3} batches (max {4} per batch)'.format(
+        BURST, BURST / elapsed, counters['bytes_s'] / 1000, len(batches), max(batches)))
+    print('    latency p50 {0:.1f} ms, p99 {1:.1f} ms, queued for batch max {2:.1f} ms'.format(
+        percentile(latencies, 0.5), percentile(latencies, 0.99), counters['queued_ms_max']))
+
+    latencies = run_legacy(master, slave, LEGACY)
+    print('readline + 1 s wait, {0} lines at once: latency {1}'.format(
+        LEGACY, ', '.join('{0:.0f} ms'.format(l) for l in latencies)))
+
+    os.close(master)
+    os.close(slave)
+
+
+if __name__ == '__main__':
+    main()
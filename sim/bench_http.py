@@ -0,0 +1,157 @@
+"""
+Load test of the firmware web server under CPython: concurrent keep-alive
+clients request the result page of a simulated 1k resistor and the
+requests per second and latencies are printed. Also checks the answers to
+an unsupported method, a malformed Content-Length, a handler failing
+before and halfway through its response and a 204.
+
+Run from the repository root:
+    python -m sim.bench_http [clients] [requests per client]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from sim.circuit import board, Resistor
+from sim.runtime import SRC, load_firmware
+
+REQUEST = b'GET / HTTP/1.1\r\nHost: tester\r\n\r\n'
+
+
+async def read_response(reader, with_head=False):
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    body = await reader.readexactly(length)
+    if with_head:
+        return head, body
+    return int(head.split(b' ')[1]), body
+
+
+async def client(port, count, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for _ in range(count):
+        start = time.perf_counter()
+        writer.write(REQUEST)
+        status, body = await read_response(reader)
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            raise SystemExit('Unexpected status {0}'.format(status))
+    writer.close()
+    await writer.wait_closed()
+
+
+async def load(firmware, clients, count):
+    server = await firmware.start_server('127.0.0.1', 0)
+    port = server.server.sockets[0].getsockname()[1]
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, count, latencies) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    while server.open_connections:
+        await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+    return elapsed, latencies
+
+
+async def exchange(port, request):
+    """
+    Sends one request and returns the status, with what followed the head
+    up to the end of the connection if the response has no length.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    head, body = await read_response(reader, True)
+    status = int(head.split(b' ')[1])
+    if status == 204 or status == 304:
+        # No body follows, and no length for one
+        assert b'content-length:' not in head.lower(), head
+    elif b'content-length:' not in head.lower():
+            status = (status, await asyncio.wait_for(reader.read(), 1))
+    elif status == 500:
+        status = (status, body)
+    writer.close()
+    await writer.wait_closed()
+    return status
+
+
+async def broken_handler(request, response):
+    await response.start(200, 'text/plain')
+    await response.write(b'partial')
+    raise RuntimeError('handler failed')
+
+
+async def failing_handler(request, response):
+    raise RuntimeError('secret detail')
+
+
+async def empty_handler(request, response):
+    await response.send(204)
+
+
+async def malformed(firmware):
+    unhandled = []
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+    server = await firmware.start_server('127.0.0.1', 0)
+    server.route('/broken', broken_handler)
+    server.route('/failing', failing_handler)
+    server.route('/empty', empty_handler)
+    port = server.server.sockets[0].getsockname()[1]
+    statuses = {}
+    for name, request in (('POST /', b'POST / HTTP/1.1\r\nHost: tester\r\nContent-Length: 2\r\n\r\nab'),
+                          ('PUT /api/v1/measurement', b'PUT /api/v1/measurement HTTP/1.1\r\n\r\n'),
+                          ('Content-Length: abc', b'GET / HTTP/1.1\r\nContent-Length: abc\r\n\r\n'),
+                          ('Content-Length: -5', b'GET / HTTP/1.1\r\nContent-Length: -5\r\n\r\n'),
+                          ('failing handler', b'GET /broken HTTP/1.1\r\n\r\n'),
+                          ('handler failing early', b'GET /failing HTTP/1.1\r\n\r\n'),
+                          ('204 response', b'GET /empty HTTP/1.1\r\n\r\n'),
+                          ('GET / after them', REQUEST)):
+        statuses[name] = await exchange(port, request)
+    while server.open_connections:
+        await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+    for name, status in statuses.items():
+        print('{0:<24} {1}'.format(name, status))
+    print('unhandled task exceptions: {0}'.format(len(unhandled)))
+    assert statuses['POST /'] == 405 and statuses['PUT /api/v1/measurement'] == 405
+    assert statuses['Content-Length: abc'] == 400 and statuses['Content-Length: -5'] == 400
+    # The head was out before the handler failed, the connection is closed
+    # after what it wrote
+    assert statuses['failing handler'] == (200, b'partial') and statuses['GET / after them'] == 200
+    # Nothing was out yet: a plain 500, the error only in the trace
+    assert statuses['handler failing early'] == (500, b'Internal Server Error')
+    assert statuses['204 response'] == 204
+    assert not unhandled
+    records = []
+    firmware.tracer.dump(records.append)
+    assert any('GET /broken failed' in record for record in records)
+    assert any('GET /failing failed' in record and 'secret detail' in record for record in records)
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    conf, firmware = load_firmware()
+    os.chdir(SRC)
+    board.insert(0, 1, Resistor(1000))
+    firmware.measure_phase()
+
+    elapsed, latencies = asyncio.run(load(firmware, clients, count))
+    latencies.sort()
+    total = len(latencies)
+    print('{0} clients x {1} keep-alive requests: {2} requests in {3:.2f} s, {4:.0f} requests/s'.format(
+        clients, count, total, elapsed, total / elapsed))
+    print('latency p50 {0:.2f} ms, p99 {1:.2f} ms, max {2:.2f} ms'.format(
+        latencies[total // 2] * 1000, latencies[total * 99 // 100] * 1000, latencies[-1] * 1000))
+    asyncio.run(malformed(firmware))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Inductance measurement by pulse width sweep: measure_phase() of inductors
+of 10 mH to 1 H with winding resistances of 0.5 to 50 ohm, next to the
+previous single 10 us pulse read once. Prints the inductance and
+resistance errors, the virtual time, the pulses averaged and the longest
+pulse sequence run with interrupts disabled, the spread with a noisy ADC
+with and without averaging, and what becomes of parts outside the range.
+
+Run from the repository root:
+    python -m sim.bench_inductance
+"""
+
+import json
+import math
+
+from sim.circuit import board, Inductor
+from sim.clock import clock
+from sim.runtime import load_firmware
+
+INDUCTORS = (10 * 10**-3, 22 * 10**-3, 47 * 10**-3, 100 * 10**-3, 220 * 10**-3, 470 * 10**-3, 1.0)
+RESISTANCES = (0.5, 10, 50)
+# ADC noise, standard deviation
+NOISE_UV = 5000
+NOISE_PARTS = 8
+# Below the range the rise is over within an ADC conversion, above it the
+# current is still rising at the end of the first pulse
+EDGES = (('1 mH', Inductor(1 * 10**-3, 5), 'resistor'), ('3.3 mH', Inductor(3.3 * 10**-3, 20), 'resistor'),
+         ('2.2 H', Inductor(2.2, 20), None))
+
+
+def label(inductance):
+    if inductance >= 1:
+        return '{0:g} H'.format(inductance)
+    return '{0:g} mH'.format(inductance * 1000)
+
+
+def legacy_inductance(firmware, tp_x, tp_y):
+    """The previous measure_inductance_test(): one 10 us pulse, one reading, a 3.3 V rail."""
+    firmware.discharge_part(tp_x, tp_y, firmware.log_inductor)
+    tp_y.settle()
+    tp_x.set_r1_low()
+    sequence = firmware.inductance_sequence
+    sequence.clear()
+    sequence.add(0, tp_y, (1, 0, 0))
+    sequence.add(10, None, None, tp_x)
+    sequence.add(10, tp_y, (-1, 0, 0))
+    firmware.pulse_scheduler.run(sequence)
+    voltage = sequence.get_sample(1) / 1000000
+    diff = sequence.get_interval(0, 1) * 10**(-6)
+    if voltage >= 3.3:
+        return float('inf')
+    return -diff * 680 / math.log(1 - voltage / 3.3) * 1000
+
+
+def watch_sequences(firmware):
+    """Records the duration of every pulse sequence the scheduler runs."""
+    durations = []
+    scheduler = firmware.pulse_scheduler
+    run = scheduler.run
+
+    def watched_run(sequence, timeout_ms=1000):
+        done = run(sequence, timeout_ms)
+        durations.append(sequence.get_actual(sequence.count - 1))
+        return done
+
+    scheduler.run = watched_run
+    return durations
+
+
+def measure(firmware, part):
+    board.insert(0, 1, part)
+    start = clock.now_us
+    firmware.measure_phase()
+    return json.loads(firmware.measurement_json), clock.now_us - start
+
+
+def accuracy(firmware):
+    durations = watch_sequences(firmware)
+    print('{0:>8} {1:>6}  {2:>10} {3:>8} {4:>10}  {5:>10} {6:>7}  {7:>12}'.format(
+        'part', 'R', 'L error', 'R error', 'virtual', 'pulses', 'tau', 'single pulse'))
+    worst_l = worst_r = 0.0
+    longest_ms = 0.0
+    for inductance in INDUCTORS:
+        for resistance in RESISTANCES:
+            result, elapsed = measure(firmware, Inductor(inductance, resistance))
+            assert result['component'] == 'inductor', (inductance, resistance, result['component'])
+            values = result['values']
+            l_error = values['inductance_mh'] / (inductance * 1000) - 1
+            r_error = values['resistance'] - resistance
+            sweep = firmware.inductance_result
+            board.insert(0, 1, Inductor(inductance, resistance))
+            legacy = legacy_inductance(firmware, firmware.tp1, firmware.tp2) / (inductance * 1000) - 1
+            print('{0:>8} {1:>4g} R  {2:>+10.3%} {3:>+6.3f} R {4:>7.1f} ms  {5:>10} {6:>4.0f} us  {7:>+12.1%}'.format(
+                label(inductance), resistance, l_error, r_error, elapsed / 1000, sweep.get_pulses(),
+                sweep.get_tau_us(), legacy))
+            worst_l = max(worst_l, abs(l_error))
+            worst_r = max(worst_r, abs(r_error))
+            longest_ms = max(longest_ms, sweep.get_time_us() / 1000)
+    del firmware.pulse_scheduler.run
+    sequence_ms = max(durations) / 1000
+    print('worst L error {0:.3%}, worst R error {1:.3f} ohm, longest inductance measurement {2:.1f} ms virtual '
+          '(budget {3:.0f} ms), longest pulse sequence {4:.1f} ms'.format(
+              worst_l, worst_r, longest_ms, firmware.inductance_budget_us / 1000, sequence_ms))
+    assert worst_l < 0.01 and worst_r < 0.1
+    assert longest_ms <= firmware.inductance_budget_us / 1000
+    assert sequence_ms <= max(firmware.inductance_sequence_us, firmware.inductance_rise_us) / 1000 + 1
+
+
+def noise(firmware, conf):
+    """Spread of the inductance with a noisy ADC, one pulse per width and the default repeats."""
+    import machine
+    adc_pins = (conf.adc_tp1, conf.adc_tp2, conf.adc_tp3)
+    repeats = conf.inductance_repeats
+    print('ADC noise {0:.0f} mV rms, {1} parts each:'.format(NOISE_UV / 1000, NOISE_PARTS))
+    spreads = {}
+    for count in (1, repeats):
+        firmware.inductance_repeats = count
+        firmware.inductance_average_us = conf.inductance_average_us if count > 1 else 0
+        firmware.init_sample_buffers()
+        for inductance in (10 * 10**-3, 100 * 10**-3):
+            for i, pin in enumerate(adc_pins):
+                machine.adc_errors[pin] = machine.AdcError(noise_uv=NOISE_UV, seed=i + 1)
+            errors = []
+            pulses = 0
+            for _ in range(NOISE_PARTS):
+                result, elapsed = measure(firmware, Inductor(inductance, 10))
+                if result['component'] != 'inductor':
+                    errors.append(float('inf'))
+                    continue
+                errors.append(result['values']['inductance_mh'] / (inductance * 1000) - 1)
+                pulses = firmware.inductance_result.get_pulses()
+            worst = max(abs(e) for e in errors)
+            spreads[(count, inductance)] = worst
+            print('  {0:<26} {1:>7}: {2:4} pulses, worst L error {3:.2%}'.format(
+                'one pulse per width' if count == 1 else 'averaged', label(inductance), pulses, worst))
+    machine.adc_errors.clear()
+    firmware.inductance_repeats = repeats
+    firmware.init_sample_buffers()
+    for inductance in (10 * 10**-3, 100 * 10**-3):
+        assert spreads[(repeats, inductance)] < spreads[(1, inductance)] / 2
+        assert spreads[(repeats, inductance)] < 0.05
+
+
+def edges(firmware):
+    print('outside the range:')
+    for name, part, expected in EDGES:
+        result, elapsed = measure(firmware, part)
+        status = firmware.inductance_result.get_status() if firmware.inductance_result is not None else '-'
+        values = ', '.join('{0} {1}'.format(key, value) for key, value in result['values'].items()
+                           if key in ('resistance', 'inductance_mh'))
+        print('  {0:>7}: {1} ({2}) {3}, {4:.1f} ms virtual'.format(name, result['component'], status, values,
+                                                                  elapsed / 1000))
+        assert result['component'] == expected
+        assert elapsed <= firmware.inductance_budget_us
+    board.remove()
+
+
+def main():
+    conf, firmware = load_firmware()
+    accuracy(firmware)
+    noise(firmware, conf)
+    edges(firmware)
+
+
+if __name__ == '__main__':
+    main()
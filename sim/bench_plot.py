@@ -0,0 +1,104 @@
+"""
+host_app live plot with synthetic data, rendered offscreen: paint time of
+the min/max decimated plot against drawing every sample as the buffer
+grows, a 50 kS/s stream fed in display-refresh sized blocks, and the
+accuracy of the exponential fit on noisy RC and RL curves.
+
+Run from the repository root:
+    python -m sim.bench_plot
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtGui import QImage, QPainter, QPen, QPolygonF
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'host_app'))
+from plot import CurvePlot, fit_exponential
+
+WIDTH = 1200
+HEIGHT = 400
+RATE_HZ = 50000
+REFRESH_HZ = 60
+STREAM_S = 3
+
+
+class NaivePlot(CurvePlot):
+    """Draws every sample, for comparison."""
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        times, values = self.ring.arrays()
+        x = (times - times[0]) * (self.width() - 1) / (times[-1] - times[0])
+        y = self.height() - 10 - (values - values.min()) * (self.height() - 20) / np.ptp(values)
+        painter.setPen(QPen(Qt.darkBlue, 1))
+        painter.drawPolyline(QPolygonF([QPointF(a, b) for a, b in zip(x.tolist(), y.tolist())]))
+
+
+def synthetic(n, tau_us, rate_hz, noise, rng, start=0):
+    times = (start + np.arange(n)) * 1e6 / rate_hz
+    return times, 3.3e6 * (1 - np.exp(-times / tau_us)) + rng.normal(0, noise, n)
+
+
+def paint_ms(plot, image, repeats=5):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        plot.render(image)
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def main():
+    app = QApplication(sys.argv)
+    image = QImage(WIDTH, HEIGHT, QImage.Format_RGB32)
+    rng = np.random.default_rng(1)
+
+    print('{0:>9} {1:>12} {2:>12}'.format('samples', 'min/max ms', 'all ms'))
+    for n in (1000, 10000, 100000, 1000000):
+        times, values = synthetic(n, n * 4, RATE_HZ, 20000, rng)
+        plot = CurvePlot(n)
+        plot.resize(WIDTH, HEIGHT)
+        plot.show_curve(times, values)
+        naive = ''
+        if n <= 100000:
+            full = NaivePlot(n)
+            full.resize(WIDTH, HEIGHT)
+            full.show_curve(times, values)
+            naive = '{0:.1f}'.format(paint_ms(full, image, 2))
+        print('{0:>9} {1:>12.1f} {2:>12}'.format(n, paint_ms(plot, image), naive))
+
+    # A stream at RATE_HZ into a one second window, one block and one
+    # repaint per display refresh
+    plot = CurvePlot(RATE_HZ)
+    plot.resize(WIDTH, HEIGHT)
+    block = RATE_HZ // REFRESH_HZ
+    frames = STREAM_S * REFRESH_HZ
+    frame_ms = []
+    for frame in range(frames):
+        times, values = synthetic(block, 2000, RATE_HZ, 20000, rng, frame * block)
+        start = time.perf_counter()
+        plot.append(times, values)
+        plot.render(image)
+        frame_ms.append((time.perf_counter() - start) * 1000)
+    frame_ms = sorted(frame_ms)
+    mean_ms = sum(frame_ms) / frames
+    print('stream {0} S/s, {1} per frame: {2:.1f} ms mean, {3:.1f} ms max per frame ({4:.0f} % of the frame budget)'.format(
+        RATE_HZ, block, mean_ms, frame_ms[-1], mean_ms * REFRESH_HZ / 10))
+
+    for name, tau_us, final, noise in (('RC charge 1 ms', 1000.0, 3.3e6, 5000), ('RC discharge 220 us', 220.0, 0.0, 5000),
+                                       ('RL current 35 us', 35.0, 48000.0, 300)):
+        times = np.arange(256) * tau_us * 5 / 256
+        start_value = 3.3e6 if final == 0.0 else 0.0
+        values = final + (start_value - final) * np.exp(-times / tau_us) + rng.normal(0, noise, len(times))
+        fit = fit_exponential(times, values)
+        print('fit {0:<20} tau {1:8.2f} us, error {2:+.2f} %'.format(name, fit[2], (fit[2] / tau_us - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
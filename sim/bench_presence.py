@@ -0,0 +1,247 @@
+"""
+Presence detection between measurements: the signature of each kind of
+part, the time from a part touching the test points to the start of its
+measurement with contact bounce, spurious measurements, the idle cost of
+the probe, and a part inserted under the running event loop reaching
+host_app over serial and the JSON API.
+
+Run from the repository root:
+    python -m sim.bench_presence
+"""
+
+import asyncio
+import io
+import json
+import os
+import random
+import threading
+import time
+import tty
+
+from sim.circuit import board, Resistor, Short, Capacitor, Diode, Inductor
+from sim.clock import clock, sleep_ms
+from sim.runtime import SRC, load_firmware
+
+from host_app.link import DeviceLink
+from protocol import MSG_RESULT
+
+INSERTIONS = 200
+SEED = 1
+# Contact bounce: toggles and the longest time between two of them
+BOUNCES = 6
+BOUNCE_MS = 3
+IDLE_MS = 1000
+
+PARTS = (
+    ('1k TP1-TP2', 0, 1, lambda: Resistor(1000)),
+    ('2.2M TP1-TP3', 0, 2, lambda: Resistor(2200000)),
+    ('short TP2-TP3', 1, 2, Short),
+    ('220pF TP1-TP2', 0, 1, lambda: Capacitor(220 * 10**-12)),
+    ('100uF TP2-TP3', 1, 2, lambda: Capacitor(100 * 10**-6)),
+    ('diode TP1>TP2', 0, 1, lambda: Diode(0.65, 10)),
+    ('diode TP2>TP1', 1, 0, lambda: Diode(0.65, 10)),
+    ('LED TP3>TP1', 2, 0, lambda: Diode(2.0, 5)),
+    ('10mH TP1-TP3', 0, 2, lambda: Inductor(10 * 10**-3, 20)),
+)
+
+
+def signatures(firmware):
+    print('presence signatures (bit i: TPi+1 conducts)')
+    board.remove()
+    assert firmware.presence_probe() == 0
+    for name, a, b, make in PARTS:
+        board.insert(a, b, make())
+        signature = firmware.presence_probe()
+        assert signature, name
+        print('  {0:<16} {1:03b}'.format(name, signature))
+    board.remove()
+
+
+def schedule(rng):
+    """
+    Board states over virtual time: (time_us, part or None, node_a, node_b,
+    first contact) with a few bounces at every insertion and removal.
+    """
+    events = []
+    now = clock.now_us
+    for _ in range(INSERTIONS):
+        name, a, b, make = rng.choice(PARTS)
+        now += rng.randint(100, 400) * 1000
+        part = make()
+        part.name = name
+        events.append((now, part, a, b, True))
+        for i in range(rng.randint(0, BOUNCES)):
+            now += rng.randint(200, BOUNCE_MS * 1000)
+            events.append((now, None if i % 2 == 0 else part, a, b, False))
+        if events[-1][1] is None:
+            now += rng.randint(200, BOUNCE_MS * 1000)
+            events.append((now, part, a, b, False))
+        now += rng.randint(1500, 2500) * 1000
+        events.append((now, None, a, b, True))
+        for i in range(rng.randint(0, BOUNCES)):
+            now += rng.randint(200, BOUNCE_MS * 1000)
+            events.append((now, part if i % 2 == 0 else None, a, b, False))
+        if events[-1][1] is not None:
+            now += rng.randint(200, BOUNCE_MS * 1000)
+            events.append((now, None, a, b, False))
+    return events, now + 500000
+
+
+def latency(firmware, conf):
+    rng = random.Random(SEED)
+    events, end = schedule(rng)
+    started = []
+    measure_phase = firmware.measure_phase
+
+    def measure(trigger='request'):
+        started.append(clock.now_us)
+        return measure_phase(trigger)
+
+    firmware.measure_phase = measure
+    firmware.presence = conf.PresenceDebouncer(conf.presence_debounce)
+    published = []
+    missed = {}
+    index = 0
+    contact = None
+    name = None
+    latencies = []
+    try:
+        while clock.now_us < end:
+            while index < len(events) and events[index][0] <= clock.now_us:
+                at, part, a, b, first = events[index]
+                if part is None:
+                    board.remove()
+                else:
+                    board.insert(a, b, part)
+                if first:
+                    contact = at if part is not None else None
+                    name = part.name if part is not None else None
+                index += 1
+            count = len(started)
+            if firmware.presence_poll():
+                result = json.loads(firmware.measurement_json)
+                published.append(result['component'])
+                if len(started) > count:
+                    latencies.append(started[-1] - contact)
+                    if result['component'] is None:
+                        missed[name] = missed.get(name, 0) + 1
+            sleep_ms(conf.presence_poll_ms)
+    finally:
+        firmware.measure_phase = measure_phase
+
+    # The empty board at the start is published as well
+    removals = len(published) - len(started) - 1
+    latencies.sort()
+    print('{0} insertions with up to {1} bounces: {2} measured, {3} removals published, nothing found for {4}'.format(
+        INSERTIONS, BOUNCES, len(started), removals, missed))
+    print('contact to measurement start: median {0:.1f} ms, p95 {1:.1f} ms, max {2:.1f} ms'.format(
+        latencies[len(latencies) // 2] / 1000, latencies[int(len(latencies) * 0.95)] / 1000, latencies[-1] / 1000))
+    assert len(started) == INSERTIONS and removals == INSERTIONS
+    assert latencies[-1] < 100000
+
+
+def idle_cost(firmware, conf):
+    import machine
+    board.remove()
+    firmware.presence = conf.PresenceDebouncer(conf.presence_debounce)
+    firmware.presence_poll()
+    machine.reset_stats()
+    start = clock.now_us
+    busy = 0
+    polls = 0
+    while clock.now_us - start < IDLE_MS * 1000:
+        before = clock.now_us
+        firmware.presence_poll()
+        busy += clock.now_us - before
+        polls += 1
+        sleep_ms(conf.presence_poll_ms)
+    seconds = (clock.now_us - start) / 1000000
+    stats = machine.stats
+    print('idle: {0:.0f} probes/s, {1:.0f} ADC reads/s, {2:.0f} pin changes/s, {3:.0f} us per probe, '
+          '{4:.1%} of the time probing'.format(polls / seconds, stats['adc_read'] / seconds,
+                                               (stats['pin_init'] + stats['pin_value']) / seconds,
+                                               busy / polls, busy / (clock.now_us - start)))
+
+
+async def fetch_measurement(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET /api/v1/measurement HTTP/1.1\r\nHost: tester\r\nConnection: close\r\n\r\n')
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.partition(b'\r\n\r\n')[2])
+
+
+def event_loop(firmware):
+    """
+    measurement_loop() and serial_loop() as on the device; a resistor is
+    inserted once the empty board was published.
+    """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    link = DeviceLink(io.FileIO(master, 'r+b', closefd=False))
+    results = []
+    arrived = []
+    inserted_at = []
+
+    def host():
+        while len(results) < 2:
+            for kind, value in link.read():
+                if kind == MSG_RESULT:
+                    results.append(value)
+                    arrived.append(time.perf_counter())
+
+    async def run():
+        board.remove()
+        os.chdir(SRC)
+        server = await firmware.start_server('127.0.0.1', 0)
+        port = server.server.sockets[0].getsockname()[1]
+        tasks = [asyncio.create_task(firmware.serial_loop(io.FileIO(slave, 'rb', closefd=False),
+                                                          io.FileIO(slave, 'wb', closefd=False))),
+                 asyncio.create_task(firmware.measurement_loop())]
+        thread = threading.Thread(target=host)
+        thread.start()
+        start = time.perf_counter()
+        while not results and time.perf_counter() - start < 10:
+            await asyncio.sleep(0.01)
+        # Inserted between two probes, on the thread of the firmware
+        board.insert(0, 2, Resistor(4700))
+        inserted_at.append(time.perf_counter())
+        while len(results) < 2 and time.perf_counter() - start < 10:
+            await asyncio.sleep(0.01)
+        measurement = await fetch_measurement(port)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        while server.open_connections:
+            await asyncio.sleep(0.01)
+        server.close()
+        await server.wait_closed()
+        return measurement
+
+    firmware.init_serial()
+    measurement = asyncio.run(run())
+    os.close(master)
+    os.close(slave)
+    empty, inserted = results
+    assert empty['component'] is None and empty['trigger'] == 'presence'
+    assert inserted['component'] == 'resistor' and inserted['trigger'] == 'presence'
+    assert measurement['seq'] == inserted['seq']
+    print('event loop: 4.7k TP1-TP3 at host_app {0:.0f} ms (wall) after insertion, seq {1} {2:.0f} ohm, '
+          'same on /api/v1/measurement'.format((arrived[1] - inserted_at[0]) * 1000, inserted['seq'],
+                                               inserted['values']['resistance']))
+
+
+def main():
+    conf, firmware = load_firmware()
+    signatures(firmware)
+    latency(firmware, conf)
+    idle_cost(firmware, conf)
+    event_loop(firmware)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Run the ESR and inductance pulse sequences on the stand-in Timer and print
+requested versus achieved step times. Two runs of the same sequence must
+give identical timings.
+
+Run from the repository root:
+    python -m sim.bench_pulse
+"""
+
+from sim.circuit import board, Capacitor
+from sim.runtime import load_firmware
+
+
+def timings(sequence):
+    return [(sequence.get_requested(i), sequence.get_actual(i)) for i in range(sequence.count)]
+
+
+def main():
+    conf, firmware = load_firmware()
+    board.insert(0, 1, Capacitor(10 * 10**-6))
+
+    tp_x, tp_y = firmware.tp1, firmware.tp2
+    sequence = firmware.esr_sequence
+    sequence.clear()
+    for j in range(4):
+        start = j * conf.esr_period_us
+        sequence.add(start, tp_y, (0, 1, 0), tp_y)
+        sequence.add(start + conf.esr_high_us, tp_y, (0, -1, 0))
+        sequence.add(start + conf.esr_high_us + conf.esr_low_us, None, None, tp_x)
+        sequence.add(start + conf.esr_high_us + conf.esr_low_us, tp_y, (0, 0, 0), tp_y)
+
+    firmware.pulse_scheduler.run(sequence)
+    first = timings(sequence)
+    tp_y.set_pins_floating()
+    firmware.pulse_scheduler.run(sequence)
+    second = timings(sequence)
+
+    print('{0:>5} {1:>14} {2:>13} {3:>10}'.format('step', 'requested (us)', 'achieved (us)', 'error (us)'))
+    for i, (requested, actual) in enumerate(first):
+        print('{0:>5} {1:>14} {2:>13} {3:>10}'.format(i, requested, actual, actual - requested))
+    print('Mean achieved high time: {0} us (requested {1} us)'.format(
+        sequence.get_interval_mean(0, 1, 4), conf.esr_high_us))
+    print('Deterministic: {0}'.format(first == second))
+    if first != second:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
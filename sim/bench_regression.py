@@ -0,0 +1,184 @@
+"""
+Accuracy and speed regression of measure_phase() over a few hundred
+simulated parts: resistors, capacitors with ESR, diodes and LEDs,
+inductors with winding resistance, opens and shorts, on random pairs of
+test points. Prints per kind of part how many were classified right, the
+error of the main value and the virtual time per part, and exits with 1
+if any kind is worse than BASELINE.
+
+Run from the repository root:
+    python -m sim.bench_regression [parts] [seed]
+"""
+
+import json
+import math
+import random
+import sys
+import time
+
+from sim.circuit import board, Resistor, Short, Capacitor, Diode, Inductor, VCC, PIN_RES, SHORT_RES
+from sim.clock import clock
+from sim.runtime import load_firmware
+
+PARTS = 300
+SEED = 1
+PAIRS = ((0, 1), (1, 0), (0, 2), (2, 0), (1, 2), (2, 1))
+E12 = (1.0, 1.2, 1.5, 1.8, 2.2, 2.7, 3.3, 3.9, 4.7, 5.6, 6.8, 8.2)
+
+# Kind of part: share of the parts, expected component, value key
+KINDS = (
+    ('resistor', 0.30, 'resistor', 'resistance'),
+    ('capacitor', 0.25, 'capacitor', 'capacitance_uf'),
+    ('diode', 0.20, 'diode', 'forward_voltage'),
+    ('inductor', 0.06, 'inductor', 'inductance_mh'),
+    ('winding', 0.04, 'resistor', 'resistance'),
+    ('short', 0.075, 'resistor', 'resistance'),
+    ('open', 0.075, None, None),
+)
+
+# Per kind: least share classified right, largest 95th percentile value
+# error (relative, absolute ohms for shorts) and most virtual ms per part,
+# from the results of seed 1 with some margin. Inductors whose time
+# constant through 680 ohm is well below an ADC conversion read as their
+# winding resistance.
+BASELINE = {
+    'resistor': (1.0, 0.005, 10),
+    'capacitor': (1.0, 0.05, 500),
+    'diode': (1.0, 0.001, 7),
+    'inductor': (1.0, 0.01, 300),
+    'winding': (1.0, 0.005, 15),
+    'short': (1.0, 0.01, 15),
+    'open': (1.0, None, 6),
+}
+
+
+def log_uniform(rng, low, high):
+    return math.exp(rng.uniform(math.log(low), math.log(high)))
+
+
+def e12(rng, low, high):
+    decade = 10 ** rng.randint(int(math.log10(low)), int(math.log10(high)) - 1)
+    return rng.choice(E12) * decade
+
+
+def make_part(rng, kind):
+    """
+    Returns:
+        tuple: (part or None, true value in the unit of the value key).
+    """
+    if kind == 'resistor':
+        resistance = e12(rng, 10, 1000000)
+        return Resistor(resistance), resistance
+    if kind == 'capacitor':
+        capacitance = log_uniform(rng, 1 * 10**-9, 1000 * 10**-6)
+        return Capacitor(capacitance, 0.0, rng.uniform(0, 2)), capacitance * 10**6
+    if kind == 'diode':
+        forward_voltage = rng.choice((rng.uniform(0.25, 0.45), rng.uniform(0.55, 0.75), rng.uniform(1.6, 2.2)))
+        on_resistance = rng.uniform(5, 30)
+        # The forward voltage at the test current through 680 ohm and two pins
+        current = (VCC - forward_voltage) / (on_resistance + 680 + 2 * PIN_RES)
+        return Diode(forward_voltage, on_resistance), forward_voltage + on_resistance * current
+    if kind == 'inductor':
+        inductance = log_uniform(rng, 10 * 10**-3, 1)
+        return Inductor(inductance, rng.uniform(0.5, 50)), inductance * 1000
+    if kind == 'winding':
+        resistance = rng.uniform(0.5, 50)
+        return Inductor(log_uniform(rng, 100 * 10**-6, 3.3 * 10**-3), resistance), resistance
+    if kind == 'short':
+        return Short(), SHORT_RES
+    return None, None
+
+
+def generate(count, seed):
+    rng = random.Random(seed)
+    parts = []
+    for kind, share, component, key in KINDS:
+        for _ in range(max(1, round(count * share))):
+            part, value = make_part(rng, kind)
+            parts.append((kind, rng.choice(PAIRS), part, value))
+    rng.shuffle(parts)
+    return parts
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(firmware, pair, part):
+    if part is None:
+        board.remove()
+    else:
+        board.insert(pair[0], pair[1], part)
+    start = clock.now_us
+    firmware.measure_phase()
+    return json.loads(firmware.measurement_json), clock.now_us - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else PARTS
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else SEED
+    conf, firmware = load_firmware()
+    parts = generate(count, seed)
+    expected = {kind: (component, key) for kind, share, component, key in KINDS}
+    stats = {kind: {'parts': 0, 'right': 0, 'errors': [], 'virtual_us': 0} for kind, _, _, _ in KINDS}
+
+    start = time.perf_counter()
+    for kind, pair, part, value in parts:
+        result, virtual_us = measure(firmware, pair, part)
+        component, key = expected[kind]
+        entry = stats[kind]
+        entry['parts'] += 1
+        entry['virtual_us'] += virtual_us
+        if result['component'] != component:
+            continue
+        entry['right'] += 1
+        if key is None:
+            continue
+        measured = result['values'].get(key)
+        if measured is None:
+            entry['errors'].append(float('inf'))
+        elif kind == 'short':
+            entry['errors'].append(abs(measured - value))
+        else:
+            entry['errors'].append(abs(measured - value) / value)
+    elapsed = time.perf_counter() - start
+
+    print('{0} parts, seed {1}: {2:.1f} s wall, {3:.0f} parts/s, {4:.1f} s virtual'.format(
+        len(parts), seed, elapsed, len(parts) / elapsed, sum(s['virtual_us'] for s in stats.values()) / 10**6))
+    print('{0:>10} {1:>6} {2:>8} {3:>10} {4:>10} {5:>10} {6:>12}  {7}'.format(
+        'kind', 'parts', 'right', 'err p50', 'err p95', 'err max', 'virtual ms', 'baseline'))
+    failed = []
+    for kind, share, component, key in KINDS:
+        entry = stats[kind]
+        right = entry['right'] / entry['parts']
+        p50 = percentile(entry['errors'], 0.5)
+        p95 = percentile(entry['errors'], 0.95)
+        worst = max(entry['errors']) if entry['errors'] else None
+        virtual_ms = entry['virtual_us'] / entry['parts'] / 1000
+        min_right, max_p95, max_ms = BASELINE[kind]
+        ok = right >= min_right and virtual_ms <= max_ms and (max_p95 is None or (p95 is not None and p95 <= max_p95))
+        if not ok:
+            failed.append(kind)
+        print('{0:>10} {1:>6} {2:>7.0%} {3:>10} {4:>10} {5:>10} {6:>12.1f}  {7}'.format(
+            kind, entry['parts'], right, format_error(p50, kind), format_error(p95, kind), format_error(worst, kind), virtual_ms,
+            'ok' if ok else 'REGRESSION'))
+    if failed:
+        print('worse than the baseline: ' + ', '.join(failed))
+        sys.exit(1)
+
+
+def format_error(error, kind):
+    if error is None:
+        return '-'
+    if error == float('inf'):
+        return 'inf'
+    if kind == 'short':
+        return '{0:.4f} ohm'.format(error)
+    return '{0:.3%}'.format(error)
+
+
+if __name__ == '__main__':
+    main()
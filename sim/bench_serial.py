@@ -0,0 +1,173 @@
+"""
+Serial protocol under CPython over a pty pair: the firmware serial task on
+one end, host_app's DeviceLink on the other. Checks measure, charge curve,
+configure, Wi-Fi and recovery from corrupted bytes, then prints round trip
+times, curve throughput and how many read calls the firmware needed.
+
+Run from the repository root:
+    python -m sim.bench_serial
+"""
+
+import asyncio
+import io
+import os
+import tempfile
+import threading
+import time
+import tty
+
+from sim.circuit import board, Capacitor
+from sim.runtime import load_firmware
+
+from host_app.link import DeviceLink, MSG_CURVE_BLOCK
+from protocol import MSG_RESULT, MSG_ACK, MSG_SAMPLES, MSG_MEASURE, MSG_CONFIGURE, MSG_SET_WIFI, \
+    STATUS_OK, STATUS_ERROR, write_frame
+
+ROUNDS = 20
+CURVES = 50
+
+
+class CountingReader:
+    """The firmware end of the pty, counting the read calls."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.calls = 0
+        self.bytes = 0
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        self.calls += 1
+        self.bytes += n or 0
+        return n
+
+
+def wait_for(link, kind):
+    while True:
+        for message in link.read():
+            if message[0] == kind:
+                return message[1]
+
+
+def host(link, firmware, report):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        link.measure()
+        result = wait_for(link, MSG_RESULT)
+    report['measure_ms'] = (time.perf_counter() - start) * 1000 / ROUNDS
+    report['component'] = result['component']
+
+    link.request_curve()
+    # The blocks handed on as they arrive add up to the complete curve
+    blocks = ([], [])
+    while True:
+        messages = [message for message in link.read() if message[0] in (MSG_CURVE_BLOCK, MSG_SAMPLES)]
+        for kind, value in messages:
+            if kind == MSG_CURVE_BLOCK:
+                assert value[2] == len(blocks[1])
+                blocks[0].extend(value[0])
+                blocks[1].extend(value[1])
+            else:
+                times, values = value
+        if messages and messages[-1][0] == MSG_SAMPLES:
+            break
+    count = firmware.charge_curve.get_count()
+    assert times == list(firmware.charge_curve.times[:count])
+    assert values == list(firmware.charge_curve.values[:count])
+    assert times[:len(blocks[0])] == blocks[0] and values[:len(blocks[1])] == blocks[1] and blocks[1]
+    report['curve_samples'] = count
+
+    bytes_before = link.bytes_read
+    start = time.perf_counter()
+    for _ in range(CURVES):
+        link.request_curve()
+        wait_for(link, MSG_SAMPLES)
+    elapsed = time.perf_counter() - start
+    report['curve_ms'] = elapsed * 1000 / CURVES
+    report['curve_kb_s'] = (link.bytes_read - bytes_before) / elapsed / 1000
+
+    link.configure(resistance_samples=16)
+    assert wait_for(link, MSG_ACK) == (MSG_CONFIGURE, STATUS_OK)
+    assert firmware.resistance_samples == 16 and len(firmware.sample_buffer) == 16
+    link.configure(resistance_samples='many')
+    assert wait_for(link, MSG_ACK) == (MSG_CONFIGURE, STATUS_ERROR)
+    link.configure(no_such_setting=1)
+    assert wait_for(link, MSG_ACK) == (MSG_CONFIGURE, STATUS_ERROR)
+    # State of main.py, out of range, the wrong type, only read at boot
+    sequence = firmware.measurement_sequence
+    for refused in ({'measurement_sequence': 0}, {'resistance_samples': 0}, {'resistance_samples': 16.5},
+                    {'http_port': 1.5}, {'charge_curve_size': 64}, {'stream_queue_frames': 8},
+                    {'trace_levels': {'capacitor': 9}}):
+        link.configure(**refused)
+        assert wait_for(link, MSG_ACK) == (MSG_CONFIGURE, STATUS_ERROR), refused
+    assert firmware.measurement_sequence == sequence and firmware.resistance_samples == 16
+
+    link.set_wifi('lab', 'secret')
+    assert wait_for(link, MSG_ACK) == (MSG_SET_WIFI, STATUS_OK)
+    assert firmware.read_wifi_credentials() == ('lab', 'secret')
+
+    # Line noise, then a frame with a flipped payload bit, then a good one
+    corrupted = io.BytesIO()
+    write_frame(corrupted, MSG_CONFIGURE, b'{"resistance_samples": 10}')
+    corrupted = bytearray(corrupted.getvalue())
+    corrupted[8] ^= 0x01
+    link.port.write(b'\xa5garbage\x5a\xa5' + bytes(corrupted))
+    link.measure()
+    wait_for(link, MSG_RESULT)
+    report['rx_errors'] = firmware.serial_decoder.errors
+    report['rx_skipped'] = firmware.serial_decoder.skipped
+    assert firmware.resistance_samples == 16
+
+
+async def run(firmware, stream_in, stream_out, link, report):
+    task = asyncio.create_task(firmware.serial_loop(stream_in, stream_out))
+    thread = threading.Thread(target=host, args=(link, firmware, report))
+    thread.start()
+    while thread.is_alive():
+        await asyncio.sleep(0.01)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def main():
+    conf, firmware = load_firmware()
+    board.insert(1, 2, Capacitor(10 * 10**-6))
+    firmware.init_serial()
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    stream_in = CountingReader(io.FileIO(slave, 'rb', closefd=False))
+    stream_out = io.FileIO(slave, 'wb', closefd=False)
+    link = DeviceLink(io.FileIO(master, 'r+b', closefd=False))
+
+    report = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        # MSG_SET_WIFI writes wifi_credentials.json to the working directory
+        os.chdir(scratch)
+        try:
+            asyncio.run(run(firmware, stream_in, stream_out, link, report))
+        finally:
+            os.chdir(cwd)
+    os.close(master)
+    os.close(slave)
+
+    frames = firmware.serial_decoder.frames
+    print('measure round trip ({0}):  {1:.1f} ms'.format(report['component'], report['measure_ms']))
+    print('charge curve:              {0} samples, {1:.2f} ms, {2:.0f} kB/s'.format(
+        report['curve_samples'], report['curve_ms'], report['curve_kb_s']))
+    print('firmware reads:            {0} calls for {1} bytes in {2} frames ({3:.1f} per frame)'.format(
+        stream_in.calls, stream_in.bytes, frames, stream_in.calls / frames))
+    print('corrupted input:           {0} bad frames, {1} bytes skipped, next frame answered'.format(
+        report['rx_errors'], report['rx_skipped']))
+    print('host reads:                {0} calls for {1} bytes'.format(link.reads, link.bytes_read))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Virtual time spent in measure_resistance_auto() between TP1 and TP2 with
+adaptive settling versus the previous fixed 5 ms waits. Then the recharge
+wait between ESR cycles on capacitors up to 1000 uF: the fixed 5 ms wait,
+settle() alone and settle() after the time constant dwell, with the
+capacitor voltage left when each wait ends.
+
+Run from the repository root:
+    python -m sim.bench_settle
+"""
+
+from sim.circuit import board, Resistor, Capacitor
+from sim.clock import clock, sleep
+from sim.runtime import load_firmware
+
+VALUES = [10, 100, 1000, 10000, 100000, 470000, 1000000]
+CAPACITANCES_UF = [1, 10, 100, 1000]
+
+
+def fixed_settle(self, tolerance_uv=None, timeout_us=None, min_us=0):
+    sleep(0.005)
+    return 5000
+
+
+def run(firmware, resistance):
+    board.insert(0, 1, Resistor(resistance))
+    start = clock.now_us
+    result = firmware.measure_resistance_auto(firmware.tp1, firmware.tp2)
+    elapsed = clock.now_us - start
+    return elapsed, result.get_resistance()
+
+
+def esr_waits(conf, firmware, settle, capacitance):
+    """
+    Runs measure_capacitor_esr() with the given settle(), returns the
+    longest recharge wait and the highest voltage the test point was left
+    at after one.
+    """
+    board.insert(0, 1, Capacitor(capacitance * 10**-6))
+    waits = []
+
+    def recorded(self, tolerance_uv=None, timeout_us=None, min_us=0):
+        start = clock.now_us
+        settle(self, tolerance_uv, timeout_us, min_us)
+        waits.append((clock.now_us - start, self.adc.read_uv() / 1000000))
+
+    original = conf.TestPoint.settle
+    conf.TestPoint.settle = recorded
+    try:
+        firmware.measure_capacitor_esr(firmware.tp1, firmware.tp2, capacitance)
+    finally:
+        conf.TestPoint.settle = original
+    return max(wait for wait, _ in waits), max(voltage for _, voltage in waits)
+
+
+def main():
+    conf, firmware = load_firmware()
+    adaptive_settle = conf.TestPoint.settle
+
+    print('{0:>10} {1:>12} {2:>12} {3:>14} {4:>14}'.format(
+        'R (ohm)', 'fixed (us)', 'adaptive (us)', 'fixed R', 'adaptive R'))
+    for resistance in VALUES:
+        conf.TestPoint.settle = fixed_settle
+        fixed_time, fixed_value = run(firmware, resistance)
+        conf.TestPoint.settle = adaptive_settle
+        adaptive_time, adaptive_value = run(firmware, resistance)
+        print('{0:>10} {1:>12} {2:>12} {3:>14.1f} {4:>14.1f}'.format(
+            resistance, fixed_time, adaptive_time, fixed_value, adaptive_value))
+
+    def no_dwell(self, tolerance_uv=None, timeout_us=None, min_us=0):
+        return adaptive_settle(self, tolerance_uv, timeout_us)
+
+    print()
+    print('{0:>10} {1:>22} {2:>22} {3:>22}'.format(
+        'C (uF)', 'fixed (us, V left)', 'no dwell (us, V left)', 'dwell (us, V left)'))
+    for capacitance in CAPACITANCES_UF:
+        row = []
+        for settle in (fixed_settle, no_dwell, adaptive_settle):
+            row.append(esr_waits(conf, firmware, settle, capacitance))
+        print('{0:>10} {1[0]:>13} {1[1]:>8.4f} {2[0]:>13} {2[1]:>8.4f} {3[0]:>13} {3[1]:>8.4f}'.format(
+            capacitance, *row))
+        # The dwell waits out at least as much of the tail as the fixed wait did
+        assert row[2][1] <= row[0][1] + 0.001, (capacitance, row)
+
+
+if __name__ == '__main__':
+    main()
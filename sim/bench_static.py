@@ -0,0 +1,77 @@
+"""
+Bytes a browser transfers for the result page: the first visit fetching
+the page and every asset, then a reload revalidating the assets with
+their ETags. Also checks that every asset decompresses.
+
+Run from the repository root:
+    python -m sim.bench_static
+"""
+
+import asyncio
+import gzip
+import os
+
+from sim.bench_http import read_response
+from sim.circuit import board, Resistor
+from sim.runtime import SRC, load_firmware
+
+
+async def fetch(reader, writer, path, etag=None):
+    request = 'GET {0} HTTP/1.1\r\nHost: tester\r\nAccept-Encoding: gzip\r\n'.format(path)
+    if etag is not None:
+        request += 'If-None-Match: {0}\r\n'.format(etag)
+    writer.write((request + '\r\n').encode())
+    head, body = await read_response(reader, True)
+    headers = {}
+    for line in head.split(b'\r\n')[1:]:
+        if b':' in line:
+            name, value = line.split(b':', 1)
+            headers[name.strip().lower().decode()] = value.strip().decode()
+    return int(head.split(b' ')[1]), headers, len(head) + len(body), body
+
+
+async def visit(port, paths, etags):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    total = 0
+    rows = []
+    for path in paths:
+        status, headers, size, body = await fetch(reader, writer, path, etags.get(path))
+        if status == 200 and headers.get('content-encoding') == 'gzip':
+            gzip.decompress(body)
+        if 'etag' in headers:
+            etags[path] = headers['etag']
+        rows.append((path, status, size))
+        total += size
+    writer.close()
+    await writer.wait_closed()
+    return total, rows
+
+
+async def run(firmware):
+    server = await firmware.start_server('127.0.0.1', 0)
+    port = server.server.sockets[0].getsockname()[1]
+    paths = ['/'] + sorted(firmware.static_assets.paths())
+    etags = {}
+    first, first_rows = await visit(port, paths, etags)
+    reload, reload_rows = await visit(port, paths, etags)
+    while server.open_connections:
+        await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+
+    print('{0:>22} {1:>16} {2:>16}'.format('path', 'first visit (B)', 'reload (B)'))
+    for (path, status, size), (_, reload_status, reload_size) in zip(first_rows, reload_rows):
+        print('{0:>22} {1:>10} ({2}) {3:>10} ({4})'.format(path, size, status, reload_size, reload_status))
+    print('{0:>22} {1:>16} {2:>16}'.format('total', first, reload))
+
+
+def main():
+    conf, firmware = load_firmware()
+    os.chdir(SRC)
+    board.insert(0, 1, Resistor(1000))
+    firmware.measure_phase()
+    asyncio.run(run(firmware))
+
+
+if __name__ == '__main__':
+    main()
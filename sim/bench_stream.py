@@ -0,0 +1,99 @@
+"""
+Live stream under CPython: one client reads the event stream while a
+second one never reads, during a capacitor measurement. Prints the frames
+each client got or lost and the measurement time with and without the
+clients attached, and how soon closed connections are noticed.
+
+Run from the repository root:
+    python -m sim.bench_stream
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import time
+
+from sim.circuit import board, Capacitor
+from sim.clock import clock
+from sim.runtime import SRC, load_firmware
+
+REQUEST = b'GET /stream HTTP/1.1\r\nHost: tester\r\n\r\n'
+
+
+async def reader_client(port, counts):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(REQUEST)
+    await reader.readuntil(b'\r\n\r\n')
+    try:
+        while True:
+            frame = await reader.readuntil(b'\n\n')
+            event = frame.split(b'\n', 1)[0][len(b'event: '):].decode()
+            counts[event] = counts.get(event, 0) + 1
+    except (asyncio.IncompleteReadError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+async def stalled_client(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(REQUEST)
+    return writer
+
+
+def measure(firmware):
+    board.insert(1, 2, Capacitor(100 * 10**-6))
+    start_virtual = clock.now_us
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        firmware.measure_phase()
+    return clock.now_us - start_virtual, time.perf_counter() - start
+
+
+async def run(firmware, conf):
+    server = await firmware.start_server('127.0.0.1', 0)
+    port = server.server.sockets[0].getsockname()[1]
+    voltages = asyncio.create_task(firmware.stream_voltages())
+
+    alone = measure(firmware)
+
+    counts = {}
+    reading = asyncio.create_task(reader_client(port, counts))
+    stalled = await stalled_client(port)
+    await asyncio.sleep(0.5)
+    streamed = measure(firmware)
+    await asyncio.sleep(0.5)
+
+    hub = firmware.stream_hub
+    print('Published frames: {0}'.format(hub.published))
+    for i, client in enumerate(hub.clients):
+        print('Client {0}: sent {1}, dropped {2}, queued {3}'.format(
+            i, client.sent, client.dropped, len(client.frames)))
+    print('Reader received: {0}'.format(counts))
+    print('measure_phase without clients: {0} us virtual, {1:.1f} ms CPU'.format(alone[0], alone[1] * 1000))
+    print('measure_phase while streaming: {0} us virtual, {1:.1f} ms CPU'.format(streamed[0], streamed[1] * 1000))
+
+    voltages.cancel()
+    reading.cancel()
+    stalled.close()
+    # The stream handlers notice the closed connections without anything
+    # being published
+    start = time.perf_counter()
+    while server.open_connections and time.perf_counter() - start < 1:
+        await asyncio.sleep(0.01)
+    print('Closed connections removed after {0:.0f} ms, {1} clients left'.format(
+        (time.perf_counter() - start) * 1000, len(hub.clients)))
+    assert not hub.clients and not server.open_connections
+    server.close()
+    await server.wait_closed()
+
+
+def main():
+    conf, firmware = load_firmware()
+    os.chdir(SRC)
+    asyncio.run(run(firmware, conf))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Requests per second and peak Python heap per request of the result page:
+the previous per-request read, format and encode against the compiled
+Template streaming its chunks. Both write into an in-memory connection,
+so only the rendering is measured.
+
+Run from the repository root:
+    python -m sim.bench_template
+"""
+
+import asyncio
+import os
+import time
+import tracemalloc
+
+from sim.circuit import board, Capacitor
+from sim.runtime import SRC, load_firmware
+
+REQUESTS = 2000
+
+
+class Connection:
+    """
+    Stand-in StreamWriter that counts the bytes it is handed.
+    """
+    def __init__(self):
+        self.sent = 0
+        self.data = []
+        self.keep = False
+
+    def write(self, chunk):
+        self.sent += len(chunk)
+        if self.keep:
+            self.data.append(bytes(chunk))
+
+    async def drain(self):
+        pass
+
+
+def legacy_page(firmware, conf, values):
+    with open('template.html', 'r') as file:
+        template_content = file.read()
+    values = dict(values)
+    values.update(firmware.page_template.static)
+    rendered_content = template_content.format(**values)
+    response = 'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n' + rendered_content
+    return response.encode()
+
+
+async def legacy(firmware, conf, values, connection):
+    connection.write(legacy_page(firmware, conf, values))
+
+
+async def compiled(firmware, conf, values, connection):
+    # server.py is importable once load_firmware() has set up the path
+    from server import Response
+    await firmware.page_template.send(Response(connection, True), values)
+
+
+def measure(render, firmware, conf, values):
+    connection = Connection()
+    loop = asyncio.new_event_loop()
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        loop.run_until_complete(render(firmware, conf, values, connection))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    loop.run_until_complete(render(firmware, conf, values, connection))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    loop.close()
+    return REQUESTS / elapsed, peak
+
+
+def body(render, firmware, conf, values):
+    connection = Connection()
+    connection.keep = True
+    asyncio.run(render(firmware, conf, values, connection))
+    return b''.join(connection.data).split(b'\r\n\r\n', 1)[1]
+
+
+def main():
+    conf, firmware = load_firmware()
+    os.chdir(SRC)
+    board.insert(0, 1, Capacitor(10 * 10**-6))
+    firmware.charge_curve.reset(680)
+    for i in range(conf.charge_curve_size):
+        firmware.charge_curve.add(i * 40, i * 8000)
+    firmware.page_template = firmware.Template('template.html', {
+        'style_url': '/static/style.css?v=0',
+        'script_url': '/static/app.js?v=0',
+    })
+
+    capacitor = firmware.Capacitor(10.02)
+    values = {
+        'tp1': '0.0', 'tp2': '0.0', 'tp3': '0.0',
+        'component_name': capacitor.get_name(),
+        'component_image_url': capacitor.get_image(),
+        'component_characteristics': capacitor.get_data(),
+        'charge_curve': firmware.charge_curve_points(400, 100),
+    }
+
+    same = body(legacy, firmware, conf, values) == body(compiled, firmware, conf, values)
+    print('{0:>10} {1:>12} {2:>16}'.format('renderer', 'requests/s', 'peak heap (B)'))
+    for name, render in (('legacy', legacy), ('compiled', compiled)):
+        rate, peak = measure(render, firmware, conf, values)
+        print('{0:>10} {1:>12.0f} {2:>16}'.format(name, rate, peak))
+    print('Identical page body: {0}, template loads: {1}'.format(same, firmware.page_template.loads))
+    if not same:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
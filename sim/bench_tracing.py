@@ -0,0 +1,215 @@
+"""
+Cost of tracing in the capacitor charge loop: wall clock time per loop
+iteration of capture_charge_curve() with the per-sample trace point off,
+recording into the ring, printing, and stripped by python -O, next to the
+previous eager debug() call. Also counts the ADC reads per iteration of
+discharge_part() and checks the ring dump over HTTP and serial.
+
+Run from the repository root:
+    python -m sim.bench_tracing
+"""
+
+import asyncio
+import contextlib
+import io
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import tty
+
+from sim.circuit import board, Capacitor
+from sim.clock import clock, ADC_READ_US
+from sim.runtime import SRC, load_firmware
+
+from host_app.link import DeviceLink
+from protocol import MSG_LOG, MSG_ACK, MSG_GET_TRACE, STATUS_OK
+
+REPEATS = 10
+CALLS = 200000
+
+
+def legacy_debug_cost(debug_check):
+    """The previous conf.debug() with the message built by the caller, ns per call."""
+    state = {'index': 0}
+
+    def debug(message):
+        if debug_check:
+            print('$ ' + str(state['index']) + ": " + message)
+            state['index'] += 1
+
+    elapsed, value = 1234, 1500000
+    seconds = timeit.timeit(lambda: debug('Charging status: {0} us, TP Y: {1} v'.format(elapsed, value / 1000000)),
+                            number=CALLS)
+    return seconds * 1e9 / CALLS
+
+
+def charge_loop(firmware, conf):
+    """
+    Best of REPEATS: (us per iteration, iterations) of one 470 uF charge.
+    TP2 reads an ideal RC curve instead of solving the board, so the time
+    is that of the firmware loop alone.
+    """
+    tau_us = 470 * (680 + 2 * conf.pin_res)
+    tp = firmware.tp2
+    counter = [0, 0]
+
+    def read_uv():
+        clock.advance(ADC_READ_US)
+        counter[0] += 1
+        return int(conf.supply_uv * (1 - math.exp(-(clock.now_us - counter[1]) / tau_us)))
+
+    tp.get_uv = read_uv
+    best = None
+    try:
+        for _ in range(REPEATS):
+            counter[0] = 0
+            counter[1] = clock.now_us
+            start = time.perf_counter()
+            firmware.capture_charge_curve(firmware.tp1, tp, 680)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed / counter[0] < best[0]:
+                best = (elapsed / counter[0], counter[0])
+    finally:
+        del tp.get_uv
+    return best[0] * 1e6, best[1]
+
+
+def child():
+    """Runs under python -O: the guarded trace point is compiled out."""
+    conf, firmware = load_firmware()
+    firmware.log_capacitor.level = conf.LEVEL_TRACE
+    per_iteration, iterations = charge_loop(firmware, conf)
+    print(per_iteration, firmware.tracer.recorded, iterations)
+
+
+async def http_dump(firmware):
+    server = await firmware.start_server('127.0.0.1', 0)
+    port = server.server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET /api/v1/trace HTTP/1.1\r\nHost: tester\r\n\r\n')
+    response = await reader.read()
+    writer.close()
+    while server.open_connections:
+        await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+    return response.partition(b'\r\n\r\n')[2].decode().splitlines()
+
+
+def serial_dump(firmware):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    link = DeviceLink(io.FileIO(master, 'r+b', closefd=False))
+    lines = []
+
+    def host():
+        link.set_trace_levels(capacitor=firmware.LEVEL_DEBUG)
+        link.request_trace()
+        done = False
+        while not done:
+            for kind, value in link.read():
+                if kind == MSG_LOG:
+                    lines.append(value)
+                elif kind == MSG_ACK and value == (MSG_GET_TRACE, STATUS_OK):
+                    done = True
+
+    async def run():
+        task = asyncio.create_task(firmware.serial_loop(io.FileIO(slave, 'rb', closefd=False),
+                                                        io.FileIO(slave, 'wb', closefd=False)))
+        thread = threading.Thread(target=host)
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    firmware.init_serial()
+    asyncio.run(run())
+    os.close(master)
+    os.close(slave)
+    return lines
+
+
+def main():
+    if sys.argv[1:] == ['--child']:
+        child()
+        return
+
+    conf, firmware = load_firmware()
+    channel = firmware.log_capacitor
+    rows = []
+
+    channel.level = conf.LEVEL_INFO
+    off_us, iterations = charge_loop(firmware, conf)
+    rows.append(('trace point off', off_us))
+
+    channel.level = conf.LEVEL_TRACE
+    recorded = firmware.tracer.recorded
+    ring_us, _ = charge_loop(firmware, conf)
+    assert firmware.tracer.recorded - recorded > 0.9 * REPEATS * iterations
+    rows.append(('into the ring', ring_us))
+
+    firmware.tracer.print_level = conf.LEVEL_TRACE
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        print_us, _ = charge_loop(firmware, conf)
+    firmware.tracer.print_level = conf.LEVEL_OFF
+    rows.append(('ring and print', print_us))
+
+    output = subprocess.run([sys.executable, '-O', '-m', 'sim.bench_tracing', '--child'],
+                            capture_output=True, text=True, check=True).stdout.split()
+    stripped_us, stripped_records, stripped_iterations = float(output[0]), int(output[1]), int(output[2])
+    # Only the debug records of the decimation steps are left
+    assert stripped_records < REPEATS * stripped_iterations / 10
+    rows.append(('stripped (-O)', stripped_us))
+
+    legacy_ns = legacy_debug_cost(False)
+    rows.append(('old debug(), off', off_us + legacy_ns / 1000))
+
+    print('capacitor charge loop, {0} iterations, 470 uF on the 680 ohm path'.format(iterations))
+    for name, per_iteration in rows:
+        print('  {0:<18} {1:6.2f} us/iteration  {2:8.0f} iterations/s'.format(name, per_iteration, 1e6 / per_iteration))
+
+    # The same trace call, measured on its own
+    guarded = timeit.timeit('if __debug__:\n if ch.level >= 5:\n  ch.trace("x {0} {1}", e, v)',
+                            globals={'ch': channel, 'e': 1234, 'v': 1500000}, number=CALLS) * 1e9 / CALLS
+    channel.level = conf.LEVEL_INFO
+    guarded_off = timeit.timeit('if __debug__:\n if ch.level >= 5:\n  ch.trace("x {0} {1}", e, v)',
+                                globals={'ch': channel, 'e': 1234, 'v': 1500000}, number=CALLS) * 1e9 / CALLS
+    unguarded_off = timeit.timeit('ch.trace("x {0} {1}", e, v)',
+                                  globals={'ch': channel, 'e': 1234, 'v': 1500000}, number=CALLS) * 1e9 / CALLS
+    print('one trace point: guarded off {0:.0f} ns, call off {1:.0f} ns, recorded {2:.0f} ns; '
+          'old debug() off {3:.0f} ns'.format(guarded_off, unguarded_off, guarded, legacy_ns))
+
+    # One debug record per discharge poll
+    channel.level = conf.LEVEL_DEBUG
+    board.insert(0, 1, Capacitor(1000 * 10**-6))
+    firmware.capture_charge_curve(firmware.tp1, firmware.tp2, 680)
+    reads = board.adc_reads
+    recorded = firmware.tracer.recorded
+    loops = firmware.discharge_part(firmware.tp1, firmware.tp2, channel).get_polls()
+    assert firmware.tracer.recorded - recorded >= loops
+    reads = board.adc_reads - reads
+    print('discharge_part: {0} polls, {1} ADC reads, {2:.0f} per poll (4 before)'.format(
+        loops, reads, (reads - 2) / loops))
+
+    os.chdir(SRC)
+    firmware.tracer.clear()
+    firmware.measure_phase()
+    lines = asyncio.run(http_dump(firmware))
+    classified = [line for line in lines if ' info main: Classified' in line]
+    assert len(lines) == firmware.tracer.count and classified
+    print('HTTP dump:   {0} records, e.g. {1}'.format(len(lines), classified[0]))
+    lines = serial_dump(firmware)
+    assert channel.level == conf.LEVEL_DEBUG and len(lines) == firmware.tracer.count
+    print('serial dump: {0} records as MSG_LOG'.format(len(lines)))
+
+
+if __name__ == '__main__':
+    main()
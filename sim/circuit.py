@@ -0,0 +1,389 @@
+"""
+Model of the three test points and the part inserted between them.
+
+Each test point is a node driven through the shunted pin (pin_res), the
+680 ohm resistor and the 470k ohm resistor, with a small stray capacitance
+to ground. Parts are connected between two nodes. The node voltages are
+integrated on the virtual clock (backward Euler on the nodal equations)
+every time a pin changes or the ADC is read.
+"""
+
+from sim.clock import clock
+
+VCC = 3.3
+PIN_RES = 40
+# Leakage of a floating node to ground (ADC input, board)
+LEAK_RES = 100 * 10**6
+# Reverse resistance of a blocking diode
+DIODE_OFF_RES = 1000 * 10**6
+# Stray capacitance of a test point (socket, traces, ADC sample and hold)
+NODE_CAP = 100 * 10**-12
+# Backward Euler steps per update and the change below which the nodes are
+# considered to be at steady state
+STEPS = 8
+STEADY_V = 10**-7
+# Updates across an inductor take at least this many steps per time
+# constant, up to MAX_STEPS per update
+STEPS_PER_TAU = 40
+MAX_STEPS = 5000
+# What a short between two test points is modelled as
+SHORT_RES = 0.05
+
+
+class Resistor:
+    def __init__(self, resistance):
+        self.resistance = resistance
+
+    def conductance(self, h):
+        return 1 / self.resistance
+
+    def source(self, h):
+        return 0.0
+
+    def commit(self, v_a, v_b, h):
+        pass
+
+    def switch(self, v_a, v_b):
+        return False
+
+    def max_step(self):
+        return None
+
+    def restart(self):
+        pass
+
+
+class Short(Resistor):
+    def __init__(self):
+        super().__init__(SHORT_RES)
+
+
+class Capacitor:
+    """
+    Capacitor with an optional series resistance (ESR). Backward Euler
+    companion model: a conductance in parallel with a current source
+    standing for the charge held.
+    """
+    def __init__(self, capacitance, voltage=0.0, esr=0.0):
+        self.capacitance = capacitance
+        self.voltage = voltage
+        self.esr = esr
+
+    def conductance(self, h):
+        return 1 / (self.esr + h / self.capacitance)
+
+    def source(self, h):
+        return self.conductance(h) * self.voltage
+
+    def commit(self, v_a, v_b, h):
+        current = (v_a - v_b - self.voltage) * self.conductance(h)
+        self.voltage += current * h / self.capacitance
+
+    def switch(self, v_a, v_b):
+        return False
+
+    def max_step(self):
+        return None
+
+    def restart(self):
+        pass
+
+
+class Inductor:
+    """
+    Inductor with its winding resistance in series. Trapezoidal companion
+    model: a conductance in parallel with a current source standing for the
+    current through it and the voltage across it at the last step. The
+    voltage jumps when a pin changes, so the first step after it, and steps
+    longer than the time constant through 680 ohm where the trapezoidal
+    rule rings, are backward Euler as for the capacitor.
+    """
+    def __init__(self, inductance, resistance=1.0, current=0.0):
+        self.inductance = inductance
+        self.resistance = resistance
+        self.current = current
+        self.voltage = None
+
+    def trapezoidal(self, h):
+        return self.voltage is not None and h * (self.resistance + 680 + 2 * PIN_RES) <= self.inductance
+
+    def conductance(self, h):
+        if self.trapezoidal(h):
+            return h / (2 * self.inductance + h * self.resistance)
+        return 1 / (self.resistance + self.inductance / h)
+
+    def source(self, h):
+        if self.trapezoidal(h):
+            return -((2 * self.inductance - h * self.resistance) * self.current + h * self.voltage) / (
+                2 * self.inductance + h * self.resistance)
+        return -self.conductance(h) * self.inductance / h * self.current
+
+    def commit(self, v_a, v_b, h):
+        self.current = (v_a - v_b) * self.conductance(h) - self.source(h)
+        self.voltage = v_a - v_b
+
+    def switch(self, v_a, v_b):
+        return False
+
+    def max_step(self):
+        """
+        Longest step for the time constant through the 680 ohm resistor and
+        two pins, the shortest one a measurement looks at.
+        """
+        return self.inductance / (self.resistance + 680 + 2 * PIN_RES) / STEPS_PER_TAU
+
+    def restart(self):
+        self.voltage = None
+
+
+class Diode:
+    """
+    Piecewise linear diode, anode on the first node of the pair: a voltage
+    source of forward_voltage behind on_resistance when conducting, a
+    DIODE_OFF_RES leak when blocking.
+    """
+    def __init__(self, forward_voltage=0.65, on_resistance=10):
+        self.forward_voltage = forward_voltage
+        self.on_resistance = on_resistance
+        self.on = False
+
+    def conductance(self, h):
+        return 1 / self.on_resistance if self.on else 1 / DIODE_OFF_RES
+
+    def source(self, h):
+        return self.forward_voltage / self.on_resistance if self.on else 0.0
+
+    def commit(self, v_a, v_b, h):
+        pass
+
+    def switch(self, v_a, v_b):
+        """
+        Flip the conduction state if the solved voltages contradict it.
+
+        Returns:
+            bool: True if the step has to be solved again.
+        """
+        on = v_a - v_b > self.forward_voltage
+        if on == self.on:
+            return False
+        self.on = on
+        return True
+
+    def max_step(self):
+        return None
+
+    def restart(self):
+        pass
+
+
+class Source(Resistor):
+    """
+    Voltage source behind a resistance, positive on the first node of the
+    pair: a battery, or a part fed from outside, that no discharge empties.
+    """
+    def __init__(self, voltage, resistance=1.0):
+        super().__init__(resistance)
+        self.voltage = voltage
+
+    def source(self, h):
+        return self.voltage / self.resistance
+
+
+class Board:
+    def __init__(self):
+        # gpio -> (node, series resistance)
+        self.drive_pins = {}
+        # Output resistance of the pins of each node
+        self.pin_res = [PIN_RES] * 3
+        # gpio -> node
+        self.adc_pins = {}
+        # gpio -> driven level (1, 0) or None when floating
+        self.levels = {}
+        # (node_a, node_b) -> part
+        self.parts = {}
+        self.adc_reads = 0
+        self.v = [0.0, 0.0, 0.0]
+        self.updated_us = 0
+        self.steady = False
+        # Inverted nodal matrices by step length, valid until a pin, the
+        # part or a diode state changes
+        self.inverses = {}
+        self.drive = None
+        self.restarted = True
+
+    def wire(self, node, adc_pin, r0_pin, r1_pin, r2_pin):
+        self.adc_pins[adc_pin] = node
+        self.drive_pins[r0_pin] = (node, 0)
+        self.drive_pins[r1_pin] = (node, 680)
+        self.drive_pins[r2_pin] = (node, 470000)
+
+    def set_pin_res(self, node, pin_res):
+        """
+        Output resistance of the three pins of one test point, PIN_RES by
+        default.
+        """
+        self.update()
+        self.pin_res[node] = pin_res
+        self.changed()
+
+    def wire_from_conf(self, conf):
+        """
+        Wire the three nodes with the pin map from src/conf.py.
+        """
+        self.drive_pins = {}
+        self.adc_pins = {}
+        self.wire(0, conf.adc_tp1, *conf.tp1_pins)
+        self.wire(1, conf.adc_tp2, *conf.tp2_pins)
+        self.wire(2, conf.adc_tp3, *conf.tp3_pins)
+        self.changed()
+
+    def changed(self):
+        self.steady = False
+        self.inverses = {}
+        self.drive = None
+        self.restarted = True
+        for part in self.parts.values():
+            part.restart()
+
+    def insert(self, node_a, node_b, part):
+        self.update()
+        self.parts = {(node_a, node_b): part}
+        self.changed()
+
+    def connect(self, node_a, node_b, part):
+        """
+        Adds a part next to the ones already inserted, e.g. two shorts
+        joining all three test points.
+        """
+        self.update()
+        self.parts[(node_a, node_b)] = part
+        self.changed()
+
+    def remove(self):
+        self.update()
+        self.parts = {}
+        self.changed()
+
+    def set_level(self, gpio, level):
+        if self.levels.get(gpio, None) == level:
+            return
+        self.update()
+        self.levels[gpio] = level
+        self.changed()
+
+    def update(self):
+        """
+        Integrate the node voltages up to the current virtual time.
+        """
+        dt = (clock.now_us - self.updated_us) / 1000000
+        self.updated_us = clock.now_us
+        if dt <= 0 or self.steady:
+            return
+        steps = STEPS
+        parts = list(self.parts.items())
+        for _, part in parts:
+            limit = part.max_step()
+            if limit is not None:
+                steps = min(MAX_STEPS, max(steps, int(dt / limit) + 1))
+        h = dt / steps
+        for _ in range(steps):
+            # Diodes pick their state from the solution, a step is solved
+            # again until no part switches
+            for _ in range(4):
+                v = self.solve(h, parts)
+                switched = False
+                for (a, b), part in parts:
+                    if part.switch(v[a], v[b]):
+                        switched = True
+                if not switched:
+                    break
+                self.inverses = {}
+            for (a, b), part in parts:
+                part.commit(v[a], v[b], h)
+            if self.restarted:
+                # The first step after a change may have been solved with
+                # other companion models than the ones after it
+                self.restarted = False
+                self.inverses = {}
+            change = max(abs(v[0] - self.v[0]), abs(v[1] - self.v[1]), abs(v[2] - self.v[2]))
+            self.v = v
+            if change < STEADY_V:
+                self.steady = True
+                break
+
+    def drive_sources(self):
+        """
+        Conductance and current into every node from the driven pins.
+
+        Returns:
+            tuple: ([g] * 3, [i] * 3).
+        """
+        if self.drive is None:
+            g = [0.0] * 3
+            i = [0.0] * 3
+            for gpio, level in self.levels.items():
+                if level is None or gpio not in self.drive_pins:
+                    continue
+                node, series = self.drive_pins[gpio]
+                res = series + self.pin_res[node]
+                g[node] += 1 / res
+                i[node] += level * VCC / res
+            self.drive = (g, i)
+        return self.drive
+
+    def inverse(self, h, parts):
+        inverse = self.inverses.get(h)
+        if inverse is None:
+            drive_g = self.drive_sources()[0]
+            g = [[0.0] * 3 for _ in range(3)]
+            for n in range(3):
+                g[n][n] = 1 / LEAK_RES + NODE_CAP / h + drive_g[n]
+            for (a, b), part in parts:
+                c = part.conductance(h)
+                g[a][a] += c
+                g[b][b] += c
+                g[a][b] -= c
+                g[b][a] -= c
+            inverse = invert3(g)
+            self.inverses[h] = inverse
+        return inverse
+
+    def solve(self, h, parts):
+        """
+        One backward Euler step of length h: the nodal equations G v = I,
+        G from the cached inverse.
+
+        Returns:
+            list: The three node voltages.
+        """
+        m = self.inverse(h, parts)
+        drive_i = self.drive_sources()[1]
+        c = NODE_CAP / h
+        i = [drive_i[0] + c * self.v[0], drive_i[1] + c * self.v[1], drive_i[2] + c * self.v[2]]
+        for (a, b), part in parts:
+            j = part.source(h)
+            i[a] += j
+            i[b] -= j
+        return [m[0][0] * i[0] + m[0][1] * i[1] + m[0][2] * i[2],
+                m[1][0] * i[0] + m[1][1] * i[1] + m[1][2] * i[2],
+                m[2][0] * i[0] + m[2][1] * i[1] + m[2][2] * i[2]]
+
+    def read_uv(self, adc_pin):
+        self.adc_reads += 1
+        self.update()
+        v = self.v[self.adc_pins[adc_pin]]
+        return int(min(max(v, 0), VCC) * 1000000)
+
+
+def invert3(m):
+    (a, b, c), (d, e, f), (g, h, i) = m
+    A = e * i - f * h
+    B = f * g - d * i
+    C = d * h - e * g
+    det = a * A + b * B + c * C
+    return [[A / det, (c * h - b * i) / det, (b * f - c * e) / det],
+            [B / det, (a * i - c * g) / det, (c * d - a * f) / det],
+            [C / det, (b * g - a * h) / det, (a * e - b * d) / det]]
+
+
+board = Board()
@@ -0,0 +1,110 @@
+"""
+Virtual clock shared by the stand-in machine module and the time shim.
+"""
+
+import time as _time
+
+# Time one ADC conversion takes on the ESP32 (read_uv with calibration)
+ADC_READ_US = 40
+# Interpreter time of one Pin.init()/Pin.value() call
+PIN_OP_US = 2
+# Interpreter time of one ticks_us() call, lets busy-wait loops terminate
+TICKS_CALL_US = 1
+
+
+class Clock:
+    def __init__(self):
+        self.now_us = 0
+        # [deadline_us, period_us or 0, callback, owner]
+        self.timers = []
+        self.firing = False
+
+    def advance(self, us):
+        self.now_us += int(us)
+        if self.timers and not self.firing:
+            self.fire_due()
+
+    def reset(self):
+        self.now_us = 0
+        self.timers = []
+
+    def schedule(self, owner, delay_us, period_us, callback):
+        """
+        Call callback(owner) once the virtual time passes now + delay_us,
+        then every period_us if it is not 0.
+        """
+        self.cancel(owner)
+        self.timers.append([self.now_us + int(delay_us), int(period_us), callback, owner])
+
+    def cancel(self, owner):
+        self.timers = [t for t in self.timers if t[3] is not owner]
+
+    def fire_due(self):
+        # Callbacks run with the clock still moving (ADC reads, busy waits)
+        # but cannot re-enter each other, like soft timer callbacks
+        self.firing = True
+        try:
+            while True:
+                due = [t for t in self.timers if t[0] <= self.now_us]
+                if not due:
+                    break
+                timer = min(due, key=lambda t: t[0])
+                if timer[1]:
+                    timer[0] += timer[1]
+                else:
+                    self.timers.remove(timer)
+                timer[2](timer[3])
+        finally:
+            self.firing = False
+
+
+clock = Clock()
+
+
+def sleep(seconds):
+    clock.advance(seconds * 1000000)
+
+
+def sleep_ms(ms):
+    clock.advance(ms * 1000)
+
+
+def sleep_us(us):
+    clock.advance(us)
+
+
+def ticks_ms():
+    return clock.now_us // 1000
+
+
+def ticks_us():
+    clock.advance(TICKS_CALL_US)
+    return clock.now_us
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def ticks_diff(end, start):
+    return end - start
+
+
+def make_time_module():
+    """
+    Build a copy of the CPython time module with the MicroPython sleep and
+    ticks functions bound to the virtual clock.
+
+    Returns:
+        module: The shim module.
+    """
+    module = type(_time)('time')
+    module.__dict__.update(_time.__dict__)
+    module.sleep = sleep
+    module.sleep_ms = sleep_ms
+    module.sleep_us = sleep_us
+    module.ticks_ms = ticks_ms
+    module.ticks_us = ticks_us
+    module.ticks_add = ticks_add
+    module.ticks_diff = ticks_diff
+    return module
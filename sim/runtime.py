@@ -0,0 +1,44 @@
+"""
+Load the firmware modules from src/ under CPython with the stand-ins.
+"""
+
+import os
+import sys
+
+from sim import clock
+from sim.circuit import board
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(ROOT, 'sim', 'stubs')
+SRC = os.path.join(ROOT, 'src')
+
+
+def load_firmware(debug=False):
+    """
+    Import conf.py and main.py against the stand-in modules and wire the
+    simulated board from the firmware pin map.
+
+    Args:
+        debug (bool): Print the trace messages up to LEVEL_DEBUG.
+
+    Returns:
+        tuple: The (conf, main) modules with the test points initialized.
+    """
+    for path in (STUBS, SRC):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    # The firmware binds sleep/ticks at import time, so the shim only has
+    # to be visible while it is being imported
+    real_time = sys.modules['time']
+    sys.modules['time'] = clock.make_time_module()
+    try:
+        import conf
+        import main
+    finally:
+        sys.modules['time'] = real_time
+
+    main.tracer.print_level = conf.LEVEL_DEBUG if debug else conf.LEVEL_OFF
+    board.wire_from_conf(conf)
+    main.init_pins()
+    return conf, main
@@ -0,0 +1,156 @@
+"""
+Stand-in for the MicroPython machine module, backed by sim.circuit.board.
+
+Pin allocations and mode/level changes are counted in `stats` so the
+firmware's pin traffic can be benchmarked. The ADCs are ideal unless an
+AdcError is set for their pin in `adc_errors`.
+"""
+
+import random
+
+from sim.circuit import board
+from sim.clock import clock, ADC_READ_US, PIN_OP_US
+
+stats = {'pin_alloc': 0, 'pin_init': 0, 'pin_value': 0, 'adc_read': 0}
+
+
+# ADC gpio -> AdcError
+adc_errors = {}
+
+
+def reset_stats():
+    for key in stats:
+        stats[key] = 0
+
+
+class AdcError:
+    """
+    Transfer error of one ADC, like that left by the ESP32 eFuse
+    calibration: an offset, a gain error and a bow across the range, the
+    top compressed above knee_uv like the 11 dB attenuation, clamped to the
+    converter range and quantized to 12 bits. noise_uv adds gaussian noise
+    of that standard deviation, from a generator seeded with seed so runs
+    repeat.
+    """
+    def __init__(self, offset_uv=0, gain=1.0, bow_uv=0, knee_uv=None, full_uv=3300000, bits=12, noise_uv=0,
+                 seed=1):
+        self.offset_uv = offset_uv
+        self.gain = gain
+        self.bow_uv = bow_uv
+        self.knee_uv = knee_uv
+        self.full_uv = full_uv
+        self.lsb_uv = full_uv / (1 << bits)
+        self.noise_uv = noise_uv
+        self.rng = random.Random(seed)
+
+    def apply(self, uv):
+        x = uv / self.full_uv
+        value = self.offset_uv + self.gain * uv + 4 * self.bow_uv * x * (1 - x)
+        if self.knee_uv is not None and value > self.knee_uv:
+            value = self.knee_uv + (value - self.knee_uv) / 2
+        if self.noise_uv:
+            value += self.rng.gauss(0, self.noise_uv)
+        value = min(max(value, 0), self.full_uv)
+        return int(round(value / self.lsb_uv) * self.lsb_uv)
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_UP = 2
+    PULL_DOWN = 1
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        stats['pin_alloc'] += 1
+        self.id = id
+        self.mode = Pin.IN
+        self.level = 0
+        if mode != -1:
+            self._configure(mode, value)
+
+    def _configure(self, mode, value):
+        self.mode = mode
+        if value is not None:
+            self.level = 1 if value else 0
+        self._publish()
+
+    def _publish(self):
+        board.set_level(self.id, self.level if self.mode == Pin.OUT else None)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        stats['pin_init'] += 1
+        clock.advance(PIN_OP_US)
+        self._configure(self.mode if mode == -1 else mode, value)
+
+    def value(self, value=None):
+        if value is None:
+            return self.level
+        stats['pin_value'] += 1
+        clock.advance(PIN_OP_US)
+        self.level = 1 if value else 0
+        self._publish()
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+class ADC:
+    ATTN_0DB = 0
+    ATTN_2_5DB = 1
+    ATTN_6DB = 2
+    ATTN_11DB = 3
+
+    def __init__(self, pin):
+        self.pin = pin.id
+
+    def atten(self, atten):
+        pass
+
+    def read_uv(self):
+        stats['adc_read'] += 1
+        clock.advance(ADC_READ_US)
+        error = adc_errors.get(self.pin)
+        if error is None:
+            return board.read_uv(self.pin)
+        return error.apply(board.read_uv(self.pin))
+
+    def read(self):
+        return self.read_uv() * 4095 // 3300000
+
+
+class Timer:
+    """
+    Hardware timer whose callback fires when the virtual clock passes its
+    deadline, so sequences run deterministically.
+    """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id):
+        self.id = id
+
+    def init(self, mode=PERIODIC, period=-1, callback=None, freq=-1):
+        if freq > 0:
+            period_us = 1000000 // freq
+        else:
+            period_us = period * 1000
+        clock.schedule(self, period_us, period_us if mode == Timer.PERIODIC else 0, callback)
+
+    def deinit(self):
+        clock.cancel(self)
+
+
+irq_state = {'disabled': 0}
+
+
+def disable_irq():
+    irq_state['disabled'] += 1
+    return irq_state['disabled'] - 1
+
+
+def enable_irq(state):
+    irq_state['disabled'] = state
@@ -0,0 +1,72 @@
+"""
+Stand-in for the MicroPython network module. The station connects to the
+networks in access_points, after CONNECT_US of virtual time, and to nothing
+else.
+"""
+
+from sim.clock import clock
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_WRONG_PASSWORD = 202
+STAT_NO_AP_FOUND = 201
+STAT_GOT_IP = 1010
+
+# ssid -> password of the networks in range
+access_points = {}
+CONNECT_US = 1500000
+ADDRESS = '192.168.4.23'
+
+
+class WLAN:
+    def __init__(self, interface):
+        self.interface = interface
+        self._active = False
+        self._ssid = None
+        self._status = STAT_IDLE
+        self._connected_us = None
+
+    def active(self, active=None):
+        if active is None:
+            return self._active
+        self._active = active
+        if not active:
+            self.disconnect()
+
+    def connect(self, ssid, password):
+        self._ssid = ssid
+        if ssid not in access_points:
+            self._status = STAT_NO_AP_FOUND
+        elif access_points[ssid] != password:
+            self._status = STAT_WRONG_PASSWORD
+        else:
+            self._status = STAT_CONNECTING
+            self._connected_us = clock.now_us + CONNECT_US
+
+    def disconnect(self):
+        self._status = STAT_IDLE
+        self._connected_us = None
+
+    def status(self):
+        if self._status == STAT_CONNECTING and clock.now_us >= self._connected_us:
+            self._status = STAT_GOT_IP
+        return self._status
+
+    def isconnected(self):
+        return self._active and self.status() == STAT_GOT_IP
+
+    def scan(self):
+        return [(ssid.encode(), b'\x00' * 6, 1, -50, 3, False) for ssid in sorted(access_points)]
+
+    def config(self, *args, **kwargs):
+        if args == ('essid',):
+            return self._ssid or ''
+        return None
+
+    def ifconfig(self):
+        if self.isconnected():
+            return (ADDRESS, '255.255.255.0', '192.168.4.1', '192.168.4.1')
+        return ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
@@ -0,0 +1,299 @@
+"""
+Per test point ADC calibration.
+
+The guided routine in main.py reads every ADC in three conditions: the
+test points open, all three shorted together and a known resistor between
+TP1 and TP2. The pins drive known dividers in each of them, the 680 ohm
+and 470k ohm resistors against each other and against the pins, so every
+reading comes with the fraction of the supply it should have been.
+solve() turns these into the knots of a piecewise linear map from the
+read_uv() value to the true voltage for each ADC, which takes out offset,
+gain and bow together, and into the output resistance of the pins of each
+test point.
+
+Only the knots and pin resistances are stored, under 500 bytes. At boot
+they are expanded into an integer lookup table of TABLE_SIZE entries per
+test point, and a reading is corrected with a shift, two table reads and
+one multiply, without float math:
+
+    k = uv >> CAL_SHIFT
+    uv = table[k] + (((table[k + 1] - table[k]) * (uv & CAL_MASK)) >> CAL_SHIFT)
+
+The product stays below 2**30, within a MicroPython small int.
+"""
+
+import struct
+from array import array
+from binascii import crc32
+
+CAL_SHIFT = 14
+CAL_MASK = (1 << CAL_SHIFT) - 1
+# Table entries, readings up to 256 << CAL_SHIFT (4.19 V)
+TABLE_SIZE = 257
+MAX_KNOTS = 40
+# Readings closer than this are merged into one knot
+MERGE_UV = 4000
+
+# Magic and test point count, then per test point the pin resistance and
+# knot count followed by the knots, then the CRC-32 of all of it
+MAGIC = b'CAL1'
+HEADER = '<4sB'
+HEADER_SIZE = 5
+POINT = '<fB'
+POINT_SIZE = 5
+KNOT = '<ii'
+KNOT_SIZE = 8
+
+# Series resistor of pin 0 (shunt), 1 and 2
+SERIES = (0, 680, 470000)
+
+## Aux functions
+def build_table(knots):
+    """
+    Expands knots into the lookup table, linear between the knots and
+    continued with the slope of the first and last segment. A reading of 0
+    stays 0: with a negative offset it stands for every voltage below it,
+    and a discharged test point must not look charged.
+
+    Args:
+        knots (list): (read_uv() value, true microvolts) pairs sorted by
+            reading, at least two.
+
+    Returns:
+        array: array('i') of TABLE_SIZE true voltages at readings
+            k << CAL_SHIFT.
+    """
+    table = array('i', bytes(4 * TABLE_SIZE))
+    j = 0
+    last = len(knots) - 2
+    for k in range(1, TABLE_SIZE):
+        raw = k << CAL_SHIFT
+        while j < last and raw > knots[j + 1][0]:
+            j += 1
+        raw_a, true_a = knots[j]
+        raw_b, true_b = knots[j + 1]
+        table[k] = max(0, true_a + (true_b - true_a) * (raw - raw_a) // (raw_b - raw_a))
+    return table
+
+def correct(knots, uv):
+    """
+    The map of build_table() in floats, for the calibration itself.
+    """
+    j = 0
+    while j < len(knots) - 2 and uv > knots[j + 1][0]:
+        j += 1
+    raw_a, true_a = knots[j]
+    raw_b, true_b = knots[j + 1]
+    return true_a + (true_b - true_a) * (uv - raw_a) / (raw_b - raw_a)
+
+def node_fraction(states, members, pin_res):
+    """
+    Voltage of a node as a fraction of the supply.
+
+    Args:
+        states (tuple): (r0, r1, r2) drive state of each test point.
+        members (tuple): Indices of the test points joined into the node.
+        pin_res (list): Pin resistance of each test point.
+
+    Returns:
+        float: The fraction, None if nothing drives the node.
+    """
+    high = 0.0
+    total = 0.0
+    for i in members:
+        for pin in range(3):
+            state = states[i][pin]
+            if state:
+                g = 1 / (SERIES[pin] + pin_res[i])
+                total += g
+                if state > 0:
+                    high += g
+    return high / total if total else None
+
+def fit_knots(points):
+    """
+    Knots from (reading, true) points: points with readings within
+    MERGE_UV are averaged, and points that would make the map fall are
+    dropped, as are readings of 0, which an ADC with a negative offset
+    gives for a range of voltages.
+
+    Returns:
+        list: (reading, true) integer pairs sorted by reading.
+    """
+    points = sorted(point for point in points if point[0] > 0)
+    merged = []
+    group = []
+    for point in points:
+        if group and point[0] - group[0][0] > MERGE_UV:
+            merged.append(mean_point(group))
+            group = []
+        group.append(point)
+    if group:
+        merged.append(mean_point(group))
+    knots = []
+    for raw, true in merged:
+        if not knots or (raw > knots[-1][0] and true > knots[-1][1]):
+            knots.append((raw, true))
+    if len(knots) > MAX_KNOTS:
+        step = (len(knots) - 1) / (MAX_KNOTS - 1)
+        knots = [knots[round(i * step)] for i in range(MAX_KNOTS)]
+    return knots
+
+def mean_point(group):
+    n = len(group)
+    return (int(sum(p[0] for p in group) / n + 0.5), int(sum(p[1] for p in group) / n + 0.5))
+
+def solve(open_readings, short_readings, reference_readings, reference_ohm, pin_res, supply_uv, iterations=6):
+    """
+    Derives the knots and pin resistances from the readings of the three
+    calibration steps. Each reading is (states, (uv1, uv2, uv3)) with -1 for
+    test points that were not read.
+
+    The true voltage of the configurations near the rails depends on the
+    pin resistances, and the pin resistances are found from corrected
+    readings, so the two are refined in turn starting from pin_res. The
+    reference resistor between TP1 and TP2 gives the pin resistances of
+    TP1 and TP2, the shunted pins of TP1 and TP2 against that of TP3 in the
+    short give that of TP3. Those readings only say something about the
+    pin resistances and are left out of the knots, which would otherwise
+    confirm whatever pin resistances they were built with.
+
+    Args:
+        open_readings (list): Test points open, each driven on its own.
+        short_readings (list): All three test points shorted together.
+        reference_readings (list): reference_ohm between TP1 and TP2, the
+            shunted pin of one low and of the other high.
+        reference_ohm (float): The reference resistor.
+        pin_res (float): Nominal pin resistance to start from.
+        supply_uv (int): The supply the dividers divide.
+
+    Returns:
+        tuple: (pin resistance per test point, knots per test point). The
+            pin resistances are None if a test point has fewer than two
+            knots or the readings give no estimate of its pin resistance.
+    """
+    pin_res = [pin_res] * 3
+    knots = None
+    for _ in range(iterations):
+        knots = []
+        for tp in range(3):
+            points = []
+            for states, values in open_readings:
+                if values[tp] >= 0:
+                    points.append((values[tp], node_fraction(states, (tp,), pin_res) * supply_uv))
+            for states, values in short_readings:
+                if any(state[1] or state[2] for state in states):
+                    points.append((values[tp], node_fraction(states, (0, 1, 2), pin_res) * supply_uv))
+            knots.append(fit_knots(points))
+        if min(len(k) for k in knots) < 2:
+            return None, knots
+        pin_res = solve_pin_res(short_readings, reference_readings, reference_ohm, knots, supply_uv)
+        if pin_res is None:
+            return None, knots
+    return pin_res, knots
+
+def solve_pin_res(short_readings, reference_readings, reference_ohm, knots, supply_uv):
+    """
+    Returns:
+        list: Pin resistance per test point, None if the readings give no
+            estimate for one of them, e.g. with the reference resistor
+            missing.
+    """
+    estimates = [[], [], []]
+    for states, values in reference_readings:
+        low = 0 if states[0][0] < 0 else 1
+        high = 1 - low
+        v_low = correct(knots[low], values[low])
+        v_high = correct(knots[high], values[high])
+        current = (v_high - v_low) / reference_ohm
+        if current > 0:
+            estimates[low].append(v_low / current)
+            estimates[high].append((supply_uv - v_high) / current)
+    if not estimates[0] or not estimates[1]:
+        return None
+    pin_res = [sum(e) / len(e) for e in estimates[:2]]
+    pin_res.append(0.0)
+    # The shunted pin of TP1 or TP2 against that of TP3, the others floating
+    for states, values in short_readings:
+        driven = [i for i in range(3) if states[i] != (0, 0, 0)]
+        if len(driven) != 2 or 2 not in driven or any(states[i][1] or states[i][2] for i in driven):
+            continue
+        other = driven[0]
+        fraction = sum(correct(knots[i], values[i]) for i in range(3)) / 3 / supply_uv
+        if not 0 < fraction < 1:
+            continue
+        if states[2][0] < 0:
+            estimates[2].append(pin_res[other] * fraction / (1 - fraction))
+        else:
+            estimates[2].append(pin_res[other] * (1 - fraction) / fraction)
+    if not estimates[2]:
+        return None
+    pin_res[2] = sum(estimates[2]) / len(estimates[2])
+    return pin_res
+
+## Classes
+class Calibration:
+    def __init__(self):
+        """
+        Pin resistance and knots of each test point, see solve().
+
+        Returns:
+            None
+        """
+        self.points = []
+
+    def is_valid(self):
+        return len(self.points) == 3
+
+    def set_points(self, pin_res, knots):
+        self.points = [(pin_res[i], knots[i]) for i in range(len(knots))]
+
+    def to_bytes(self):
+        parts = [struct.pack(HEADER, MAGIC, len(self.points))]
+        for pin_res, knots in self.points:
+            parts.append(struct.pack(POINT, pin_res, len(knots)))
+            for raw, true in knots:
+                parts.append(struct.pack(KNOT, raw, true))
+        data = b''.join(parts)
+        return data + struct.pack('<I', crc32(data) & 0xFFFFFFFF)
+
+    def from_bytes(self, data):
+        """
+        Returns:
+            bool: False if data is not a whole calibration with a good CRC.
+        """
+        if len(data) < HEADER_SIZE + 4 or struct.unpack_from('<I', data, len(data) - 4)[0] != crc32(data[:-4]) & 0xFFFFFFFF:
+            return False
+        magic, count = struct.unpack_from(HEADER, data, 0)
+        if magic != MAGIC:
+            return False
+        offset = HEADER_SIZE
+        points = []
+        for _ in range(count):
+            pin_res, n = struct.unpack_from(POINT, data, offset)
+            offset += POINT_SIZE
+            knots = []
+            for _ in range(n):
+                knots.append(struct.unpack_from(KNOT, data, offset))
+                offset += KNOT_SIZE
+            points.append((pin_res, knots))
+        self.points = points
+        return True
+
+    def save(self, path):
+        data = self.to_bytes()
+        with open(path, 'wb') as file:
+            file.write(data)
+        return len(data)
+
+    def load(self, path):
+        """
+        Returns:
+            bool: True if a calibration was read from path.
+        """
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return False
+        return self.from_bytes(data)
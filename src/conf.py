@@ -1,5 +1,9 @@
 from machine import Pin, ADC
-from time import sleep
+from time import sleep, sleep_us, ticks_us, ticks_diff
+from array import array
+import math
+from tracing import LEVEL_OFF, LEVEL_ERROR, LEVEL_WARN, LEVEL_INFO, LEVEL_DEBUG, LEVEL_TRACE
+from calibration import CAL_SHIFT, CAL_MASK
 
 ## Pin definitions
 adc_tp1, adc_tp2, adc_tp3 = 39, 34, 35
@@ -8,88 +12,381 @@ tp2_pins = [26, 27, 14]
 tp3_pins = [12, 13, 15]
 
 ## Variable definitions
-debug_check = True
 wifi_enabled = True
 
+# Output resistance of a pin, replaced per test point by the calibration
 pin_res = 40
 
-debug_trace_index = 0
+## Oversampling depth per measurement (ADC readings averaged per value)
+resistance_samples = 10
+esr_samples = 100
+esr_cycles = 10
 
-css_style = """
-  <style>
-        body {
-            font-family: Arial, sans-serif;
-            margin: 0;
-            padding: 0;
-            background-color: #f0f0f0;
-        }
+## Timer-driven pulses (pulse.py)
+pulse_timer_id = 0
+# ESR pulses: time r1 is held high, time from low to the Ul reading, pulse period
+esr_high_us = 50
+esr_low_us = 4
+esr_period_us = 250
+# Time constants of the 680 ohm recharge path waited between ESR cycles
+# before settling, at most esr_recharge_max_us (the former fixed wait)
+esr_recharge_taus = 5
+esr_recharge_max_us = 5000
 
-        .container {
-            width: 80%;
-            margin: 20px auto;
-            background-color: #fff;
-            padding: 20px;
-            border-radius: 8px;
-            box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
-        }
+## Auto-ranging resistance measurement
+# Below this value the 680 ohm range is used, above it the 470k ohm range
+resistance_range_limit = 10000
+# Relative disagreement between the two directions that triggers more passes
+resistance_mismatch_tolerance = 0.02
+# Extra pass pairs run at most when the directions disagree
+resistance_escalation_pairs = 1
 
-        h1 {
-            color: #333;
-            text-align: center;
-        }
+## Capacitor charge curve capture
+# Samples kept per curve, the curve is decimated by two when it fills up
+charge_curve_size = 256
+# Supply voltage the capacitor charges towards
+supply_uv = 3300000
+# Charging stops at one time constant (0.632 * 3.3 V)
+charge_target_uv = 2085600
+charge_timeout_us = 3000000
+# Fewer samples than this before the target means the 680 ohm path is too
+# fast for the part and the 470k ohm path is used instead
+charge_min_samples = 16
+# Fewer samples than this on the 470k ohm path means there is no capacitor
+charge_detect_samples = 4
+# Smallest rise between two decimation steps that still counts as charging
+charge_plateau_uv = 2000
 
-        p {
-            color: #666;
-            font-size: 16px;
-            line-height: 1.6;
-            margin-bottom: 10px;
-        }
+## Part discharge (discharge_part)
+# Discharged once the part voltage is below this
+discharge_target_uv = 160000
+# A part charged above this may be fed from outside or charged above the
+# supply, it is not touched
+discharge_max_uv = 3200000
+# Most current through the shunted pins; above (pin resistance of both
+# test points) * this the part discharges through a 680 ohm resistor
+discharge_max_current_ua = 20000
+# First poll interval, doubled while the voltage does not visibly fall
+discharge_poll_us = 200
+discharge_max_poll_us = 100000
+# Fall between two polls below which the voltage counts as not falling
+discharge_noise_uv = 2000
+# Polls at discharge_max_poll_us without a fall before the part is stuck
+discharge_stuck_polls = 3
+# Parts the fitted exponential needs longer than this for are given up on
+discharge_timeout_us = 10000000
 
-        .component-info {
-            text-align: center;
-            margin-bottom: 20px;
-        }
+## Inductance measurement (measure_inductance_test)
+# Current is switched into the part from the shunted pin of one test point
+# and read across the 680 ohm resistor of the other. A first pulse read at
+# doubling times up to inductance_rise_us finds the time constant, parts
+# still rising by then are out of range
+inductance_rise_us = 20000
+# Pulse widths swept from 0 to inductance_span_tau time constants
+inductance_widths = 8
+inductance_span_tau = 3
+# Pulses averaged per width, more where that many take less than
+# inductance_average_us: fast parts leave only the tail of the rise to fit
+inductance_repeats = 16
+inductance_average_us = 100000
+# Time constants the current decays for between two pulses
+inductance_gap_tau = 8
+# Longest pulse sequence, run with interrupts disabled
+inductance_sequence_us = 20000
+# Fewer repeats are used where the whole inductance measurement (discharge,
+# rise and sweep) would take longer than this
+inductance_budget_us = 400000
+# Share of the final reading the first reading of the rise has still to
+# rise by. Time constants well below an ADC conversion read flat, those
+# parts are measured as resistors
+inductance_min_rise = 0.005
 
-        .component-info img {
-            width: 200px;
-            height: auto;
-            margin-bottom: 10px;
-        }
+## Test point pairs probed by classify (indices of TP1, TP2, TP3)
+scan_pair_indices = ((0, 1), (0, 2), (1, 2))
 
-        .test-points {
-            display: flex;
-            justify-content: center;
-            gap: 20px;
-            margin-bottom: 20px;
-        }
+## First-pass probe (classify_pair)
+# Both test points of a pair are shorted low this long before each probe
+probe_discharge_us = 100
+# Time between the two readings that reveal a charging part
+probe_dwell_us = 200
+# Longer hold that separates a large capacitor from a short or small resistor
+probe_confirm_us = 5000
+# Probe estimates below this many ohms get the longer hold
+probe_confirm_ohm = 100
+# Low-side reading above which current flows through the pair
+probe_conduct_uv = 150000
+# Change between two readings, or left-over charge, that marks a reactive part
+probe_reactive_uv = 10000
+# Reading on the 470k ohm probe above which the pair is not open
+probe_open_uv = 20000
+# Probe estimates below this many ohms are reported as a short
+probe_short_ohm = 2
+# Direction mismatch above which a pair conducting both ways is rectifying
+probe_rectify_mismatch = 0.5
 
-        .test-point {
-            background-color: #e0e0e0;
-            padding: 10px;
-            border-radius: 5px;
-            text-align: center;
-        }
+## Presence detection (measurement_loop)
+# Probe the test points for an inserted part and measure it on every change
+# instead of once at boot
+presence_enabled = True
+# Time between two presence probes
+presence_poll_ms = 20
+# Equal probes in a row before a change is accepted; insertion to the start
+# of the measurement takes at most presence_debounce * presence_poll_ms
+presence_debounce = 3
+# Each test point is read this long after its 470k ohm pull-up is switched
+# on, over four time constants of the 100 pF a bare test point has; parts
+# above about 100 pF still read low then
+presence_dwell_us = 200
+# A pulled-up test point below this voltage is connected to another one,
+# resistors up to about 4.7M ohm
+presence_threshold_uv = 3000000
 
-        .characteristics {
-            margin-bottom: 20px;
-        }
+## Web server (server.py)
+http_port = 80
+http_backlog = 5
+# Keep-alive connections idle this long are closed
+http_idle_timeout_s = 10
+http_max_header_bytes = 2048
+http_max_body_bytes = 1024
 
-        .characteristics h2 {
-            text-align: center;
-            color: #333;
-        }
+## Static assets (static.py, built by assets/build.py)
+static_manifest = 'static/manifest.json'
+static_chunk_bytes = 512
+static_max_age_s = 604800
+
+## Live stream (stream.py)
+# Events sent on /stream: tp (test point voltages), measurement (each
+# result) and curve_end (the charge curve once the charge ends). A
+# measurement holds the event loop, so the curve is not streamed while it
+# is taken, only the final curve goes out
+# Test point voltage frames per second
+stream_rate_hz = 10
+# ADC readings averaged into each voltage of a frame
+stream_samples = 4
+# Frames queued per client before the oldest ones are dropped
+stream_queue_frames = 32
+
+## Serial protocol (protocol.py)
+serial_enabled = True
+# The serial port is checked for incoming frames this often
+serial_poll_ms = 5
+# Largest frame payload accepted from host_app
+serial_max_payload = 1024
+# Samples per MSG_SAMPLES block of a charge curve
+serial_block_samples = 128
+
+## Measurement history (history.py)
+history_enabled = True
+history_directory = 'history'
+# 32 byte records per segment file and segment files kept, 1 MB in all
+history_segment_records = 1024
+history_segments = 32
+# Most records per HTTP page and per MSG_HISTORY frame
+history_page_max = 100
+history_frame_records = 30
+
+## Adaptive settling (TestPoint.settle)
+settle_tolerance_uv = 2000
+settle_poll_us = 20
+settle_timeout_us = 20000
+
+## ADC calibration (calibration.py)
+calibration_file = 'calibration.bin'
+# ADC readings averaged per test point and configuration
+calibration_samples = 32
+# Default value of the known resistor between TP1 and TP2, a few times the
+# pin resistance keeps both readings in mid range
+calibration_reference_ohm = 47
+# Pin resistances outside this range mean a step was done wrong
+calibration_min_pin_res = 5
+calibration_max_pin_res = 200
+# ESR Ul reading offset of an uncalibrated ADC
+esr_low_offset_uv = 140000
+
+## Tracing (tracing.py)
+# Level of every trace channel, and of single channels: wifi, server,
+# serial, history, probe, resistor, capacitor, diode, inductor, main
+trace_level = LEVEL_DEBUG
+trace_levels = {}
+# Records up to this level are printed as well as kept in the ring. The
+# console is the serial port host_app reads, leave it off unless debugging
+# at a terminal
+trace_print_level = LEVEL_OFF
+trace_ring_records = 256
+
+## Settings host_app may change (configure)
+# Type, lowest and highest value of each. Everything else is only read at
+# boot, or is state of main.py, and cannot be changed over serial
+tunable_settings = {
+    'resistance_samples': (int, 1, 1000),
+    'esr_samples': (int, 1, 1000),
+    'esr_cycles': (int, 1, 100),
+    'esr_high_us': (int, 1, 1000),
+    'esr_low_us': (int, 1, 1000),
+    'esr_period_us': (int, 10, 10000),
+    'esr_recharge_taus': (int, 0, 20),
+    'esr_recharge_max_us': (int, 0, 100000),
+    'resistance_range_limit': (int, 100, 1000000),
+    'resistance_mismatch_tolerance': (float, 0, 1),
+    'resistance_escalation_pairs': (int, 0, 3),
+    'charge_target_uv': (int, 100000, 3000000),
+    'charge_timeout_us': (int, 1000, 30000000),
+    'charge_min_samples': (int, 2, charge_curve_size),
+    'charge_detect_samples': (int, 1, charge_curve_size),
+    'charge_plateau_uv': (int, 0, 100000),
+    'discharge_target_uv': (int, 10000, 1000000),
+    'discharge_max_uv': (int, 1000000, 3300000),
+    'discharge_max_current_ua': (int, 1000, 40000),
+    'discharge_poll_us': (int, 10, 100000),
+    'discharge_max_poll_us': (int, 100, 1000000),
+    'discharge_noise_uv': (int, 0, 100000),
+    'discharge_stuck_polls': (int, 1, 100),
+    'discharge_timeout_us': (int, 1000, 60000000),
+    'inductance_rise_us': (int, 100, 100000),
+    'inductance_widths': (int, 3, 32),
+    'inductance_span_tau': (float, 0.5, 10),
+    'inductance_repeats': (int, 1, 64),
+    'inductance_average_us': (int, 0, 1000000),
+    'inductance_gap_tau': (float, 1, 20),
+    'inductance_sequence_us': (int, 1000, 100000),
+    'inductance_budget_us': (int, 10000, 5000000),
+    'inductance_min_rise': (float, 0, 0.5),
+    'probe_discharge_us': (int, 0, 100000),
+    'probe_dwell_us': (int, 10, 100000),
+    'probe_confirm_us': (int, 100, 1000000),
+    'probe_confirm_ohm': (int, 0, 100000),
+    'probe_conduct_uv': (int, 1000, 3000000),
+    'probe_reactive_uv': (int, 100, 1000000),
+    'probe_open_uv': (int, 100, 3000000),
+    'probe_short_ohm': (float, 0, 100),
+    'probe_rectify_mismatch': (float, 0, 1),
+    'presence_enabled': (bool, False, True),
+    'presence_poll_ms': (int, 1, 10000),
+    'presence_debounce': (int, 1, 100),
+    'presence_dwell_us': (int, 10, 100000),
+    'presence_threshold_uv': (int, 100000, 3300000),
+    'stream_rate_hz': (float, 0.1, 100),
+    'stream_samples': (int, 1, 1000),
+    'serial_poll_ms': (int, 1, 1000),
+    'serial_block_samples': (int, 1, 256),
+    'history_page_max': (int, 1, 1000),
+    'settle_tolerance_uv': (int, 100, 1000000),
+    'settle_poll_us': (int, 1, 10000),
+    'settle_timeout_us': (int, 100, 1000000),
+    'trace_level': (int, LEVEL_OFF, LEVEL_TRACE),
+    'trace_print_level': (int, LEVEL_OFF, LEVEL_TRACE),
+}
 
-        .characteristics p {
-            text-align: center;
-        }
-    </style>
-"""
 ## Aux functions
-def debug(message):
-    global debug_trace_index
-    if debug_check:
-        print('$ ' + str(debug_trace_index) + ": " + message)
-        debug_trace_index += 1
+def json_number(value):
+    """
+    A measured value as JSON can carry it: None for inf and nan, which
+    ujson would write as invalid JSON.
+    """
+    if value != value or value == float('inf') or value == float('-inf'):
+        return None
+    return value
+
+def new_sample_buffer(n):
+    """
+    Allocate a zeroed buffer for n raw microvolt readings.
+
+    Args:
+        n (int): Number of readings the buffer holds.
+
+    Returns:
+        array: An array('i') of length n.
+    """
+    return array('i', bytes(4 * n))
+
+def buffer_mean(buffer, n=None):
+    """
+    Integer mean of the first n readings of a sample buffer.
+
+    Args:
+        buffer (array): Raw microvolt readings.
+        n (int): Number of readings to use, defaults to the whole buffer.
+
+    Returns:
+        int: The mean in microvolts.
+    """
+    if n is None:
+        n = len(buffer)
+    total = 0
+    for i in range(n):
+        total += buffer[i]
+    return total // n
+
+def buffer_median(buffer, n=None):
+    """
+    Median of the first n readings of a sample buffer.
+
+    Returns:
+        int: The median in microvolts.
+    """
+    if n is None:
+        n = len(buffer)
+    ordered = sorted(buffer) if n == len(buffer) else sorted(buffer[:n])
+    if n & 1:
+        return ordered[n // 2]
+    return (ordered[n // 2 - 1] + ordered[n // 2]) // 2
+
+def buffer_trimmed_mean(buffer, n=None, trim=1):
+    """
+    Mean of the first n readings after dropping the trim lowest and trim
+    highest ones.
+
+    Returns:
+        int: The trimmed mean in microvolts.
+    """
+    if n is None:
+        n = len(buffer)
+    if n <= 2 * trim:
+        return buffer_median(buffer, n)
+    ordered = sorted(buffer) if n == len(buffer) else sorted(buffer[:n])
+    total = 0
+    for i in range(trim, n - trim):
+        total += ordered[i]
+    return total // (n - 2 * trim)
+
+def buffer_min_max(buffer, n=None):
+    """
+    Smallest and largest of the first n readings of a sample buffer.
+
+    Returns:
+        tuple: (min, max) in microvolts.
+    """
+    if n is None:
+        n = len(buffer)
+    low = high = buffer[0]
+    for i in range(1, n):
+        value = buffer[i]
+        if value < low:
+            low = value
+        elif value > high:
+            high = value
+    return low, high
+
+def set_pin_state(pin, old_state, new_state):
+    """
+    Switch an already constructed Pin to a new drive state.
+
+    Args:
+        pin (Pin): The cached Pin object.
+        old_state (int): The current state (1 high, -1 low, 0 floating).
+        new_state (int): The requested state (1 high, -1 low, 0 floating).
+
+    Returns:
+        None
+    """
+    if new_state == 0:
+        pin.init(Pin.IN)
+    elif old_state == 0:
+        # Input -> output, set the level together with the direction
+        pin.init(Pin.OUT, value=1 if new_state > 0 else 0)
+    else:
+        # Already an output, only the level changes
+        pin.value(1 if new_state > 0 else 0)
 
 ## Classes
 class TestPoint:
@@ -124,11 +421,131 @@ class TestPoint:
         self.r1_status = 0
         self.r2_status = 0
 
+        self.settle_time_us = 0
+
+        # Calibration lookup table (see calibration.py), None for the
+        # uncorrected readings, and the pin resistance
+        self.table = None
+        self.pin_res = pin_res
+
+    def set_calibration(self, table, pin_resistance):
+        """
+        Args:
+            table (array): The lookup table of build_table(), or None.
+            pin_resistance (float): Output resistance of the pins.
+
+        Returns:
+            None
+        """
+        self.table = table
+        self.pin_res = pin_resistance
+
+    def is_calibrated(self):
+        return self.table is not None
+
+    def correct(self, uv):
+        """
+        Corrects a raw read_uv() value with the calibration table.
+        """
+        table = self.table
+        if table is None:
+            return uv
+        k = uv >> CAL_SHIFT
+        low = table[k]
+        return low + (((table[k + 1] - low) * (uv & CAL_MASK)) >> CAL_SHIFT)
+
     def get_uv(self):
-        return self.adc.read_uv()
+        uv = self.adc.read_uv()
+        table = self.table
+        if table is None:
+            return uv
+        k = uv >> CAL_SHIFT
+        low = table[k]
+        return low + (((table[k + 1] - low) * (uv & CAL_MASK)) >> CAL_SHIFT)
 
     def get_v(self):
-        return self.get_uv() / 10**6
+        return self.get_uv() / 1000000
+
+    def sample(self, n, into=None):
+        """
+        Take n ADC readings back to back, corrected through the
+        calibration table with integer math.
+
+        Args:
+            n (int): Number of readings.
+            into (array): Optional pre-allocated array('i') of at least n
+                items, reused instead of allocating a new buffer.
+
+        Returns:
+            array: The buffer holding the readings in microvolts.
+        """
+        if into is None:
+            into = new_sample_buffer(n)
+        elif len(into) < n:
+            raise ValueError('Sample buffer too small')
+        read = self.adc.read_uv
+        table = self.table
+        if table is None:
+            for i in range(n):
+                into[i] = read()
+            return into
+        shift = CAL_SHIFT
+        mask = CAL_MASK
+        for i in range(n):
+            uv = read()
+            k = uv >> shift
+            low = table[k]
+            into[i] = low + (((table[k + 1] - low) * (uv & mask)) >> shift)
+        return into
+
+    def settle(self, tolerance_uv=None, timeout_us=None, min_us=0):
+        """
+        Wait until the test point voltage stops moving.
+
+        The ADC is polled with a doubling interval until two consecutive
+        readings differ by at most tolerance_uv. The growing interval
+        catches tails that move little between back to back readings, but
+        the first comparison comes settle_poll_us after the start: an RC
+        tail slower than about the full swing times settle_poll_us over
+        tolerance_uv, a large capacitor behind a series resistor, still
+        reads as settled at once. Callers that know the time constant pass
+        min_us to wait out most of it before polling. Only the change
+        matters, so the readings are not calibrated.
+
+        Args:
+            tolerance_uv (int): Allowed change between readings, defaults to
+                settle_tolerance_uv.
+            timeout_us (int): Give up after this long, defaults to
+                settle_timeout_us.
+            min_us (int): Dwell before the first reading, counted in the
+                settle time and the timeout.
+
+        Returns:
+            int: The observed settle time in microseconds, or -1 on timeout.
+        """
+        if tolerance_uv is None:
+            tolerance_uv = settle_tolerance_uv
+        if timeout_us is None:
+            timeout_us = settle_timeout_us
+
+        read = self.adc.read_uv
+        start = ticks_us()
+        if min_us > 0:
+            sleep_us(min_us)
+        interval = settle_poll_us
+        last = read()
+        while True:
+            sleep_us(interval)
+            value = read()
+            elapsed = ticks_diff(ticks_us(), start)
+            if -tolerance_uv <= value - last <= tolerance_uv:
+                self.settle_time_us = elapsed
+                return elapsed
+            if elapsed > timeout_us:
+                self.settle_time_us = -1
+                return -1
+            last = value
+            interval += interval
 
     def get_status(self):
         return 'R0: {0}, R1: {1}, R2: {2}'.format(self.r0_status, self.r1_status, self.r2_status)
@@ -136,64 +553,472 @@ class TestPoint:
     def get_name(self):
         return self.name
     
+    def drive(self, r0, r1, r2):
+        """
+        Apply a complete drive state to the three resistor pins at once.
+
+        The Pin objects created in the constructor are reused; only the pins
+        whose state actually changes are touched. Pins being released are
+        switched first, so two resistors of the same test point never drive
+        the node at the same time.
+
+        Args:
+            r0 (int): State of the shunted pin (1 high, -1 low, 0 floating).
+            r1 (int): State of the 680 ohm resistor pin.
+            r2 (int): State of the 470k ohm resistor pin.
+
+        Returns:
+            None
+        """
+        if r0 == 0 and self.r0_status != 0:
+            self.r0.init(Pin.IN)
+            self.r0_status = 0
+        if r1 == 0 and self.r1_status != 0:
+            self.r1.init(Pin.IN)
+            self.r1_status = 0
+        if r2 == 0 and self.r2_status != 0:
+            self.r2.init(Pin.IN)
+            self.r2_status = 0
+
+        if r0 != self.r0_status:
+            set_pin_state(self.r0, self.r0_status, r0)
+            self.r0_status = r0
+        if r1 != self.r1_status:
+            set_pin_state(self.r1, self.r1_status, r1)
+            self.r1_status = r1
+        if r2 != self.r2_status:
+            set_pin_state(self.r2, self.r2_status, r2)
+            self.r2_status = r2
+
     def set_r0_high(self):
-        self.r0 = Pin(self.r0_pin, Pin.OUT)
-        self.r0.on()
-        self.r0_status = 1
-        self.set_r1_floating()
-        self.set_r2_floating()
+        self.drive(1, 0, 0)
 
     def set_r0_low(self):
-        self.r0 = Pin(self.r0_pin, Pin.OUT)
-        self.r0.off()
-        self.r0_status = -1
-        self.set_r1_floating()
-        self.set_r2_floating()
+        self.drive(-1, 0, 0)
 
     def set_r0_floating(self):
-        self.r0_status = 0
-        self.r0 = Pin(self.r0_pin, Pin.IN)
+        self.drive(0, self.r1_status, self.r2_status)
 
     def set_r1_high(self):
-        self.r1 = Pin(self.r1_pin, Pin.OUT)
-        self.r1.on()
-        self.r1_status = 1
-        self.set_r0_floating()
-        self.set_r2_floating()
+        self.drive(0, 1, 0)
 
     def set_r1_low(self):
-        self.r1 = Pin(self.r1_pin, Pin.OUT)
-        self.r1.off()
-        self.r1_status = -1
-        self.set_r0_floating()
-        self.set_r2_floating()
+        self.drive(0, -1, 0)
 
     def set_r1_floating(self):
-        self.r1_status = 0
-        self.r1 = Pin(self.r1_pin, Pin.IN)
+        self.drive(self.r0_status, 0, self.r2_status)
 
     def set_r2_high(self):
-        self.r2 = Pin(self.r2_pin, Pin.OUT)
-        self.r2.on()
-        self.r2_status = 1
-        self.set_r1_floating()
-        self.set_r0_floating()
+        self.drive(0, 0, 1)
 
     def set_r2_low(self):
-        self.r2 = Pin(self.r2_pin, Pin.OUT)
-        self.r2.off()
-        self.r2_status = -1
-        self.set_r1_floating()
-        self.set_r0_floating()
+        self.drive(0, 0, -1)
 
     def set_r2_floating(self):
-        self.r2_status = 0
-        self.r2 = Pin(self.r2_pin, Pin.IN)
+        self.drive(self.r0_status, self.r1_status, 0)
 
     def set_pins_floating(self):
-        self.set_r0_floating()
-        self.set_r1_floating()
-        self.set_r2_floating()
+        self.drive(0, 0, 0)
+
+# Time-stamped capacitor charge curve
+class ChargeCurve:
+    def __init__(self, size):
+        """
+        Pre-allocates the sample storage of a charge curve.
+
+        The curve keeps the whole charge in a fixed amount of memory: when
+        the buffers fill up every other sample is dropped and from then on
+        only every second (fourth, ...) sample is recorded.
+
+        Args:
+            size (int): Number of samples kept, should be even.
+        """
+        self.size = size
+        self.times = new_sample_buffer(size)
+        self.values = new_sample_buffer(size)
+        self.count = 0
+        self.stride = 1
+        self.skip = 0
+        self.series_resistance = 0
+
+    def reset(self, series_resistance):
+        self.count = 0
+        self.stride = 1
+        self.skip = 0
+        self.series_resistance = series_resistance
+
+    def add(self, time_us, value_uv):
+        """
+        Records a sample, honouring the current decimation stride.
+
+        Returns:
+            bool: True if the buffers were decimated by this sample.
+        """
+        if self.skip:
+            self.skip -= 1
+            return False
+        decimated = False
+        if self.count == self.size:
+            self.decimate()
+            decimated = True
+        self.times[self.count] = time_us
+        self.values[self.count] = value_uv
+        self.count += 1
+        self.skip = self.stride - 1
+        return decimated
+
+    def decimate(self):
+        half = self.size // 2
+        times = self.times
+        values = self.values
+        for i in range(half):
+            times[i] = times[2 * i]
+            values[i] = values[2 * i]
+        self.count = half
+        self.stride += self.stride
+
+    def get_count(self):
+        return self.count
+
+    def get_series_resistance(self):
+        return self.series_resistance
+
+    def get_last(self):
+        return self.values[self.count - 1] if self.count else 0
+
+    def fit_time_constant(self, supply):
+        """
+        Least squares fit of ln(supply - v) against t over the recorded
+        curve. The slope of that line is -1/RC.
+
+        Args:
+            supply (int): The voltage the curve charges towards in microvolts.
+
+        Returns:
+            float: The time constant in microseconds, 0 if it cannot be fit.
+        """
+        # Samples within 5 % of the rail are dominated by noise in the log
+        floor = supply // 20
+        n = 0
+        sx = sy = sxx = sxy = 0.0
+        for i in range(self.count):
+            remaining = supply - self.values[i]
+            if remaining <= floor:
+                continue
+            x = self.times[i]
+            y = math.log(remaining)
+            n += 1
+            sx += x
+            sy += y
+            sxx += x * x
+            sxy += x * y
+        if n < 3:
+            return 0
+        denominator = n * sxx - sx * sx
+        if denominator == 0:
+            return 0
+        slope = (n * sxy - sx * sy) / denominator
+        if slope >= 0:
+            return 0
+        return -1 / slope
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The curve as plain lists, for JSON encoding.
+        """
+        return {
+            'series_resistance': self.series_resistance,
+            'stride': self.stride,
+            't_us': list(self.times[:self.count]),
+            'uv': list(self.values[:self.count]),
+        }
+
+# Result of an auto-ranging resistance measurement
+class ResistanceResult:
+    def __init__(self, resistance, range_used, mismatch, time_us, passes):
+        """
+        Args:
+            resistance (float): Measured resistance in ohms.
+            range_used (int): The series resistor of the range, 680 or 470000.
+            mismatch (float): Relative disagreement of the two directions.
+            time_us (int): Time the measurement took in microseconds.
+            passes (int): Number of measure_resistance_function passes run.
+        """
+        self.resistance = resistance
+        self.range_used = range_used
+        self.mismatch = mismatch
+        self.time_us = time_us
+        self.passes = passes
+
+    def get_resistance(self):
+        return self.resistance
+
+    def get_range(self):
+        return self.range_used
+
+    def get_mismatch(self):
+        return self.mismatch
+
+    def get_time_us(self):
+        return self.time_us
+
+    def get_passes(self):
+        return self.passes
+
+# First-pass classification of one pair of test points
+class PairProbe:
+    # Probe classes, in the order classify() prefers them
+    OPEN = 'open'
+    SHORT = 'short'
+    RESISTIVE = 'resistive'
+    REACTIVE = 'reactive'
+    INDUCTIVE = 'inductive'
+    RECTIFYING = 'rectifying'
+    RANK = (OPEN, SHORT, RESISTIVE, REACTIVE, INDUCTIVE, RECTIFYING)
+
+    def __init__(self, x, y, kind, confidence, estimate, time_us):
+        """
+        Args:
+            x (int): Index of the first test point.
+            y (int): Index of the second test point.
+            kind (str): One of the probe classes above.
+            confidence (float): 0 to 1, how clearly the readings fit kind.
+            estimate (float): Rough resistance in ohms for short and
+                resistive pairs, forward voltage in volts for rectifying
+                ones, 0 otherwise.
+            time_us (int): Time the probe took in microseconds.
+        """
+        self.x = x
+        self.y = y
+        self.kind = kind
+        self.confidence = confidence
+        self.estimate = estimate
+        self.time_us = time_us
+
+    def get_pair(self):
+        return self.x, self.y
+
+    def get_kind(self):
+        return self.kind
+
+    def get_confidence(self):
+        return self.confidence
+
+    def get_estimate(self):
+        return self.estimate
+
+    def get_time_us(self):
+        return self.time_us
+
+    def outranks(self, other):
+        """
+        True if this pair is the more informative one: the stronger class
+        first, the higher confidence within a class.
+        """
+        rank = PairProbe.RANK.index(self.kind)
+        other_rank = PairProbe.RANK.index(other.kind)
+        if rank != other_rank:
+            return rank > other_rank
+        return self.confidence > other.confidence
+
+    def get_summary(self):
+        return '{0}-{1}: {2} ({3}), estimate {4}, {5} us'.format(
+            self.x, self.y, self.kind, self.confidence, self.estimate, self.time_us)
+
+# Outcome of measure_phase: the component found and how sure we are
+class Classification:
+    def __init__(self, probe, component, confidence, probe_time_us, time_us):
+        """
+        Args:
+            probe (PairProbe): The pair the measurement was run on.
+            component (str): 'resistor', 'capacitor', 'diode', 'inductor' or
+                None if nothing was found.
+            confidence (float): 0 to 1, the probe confidence lowered by how
+                well the full measurement agreed with it.
+            probe_time_us (int): Time the probes of all pairs took.
+            time_us (int): Time from the first probe to the result.
+        """
+        self.probe = probe
+        self.component = component
+        self.confidence = confidence
+        self.probe_time_us = probe_time_us
+        self.time_us = time_us
+
+    def get_probe(self):
+        return self.probe
+
+    def get_component(self):
+        return self.component
+
+    def get_confidence(self):
+        return self.confidence
+
+    def get_probe_time_us(self):
+        return self.probe_time_us
+
+    def get_time_us(self):
+        return self.time_us
+
+# Outcome of discharging the part between two test points
+class DischargeResult:
+    DISCHARGED = 'discharged'
+    # Charged above discharge_max_uv, left alone
+    HIGH_VOLTAGE = 'high_voltage'
+    # Not falling, or too slowly to reach the target in time
+    STUCK = 'stuck'
+
+    def __init__(self, status, start_uv, residual_uv, time_us, polls):
+        """
+        Args:
+            status (str): One of the statuses above.
+            start_uv (int): Part voltage before the discharge.
+            residual_uv (int): Part voltage at the last poll.
+            time_us (int): Time the discharge took in microseconds.
+            polls (int): Readings of the part voltage after the first.
+        """
+        self.status = status
+        self.start_uv = start_uv
+        self.residual_uv = residual_uv
+        self.time_us = time_us
+        self.polls = polls
+
+    def get_status(self):
+        return self.status
+
+    def is_discharged(self):
+        return self.status == DischargeResult.DISCHARGED
+
+    def get_start_uv(self):
+        return self.start_uv
+
+    def get_residual_uv(self):
+        return self.residual_uv
+
+    def get_time_us(self):
+        return self.time_us
+
+    def get_polls(self):
+        return self.polls
+
+    def get_summary(self):
+        return '{0}: {1} uV to {2} uV in {3} us, {4} polls'.format(
+            self.status, self.start_uv, self.residual_uv, self.time_us, self.polls)
+
+# Outcome of the pulse width sweep of measure_inductance_test
+class InductanceResult:
+    MEASURED = 'measured'
+    # The first reading of the rise is already settled, or falls
+    NOT_INDUCTIVE = 'not_inductive'
+    # Still rising after inductance_rise_us, or the fit ran into its bounds
+    OUT_OF_RANGE = 'out_of_range'
+    TIMER_FAILED = 'timer_failed'
+
+    def __init__(self, status, inductance=0, resistance=0, tau_us=0, rms_uv=0, pulses=0, time_us=0):
+        """
+        Args:
+            status (str): One of the statuses above.
+            inductance (float): Inductance in mH.
+            resistance (float): Series resistance in ohms.
+            tau_us (float): Fitted time constant of the rise.
+            rms_uv (float): RMS residual of the fit over the widths.
+            pulses (int): Pulses averaged, over all widths.
+            time_us (int): Time the measurement took in microseconds.
+        """
+        self.status = status
+        self.inductance = inductance
+        self.resistance = resistance
+        self.tau_us = tau_us
+        self.rms_uv = rms_uv
+        self.pulses = pulses
+        self.time_us = time_us
+
+    def get_status(self):
+        return self.status
+
+    def is_measured(self):
+        return self.status == InductanceResult.MEASURED
+
+    def get_inductance(self):
+        return self.inductance
+
+    def get_resistance(self):
+        return self.resistance
+
+    def get_tau_us(self):
+        return self.tau_us
+
+    def get_rms_uv(self):
+        return self.rms_uv
+
+    def get_pulses(self):
+        return self.pulses
+
+    def get_time_us(self):
+        return self.time_us
+
+    def get_summary(self):
+        return '{0}: {1} mH, {2} ohm, tau {3} us, rms {4} uV, {5} pulses in {6} us'.format(
+            self.status, self.inductance, self.resistance, self.tau_us, self.rms_uv, self.pulses, self.time_us)
+
+# Debounced state of the test points between measurements
+class PresenceDebouncer:
+    def __init__(self, count):
+        """
+        Accepts a new presence signature once it was probed count times in
+        a row, so contact bounce while a part is inserted or pulled out
+        triggers nothing.
+
+        Args:
+            count (int): Equal probes needed for a change.
+
+        Returns:
+            None
+        """
+        self.count = count
+        self.value = None
+        self.candidate = None
+        self.seen = 0
+        self.first_ms = 0
+
+    def update(self, value, now_ms):
+        """
+        Args:
+            value (int): The signature of the latest probe.
+            now_ms (int): ticks_ms() of the probe.
+
+        Returns:
+            bool: True if value was just accepted as the new state.
+        """
+        if value == self.value:
+            self.candidate = None
+            self.seen = 0
+            return False
+        if value != self.candidate:
+            self.candidate = value
+            self.seen = 0
+            self.first_ms = now_ms
+        self.seen += 1
+        if self.seen < self.count:
+            return False
+        self.value = value
+        self.candidate = None
+        self.seen = 0
+        return True
+
+    def get_value(self):
+        return self.value
+
+    def get_first_ms(self):
+        """
+        ticks_ms() of the first probe that saw the accepted state.
+        """
+        return self.first_ms
+
+    def reset(self):
+        self.value = None
+        self.candidate = None
+        self.seen = 0
 
 # Class to handle the detected components
 class Component:
@@ -210,19 +1035,29 @@ class Component:
     
     def get_data(self):
         return self.data
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The measured values, for JSON encoding.
+        """
+        return {}
     
 class Resistor(Component):
     def __init__(self, resistance = 0):
         
         self.resistance = resistance
         name = 'Resistor'
-        image = '<img loading="eager" width="128" height="128" src="https://symbols-electrical.getvecta.com/stencil_229/84_resistor.1469eb6bed.svg" alt="Resistor" title="Resistor" style="transform: rotate(90deg);">'
+        image = '<img loading="eager" width="128" height="128" src="/static/resistor.svg" alt="Resistor" title="Resistor">'
         data = 'Resistance: {resistance} Ω'
         data = data.replace('{resistance}', str(resistance))
         super().__init__(name, image, data)
 
     def get_resistance(self):
         return self.resistance
+
+    def to_dict(self):
+        return {'resistance': json_number(self.resistance)}
     
 class Capacitor(Component):
     def __init__(self, capacitance = 0):
@@ -231,7 +1066,7 @@ class Capacitor(Component):
         self.df = 1
         self.capacitance = capacitance
         name = 'Capacitor'
-        image = '<img loading="eager" width="128" height="128" src="https://symbols-electrical.getvecta.com/stencil_229/82_capacitor.4925a40124.svg" alt="Capacitor" title="Capacitor" style="transform: rotate(90deg);">'
+        image = '<img loading="eager" width="128" height="128" src="/static/capacitor.svg" alt="Capacitor" title="Capacitor">'
         data = 'Capacitance: {capacitance} uF <br>ESR: {esr} Ω <br>Q factor: {qf} <br>D factor: {df}'
 
         super().__init__(name, image, data)
@@ -247,6 +1082,14 @@ class Capacitor(Component):
 
     def set_df(self, df):
         self.df = df
+
+    def to_dict(self):
+        return {
+            'capacitance_uf': json_number(self.capacitance),
+            'esr': json_number(self.esr),
+            'q_factor': json_number(self.qf),
+            'd_factor': json_number(self.df),
+        }
         
     def update_data(self):
         self.data = 'Capacitance: {capacitance} uF <br>ESR: {esr} Ω <br>Q factor: {qf} <br>D factor: {df}'
@@ -258,8 +1101,9 @@ class Capacitor(Component):
 class Diode(Component):
     def __init__(self, forward_voltage = 0, flow_direction = [0, 0]):
         self.forward_voltage = forward_voltage
+        self.flow_direction = flow_direction
         name = 'Diode'
-        image = '<img loading="eager" width="128" height="128" src="https://symbols-electrical.getvecta.com/stencil_229/89_diode.9094b2b79b.svg" alt="Diode" title="Diode" style="transform: rotate(90deg);">'
+        image = '<img loading="eager" width="128" height="128" src="/static/diode.svg" alt="Diode" title="Diode">'
         data = 'Forward voltage: {forward_voltage} V<br> Flow direction: {flow_direction[0]} -> {flow_direction[1]}'
         data = data.replace('{forward_voltage}', str(forward_voltage))
         data = data.replace('{flow_direction[0]}', str(flow_direction[0]))
@@ -269,6 +1113,13 @@ class Diode(Component):
     def get_forward_voltage(self):
         return self.forward_voltage
 
+    def to_dict(self):
+        return {
+            'forward_voltage': json_number(self.forward_voltage),
+            'anode': self.flow_direction[0],
+            'cathode': self.flow_direction[1],
+        }
+
 class Inductor(Component):
     def __init__(self, inductance = 0):
         self.inductance = inductance
@@ -276,7 +1127,7 @@ class Inductor(Component):
         self.qf = 1
         self.df = 1
         self.resistance = 0
-        image = '<img loading="eager" width="128" height="128" src="https://symbols-electrical.getvecta.com/stencil_229/83_inductor.abada104a4.svg" alt="Inductor" title="Inductor" style="transform: rotate(90deg);">'
+        image = '<img loading="eager" width="128" height="128" src="/static/inductor.svg" alt="Inductor" title="Inductor">'
         data = 'Inductance: {inductance} mH <br>Resistance: {resistance} Ω <br>Q factor: {qf} <br>D factor: {df}'
 
         super().__init__(name, image, data)
@@ -293,6 +1144,14 @@ class Inductor(Component):
     def set_resistance(self, resistance):
         self.resistance = resistance
 
+    def to_dict(self):
+        return {
+            'inductance_mh': json_number(self.inductance),
+            'resistance': json_number(self.resistance),
+            'q_factor': json_number(self.qf),
+            'd_factor': json_number(self.df),
+        }
+
     def update_data(self):
         data = 'Inductance: {inductance} mH <br>Resistance: {resistance} Ω <br>Q factor: {qf} <br>D factor: {df}'
         self.data = self.data.replace('{inductance}', str(self.inductance))
@@ -0,0 +1,212 @@
+"""
+Append-only measurement history in flash.
+
+Records are fixed size and packed with struct, see RECORD_FORMAT. They are
+appended to segment files of segment_records records each; when there are
+more than max_segments files the oldest one is deleted, so the log never
+rewrites old data and the writes move through the file system. Only the
+first sequence number and record count of every segment are kept in RAM.
+"""
+
+import struct
+from binascii import crc32
+try:
+    import uos as os
+except ImportError:
+    import os
+
+# seq, time, duration_us, component, probe kind, pair a, pair b, three
+# values, crc32 of the other fields
+RECORD_FORMAT = '<IIIBBBBfffI'
+RECORD_SIZE = 32
+COMPONENTS = (None, 'resistor', 'capacitor', 'diode', 'inductor')
+KINDS = (None, 'open', 'short', 'resistive', 'reactive', 'rectifying', 'inductive')
+# Names of the three values per component
+VALUE_NAMES = {
+    'resistor': ('resistance', None, None),
+    'capacitor': ('capacitance_uf', 'esr', 'q_factor'),
+    'diode': ('forward_voltage', None, None),
+    'inductor': ('inductance_mh', 'resistance', 'q_factor'),
+}
+
+## Aux functions
+def pack_record(buffer, seq, time_s, duration_us, component, kind, a, b, v1, v2, v3):
+    """
+    Packs a record into buffer, a bytearray of RECORD_SIZE.
+    """
+    struct.pack_into(RECORD_FORMAT, buffer, 0, seq, time_s, duration_us, COMPONENTS.index(component),
+                     KINDS.index(kind), a, b, v1, v2, v3, 0)
+    crc = crc32(memoryview(buffer)[:RECORD_SIZE - 4]) & 0xFFFFFFFF
+    struct.pack_into('<I', buffer, RECORD_SIZE - 4, crc)
+
+def unpack_record(buffer, offset=0):
+    """
+    Returns:
+        dict: The record, None if its CRC does not match.
+    """
+    fields = struct.unpack_from(RECORD_FORMAT, buffer, offset)
+    if crc32(memoryview(buffer)[offset:offset + RECORD_SIZE - 4]) & 0xFFFFFFFF != fields[10]:
+        return None
+    component = COMPONENTS[fields[3]] if fields[3] < len(COMPONENTS) else None
+    record = {
+        'seq': fields[0],
+        'time': fields[1],
+        'duration_us': fields[2],
+        'component': component,
+        'probe': KINDS[fields[4]] if fields[4] < len(KINDS) else None,
+        'pair': [fields[5], fields[6]],
+        'values': {},
+    }
+    names = VALUE_NAMES.get(component, ())
+    for i in range(len(names)):
+        if names[i] is not None:
+            value = fields[7 + i]
+            # nan and inf are not valid JSON
+            record['values'][names[i]] = value if value == value and value not in (float('inf'), float('-inf')) else None
+    return record
+
+## Classes
+class History:
+    def __init__(self, directory, segment_records=1024, max_segments=32, page_records=16):
+        """
+        Args:
+            directory (str): Directory of the segment files, created if missing.
+            segment_records (int): Records per segment file.
+            max_segments (int): Segments kept; the oldest is deleted first.
+            page_records (int): Records read from flash at a time.
+
+        Returns:
+            None
+        """
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.record = bytearray(RECORD_SIZE)
+        self.page = bytearray(RECORD_SIZE * page_records)
+        self.page_records = page_records
+        # [segment number, first seq, record count], oldest first
+        self.segments = []
+        self.appended = 0
+
+    def path(self, number):
+        return '{0}/seg-{1:05d}.bin'.format(self.directory, number)
+
+    def open(self):
+        """
+        Builds the index from the segment files: one stat and one record
+        read per segment. A segment ending in a torn record is closed, new
+        records go to a fresh one.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            os.mkdir(self.directory)
+            names = []
+        numbers = []
+        for name in names:
+            if name.startswith('seg-') and name.endswith('.bin'):
+                numbers.append(int(name[4:-4]))
+        numbers.sort()
+        self.segments = []
+        torn = False
+        for number in numbers:
+            size = os.stat(self.path(number))[6]
+            count = size // RECORD_SIZE
+            if count == 0:
+                os.remove(self.path(number))
+                continue
+            with open(self.path(number), 'rb') as file:
+                file.readinto(self.record)
+            first = struct.unpack_from('<I', self.record, 0)[0]
+            self.segments.append([number, first, count])
+            torn = size % RECORD_SIZE != 0
+        if torn:
+            # Keep the whole records of a torn last write, but never append
+            # after it
+            number, first, count = self.segments[-1]
+            self.segments.append([number + 1, first + count, 0])
+
+    def get_first_seq(self):
+        return self.segments[0][1] if self.segments else 0
+
+    def get_next_seq(self):
+        """
+        The sequence number the next record should carry.
+        """
+        if not self.segments:
+            return 1
+        last = self.segments[-1]
+        return last[1] + last[2]
+
+    def get_count(self):
+        count = 0
+        for segment in self.segments:
+            count += segment[2]
+        return count
+
+    def append(self, seq, time_s, duration_us, component, kind, a, b, v1=0.0, v2=0.0, v3=0.0):
+        """
+        Appends one record. Sequence numbers must increase by one; a gap,
+        e.g. after a reset of the firmware counter, starts a new segment.
+        """
+        pack_record(self.record, seq, time_s, duration_us, component, kind, a, b, v1, v2, v3)
+        if not self.segments:
+            self.segments.append([0, seq, 0])
+        last = self.segments[-1]
+        if last[2] >= self.segment_records or (last[2] and seq != last[1] + last[2]):
+            last = [last[0] + 1, seq, 0]
+            self.segments.append(last)
+            while len(self.segments) > self.max_segments:
+                os.remove(self.path(self.segments.pop(0)[0]))
+        if last[2] == 0:
+            last[1] = seq
+        with open(self.path(last[0]), 'ab') as file:
+            file.write(self.record)
+        last[2] += 1
+        self.appended += 1
+
+    def locate(self, seq):
+        """
+        Returns:
+            tuple: (segment index, record index) of the first record at or
+                after seq, None if there is none.
+        """
+        for i in range(len(self.segments)):
+            number, first, count = self.segments[i]
+            if seq < first + count:
+                return i, max(0, seq - first)
+        return None
+
+    def read(self, start_seq, limit, handler):
+        """
+        Calls handler(page, offset) for every record from start_seq on, up
+        to limit records. The records are read page_records at a time into
+        one reused buffer; handler must copy what it keeps.
+
+        Returns:
+            int: The number of records handed to handler.
+        """
+        position = self.locate(start_seq)
+        if position is None:
+            return 0
+        segment, index = position
+        done = 0
+        page = self.page
+        while done < limit and segment < len(self.segments):
+            number, first, count = self.segments[segment]
+            if count == 0:
+                segment += 1
+                continue
+            with open(self.path(number), 'rb') as file:
+                file.seek(index * RECORD_SIZE)
+                while done < limit and index < count:
+                    n = min(self.page_records, count - index, limit - done)
+                    view = memoryview(page)[:n * RECORD_SIZE]
+                    file.readinto(view)
+                    for i in range(n):
+                        handler(page, i * RECORD_SIZE)
+                    index += n
+                    done += n
+            segment += 1
+            index = 0
+        return done
@@ -1,20 +1,27 @@
 from conf import *
+from pulse import PulseSequence, PulseScheduler
+from server import HttpServer
+from template import Template
+from stream import StreamHub
+from static import StaticAssets
+from protocol import *
+from history import History, unpack_record
+from tracing import Tracer
+from calibration import Calibration, build_table, solve
 
 from machine import Pin, ADC, Timer
-from time import sleep, sleep_us, sleep_ms, ticks_ms, ticks_diff, ticks_us
-import _thread
+from time import sleep, sleep_us, sleep_ms, ticks_ms, ticks_diff, ticks_us, time
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 import network
-import socket
 import select
 import ujson
 import uos
 import math
-import _thread
-import select
 import sys
-
-rx_ch = select.poll() # new select object
-rx_ch.register(sys.stdin) # register the stdin file descriptor
+import conf
 
 tp1, tp2, tp3 = None, None, None
 
@@ -23,7 +30,44 @@ diode_component = Diode(0, [0, 0])
 capacitor_component = Capacitor(0)
 inductor_component = Inductor(0)
 
-detected_component = 0
+resistance_result = None
+inductance_result = None
+charge_curve = ChargeCurve(charge_curve_size)
+
+classification = None
+presence = None
+calibration = None
+# Readings of the calibration steps done so far, by step
+calibration_readings = {}
+# Incremented by every published measurement, served as the ETag of the API
+measurement_sequence = 0
+measurement_json = None
+measurement_log = None
+history_frame = None
+
+sample_buffer = None
+esr_sequence = None
+inductance_sequence = None
+pulse_scheduler = None
+http_server = None
+page_template = None
+static_assets = None
+stream_hub = StreamHub(stream_queue_frames)
+stream_buffer = None
+serial_decoder = None
+serial_out = None
+
+tracer = Tracer(trace_ring_records, trace_print_level, trace_level, trace_levels)
+log_main = tracer.channel('main')
+log_wifi = tracer.channel('wifi')
+log_server = tracer.channel('server')
+log_serial = tracer.channel('serial')
+log_history = tracer.channel('history')
+log_probe = tracer.channel('probe')
+log_resistor = tracer.channel('resistor')
+log_capacitor = tracer.channel('capacitor')
+log_diode = tracer.channel('diode')
+log_inductor = tracer.channel('inductor')
 
 def save_wifi_credentials(ssid, password):
     """
@@ -71,7 +115,7 @@ def connect_wifi(ssid, password):
         bool: True if the connection is successful, False otherwise.
     """
     if not ssid:  # Check if the SSID is empty
-        debug('SSID is empty. Exiting...')
+        log_wifi.warn('SSID is empty')
         return False
 
     wlan = network.WLAN(network.STA_IF)
@@ -79,61 +123,58 @@ def connect_wifi(ssid, password):
     wlan.active(True)
 
     if not wlan.isconnected():
-        debug('Connecting to WiFi...')
+        log_wifi.info('Connecting to {0}', ssid)
         wlan.connect(ssid, password)
         attempts = 0
         while not wlan.isconnected():
             if attempts > 10:
-                debug('Failed to connect after 10 attempts. Exiting...')
+                log_wifi.error('Failed to connect after 10 attempts')
                 return False
             sleep(1)
             attempts += 1
-    debug('Connected to WiFi: ' + ssid)
-    debug('IP address: ' + wlan.ifconfig()[0])
+    log_wifi.info('Connected to {0}, IP address {1}', ssid, wlan.ifconfig()[0])
     return True
     
-def handle_request(conn):
+def current_component():
+    """
+    The latest classification and the Component object holding its values.
+
+    Returns:
+        tuple: (component type, Component), (None, None) if nothing was found.
+    """
+    detected = classification.get_component() if classification is not None else None
+    components = {
+        'resistor': resistor_component,
+        'capacitor': capacitor_component,
+        'diode': diode_component,
+        'inductor': inductor_component,
+    }
+    return detected, components.get(detected)
+
+async def handle_request(request, response):
     """
-    Handles a client request by sending an HTTP response.
+    Renders the result page.
 
     Args:
-        conn (socket): The client socket.
+        request (Request): The parsed request.
+        response (Response): Where the page is sent.
 
     Returns:
         None
     """
     global resistor_component, diode_component, capacitor_component, inductor_component
-    global detected_component
-    template_content  = ""
-    
-    with open('template.html', 'r') as file:
-        template_content = file.read()
     
     component_name = ''
     component_image_url = ''
     component_characteristics = ''
     
-    debug('Detected component: {0}'.format(detected_component))
-    
-    if detected_component & 8:    
-        component_name = diode_component.get_name()
-        component_image_url = diode_component.get_image()
-        component_characteristics = diode_component.get_data()
-    elif detected_component == 3 or detected_component == 7:
-        component_name = capacitor_component.get_name()
-        component_image_url = capacitor_component.get_image()
-        component_characteristics = capacitor_component.get_data()
-        print(component_characteristics)
-    elif detected_component == 1:
-        component_name = resistor_component.get_name()
-        component_image_url = resistor_component.get_image()
-        component_characteristics = resistor_component.get_data()
-    elif detected_component & 5:
-        component_name = inductor_component.get_name()
-        component_image_url = inductor_component.get_image()
-        component_characteristics = inductor_component.get_data()
-        
-    detected_component = 0
+    detected, component = current_component()
+    log_server.debug('Detected component: {0}', detected)
+    
+    if component is not None:
+        component_name = component.get_name()
+        component_image_url = component.get_image()
+        component_characteristics = component.get_data()
     
     dynamic_data = {
         'tp1': str(tp1.get_v()),
@@ -142,82 +183,468 @@ def handle_request(conn):
         'component_name': component_name,
         'component_image_url': component_image_url,
         'component_characteristics': component_characteristics,
-        'css_style': css_style,
+        'charge_curve': charge_curve_points(400, 100),
     }
     
-    rendered_content = template_content.format(**dynamic_data)
+    response.add_header('Cache-Control', 'no-cache')
+    await page_template.send(response, dynamic_data)
+
+def publish_measurement(trigger='request'):
+    """
+    Encodes the latest classification once for the JSON API and bumps the
+    measurement sequence number, so polls in between cost no rendering.
+
+    Args:
+        trigger (str): 'request' for a measurement asked for over serial or
+            at boot, 'presence' for one started by a part being inserted,
+            changed or removed.
+
+    Returns:
+        int: The new sequence number.
+    """
+    global measurement_sequence, measurement_json
+    measurement_sequence += 1
+    
+    tps = (tp1, tp2, tp3)
+    detected, component = current_component()
+    result = {
+        'seq': measurement_sequence,
+        'component': detected,
+        'values': component.to_dict() if component is not None else {},
+        'tp_uv': [tp.get_uv() for tp in tps],
+        'uptime_ms': ticks_ms(),
+        'time': time(),
+        'trigger': trigger,
+    }
+    if classification is not None:
+        probe = classification.get_probe()
+        x, y = probe.get_pair()
+        result['pair'] = [tps[x].get_name(), tps[y].get_name()]
+        result['probe'] = probe.get_kind()
+        result['confidence'] = classification.get_confidence()
+        result['duration_us'] = classification.get_time_us()
+    measurement_json = ujson.dumps(result).encode()
+    if measurement_log is not None:
+        record_measurement(detected, component)
+    return measurement_sequence
+
+def init_history():
+    """
+    Opens the measurement history and continues its sequence numbers, so
+    they, and the ETag of the JSON API, keep increasing across resets.
+    """
+    global measurement_log, measurement_sequence, history_frame
+    measurement_log = History(history_directory, history_segment_records, history_segments)
+    measurement_log.open()
+    measurement_sequence = measurement_log.get_next_seq() - 1
+    history_frame = bytearray(HISTORY_HEADER_SIZE + 32 * history_frame_records)
+    log_history.info('{0} records from seq {1}', measurement_log.get_count(), measurement_log.get_first_seq())
+
+def record_measurement(detected, component):
+    """
+    Appends the latest measurement to the history as one 32 byte record.
+    """
+    kind = None
+    a = b = 0
+    duration_us = 0
+    if classification is not None:
+        probe = classification.get_probe()
+        kind = probe.get_kind()
+        a, b = probe.get_pair()
+        duration_us = classification.get_time_us()
+    values = (0.0, 0.0, 0.0)
+    if detected == 'resistor':
+        values = (component.resistance, 0.0, 0.0)
+    elif detected == 'capacitor':
+        values = (component.capacitance, component.esr, component.qf)
+    elif detected == 'diode':
+        names = [tp.get_name() for tp in (tp1, tp2, tp3)]
+        a = names.index(component.flow_direction[0])
+        b = names.index(component.flow_direction[1])
+        values = (component.forward_voltage, 0.0, 0.0)
+    elif detected == 'inductor':
+        values = (component.inductance, component.resistance, component.qf)
+    values = [math.nan if value is None else value for value in values]
+    measurement_log.append(measurement_sequence, int(time()), duration_us, detected, kind, a, b,
+                           values[0], values[1], values[2])
+
+def history_range(request_start, limit):
+    """
+    The first sequence number of a page: request_start if given, else the
+    newest limit records.
+    """
+    first = measurement_log.get_first_seq()
+    if request_start is None:
+        return max(first, measurement_log.get_next_seq() - limit)
+    return max(first, request_start)
+
+async def handle_api_history(request, response):
+    """
+    Serves a page of the measurement history as JSON, ?start=<seq> and
+    ?limit=<n> (at most history_page_max), newest page by default. The
+    records are read from flash and sent a few at a time, the page is
+    never held in RAM.
+
+    Args:
+        request (Request): The parsed request.
+        response (Response): Where the page is sent.
+
+    Returns:
+        None
+    """
+    if measurement_log is None:
+        await response.send(404, 'No history', 'text/plain')
+        return
+    try:
+        start = request.get_param('start')
+        start = int(start) if start is not None else None
+        limit = min(history_page_max, max(1, int(request.get_param('limit', '20'))))
+    except ValueError:
+        await response.send(400, 'Bad start or limit', 'text/plain')
+        return
+    seq = history_range(start, limit)
+    end = min(seq + limit, measurement_log.get_next_seq())
+    
+    response.add_header('Cache-Control', 'no-cache')
+    await response.start(200, 'application/json')
+    response.feed('{{"first":{0},"next":{1},"records":['.format(measurement_log.get_first_seq(),
+                                                                 measurement_log.get_next_seq()).encode())
+    separator = [b'']
+    def send_record(page, offset):
+        record = unpack_record(page, offset)
+        if record is not None:
+            response.feed(separator[0])
+            response.feed(ujson.dumps(record).encode())
+            separator[0] = b','
+    while seq < end:
+        n = measurement_log.read(seq, min(measurement_log.page_records, end - seq), send_record)
+        if n == 0:
+            break
+        seq += n
+        await response.flush()
+    response.feed(b']}')
+    await response.flush()
+
+async def handle_api_trace(request, response):
+    """
+    Serves the trace ring as text, oldest record first, formatting one
+    record at a time. ?clear=1 empties the ring afterwards.
+
+    Args:
+        request (Request): The parsed request.
+        response (Response): Where the records are sent.
+
+    Returns:
+        None
+    """
+    response.add_header('Cache-Control', 'no-cache')
+    await response.start(200, 'text/plain')
+    send_line = lambda line: response.feed(line.encode() + b'\n')
+    first = 0
+    while True:
+        n = tracer.dump(send_line, first, 32)
+        await response.flush()
+        if n < 32:
+            break
+        first += n
+    if request.get_param('clear') == '1':
+        tracer.clear()
+
+async def handle_api_measurement(request, response):
+    """
+    Serves the latest measurement as JSON. The sequence number is the
+    ETag; a client sending it back in If-None-Match gets a 304 without a
+    body until the next measurement is published.
+
+    Args:
+        request (Request): The parsed request.
+        response (Response): Where the result is sent.
+
+    Returns:
+        None
+    """
+    etag = '"{0}"'.format(measurement_sequence)
+    response.add_header('ETag', etag)
+    response.add_header('Cache-Control', 'no-cache')
+    
+    if measurement_json is None:
+        await response.send(204)
+        return
     
-    response = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n" + rendered_content
+    match = request.get_header('if-none-match')
+    if match is not None:
+        for tag in match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == etag or tag == '*':
+                await response.send(304)
+                return
     
-    conn.send(response.encode())  # Send the HTTP response
-    conn.close()  # Close the connection
+    await response.send(200, measurement_json, 'application/json')
+
+async def stream_voltages():
+    """
+    Publishes the mean of stream_samples readings of each test point to the
+    stream clients, stream_rate_hz times a second. Idles without clients.
+    """
+    tps = (tp1, tp2, tp3)
+    while True:
+        await asyncio.sleep(1 / stream_rate_hz)
+        if not stream_hub.has_clients():
+            continue
+        values = [ticks_ms()]
+        for tp in tps:
+            tp.sample(stream_samples, stream_buffer)
+            values.append(buffer_mean(stream_buffer, stream_samples))
+        stream_hub.publish('tp', ujson.dumps(values))
+
+def charge_curve_points(width, height):
+    """
+    Scales the last charge curve into SVG polyline points.
+
+    Args:
+        width (int): Width of the plot area.
+        height (int): Height of the plot area, mapped to 0..supply_uv.
+
+    Returns:
+        str: The points as 'x,y x,y ...', empty if there is no curve.
+    """
+    count = charge_curve.get_count()
+    if count < 2:
+        return ''
+    times = charge_curve.times
+    values = charge_curve.values
+    span = times[count - 1] or 1
+    points = []
+    for i in range(count):
+        x = times[i] * width // span
+        y = height - values[i] * height // supply_uv
+        points.append('{0},{1}'.format(x, y))
+    return ' '.join(points)
 
 def init_wifi():
     """
-    Initializes the Wi-Fi connection and starts the server.
+    Initializes the Wi-Fi connection.
 
     Returns:
-        None
+        bool: True if the station is connected and the server can start.
     """
     saved_ssid, saved_password = read_wifi_credentials()
     if saved_ssid and saved_password:
-        debug("Found saved WiFi AP: {0} with password {1}".format(saved_ssid, saved_password))
+        log_wifi.info('Found saved AP {0}', saved_ssid)
         wifi_connected = connect_wifi(saved_ssid, saved_password)
         if wifi_connected:
-            _thread.start_new_thread(start_server, ())
-            debug("###################\n$ ## WiFi Pass: OK ##\n$ ###################\n$")
+            log_main.info('WiFi pass OK')
+            return True
+    return False
         
-def start_server():
+async def start_server(host='0.0.0.0', port=None):
+    """
+    Starts the HTTP server on the running event loop. Connections are
+    served concurrently as tasks next to the measurement loop.
+
+    Args:
+        host (str): The address to bind.
+        port (int): The port, defaults to http_port.
+
+    Returns:
+        HttpServer: The running server, also stored in http_server.
+    """
+    global http_server, page_template, static_assets
+    static_assets = StaticAssets(static_manifest, static_chunk_bytes, static_max_age_s)
+    static_assets.load()
+    # The asset URLs only change with the firmware, they are compiled into
+    # the static chunks of the page
+    page_template = Template('template.html', {
+        'style_url': static_assets.url('/static/style.css'),
+        'script_url': static_assets.url('/static/app.js'),
+    })
+    page_template.refresh()
+    http_server = HttpServer(http_max_header_bytes, http_max_body_bytes, http_idle_timeout_s, log_server)
+    http_server.route('/', handle_request)
+    for path in static_assets.paths():
+        http_server.route(path, static_assets.serve)
+    http_server.route('/api/v1/measurement', handle_api_measurement)
+    http_server.route('/stream', stream_hub.serve)
+    http_server.route('/api/v1/history', handle_api_history)
+    http_server.route('/api/v1/trace', handle_api_trace)
+    await http_server.start(host, http_port if port is None else port, http_backlog)
+
+    log_server.info('Server started, waiting for connections')
+    return http_server
+
+def init_serial():
+    """
+    Takes over the USB serial port for the framed protocol of protocol.py.
+    Ctrl-C is switched off, a 0x03 byte inside a frame would otherwise
+    stop the firmware.
+    """
+    global serial_decoder
+    serial_decoder = FrameDecoder(serial_max_payload)
+    try:
+        import micropython
+        micropython.kbd_intr(-1)
+    except ImportError:
+        pass
+
+def send_frame(kind, payload=b''):
+    if serial_out is not None:
+        write_frame(serial_out, kind, payload)
+
+def send_charge_curve():
+    """
+    Sends the times and then the values of the last charge curve as
+    MSG_SAMPLES blocks of serial_block_samples, straight from the curve
+    buffers.
+    """
+    count = charge_curve.get_count()
+    for channel, samples in ((CHANNEL_CURVE_TIME, charge_curve.times), (CHANNEL_CURVE_VALUE, charge_curve.values)):
+        offset = 0
+        while True:
+            n = min(serial_block_samples, count - offset)
+            write_samples(serial_out, channel, samples, offset, n, offset + n >= count)
+            offset += n
+            if offset >= count:
+                break
+
+def send_history(payload):
     """
-    Starts a TCP/IP server on address '0.0.0.0' and port 80.
-    Listens for incoming connections and handles client requests.
+    Answers MSG_GET_HISTORY with one MSG_HISTORY frame of at most
+    history_frame_records records, copied from flash as stored.
+    """
+    if measurement_log is None:
+        send_frame(MSG_ACK, bytes((MSG_GET_HISTORY, STATUS_ERROR)))
+        return
+    start, limit = struct.unpack_from(HISTORY_REQUEST, payload, 0)
+    limit = min(limit, history_frame_records)
+    frame = history_frame
+    struct.pack_into(HISTORY_HEADER, frame, 0, measurement_log.get_first_seq(), measurement_log.get_next_seq())
+    filled = [HISTORY_HEADER_SIZE]
+    def copy_record(page, offset):
+        frame[filled[0]:filled[0] + 32] = page[offset:offset + 32]
+        filled[0] += 32
+    measurement_log.read(history_range(start or None, limit), limit, copy_record)
+    write_frame(serial_out, MSG_HISTORY, memoryview(frame)[:filled[0]])
+
+def configure(settings):
+    """
+    Applies settings sent by host_app. Only the settings in
+    tunable_settings can be changed, to values of their type within their
+    range, and nothing is changed if one of them is unknown, of the wrong
+    type or out of range. Settings only read at boot are refused.
+    trace_levels sets the level of single trace channels, e.g.
+    {"capacitor": 5}.
+
+    Args:
+        settings (dict): New values by setting name.
+
+    Returns:
+        int: STATUS_OK or STATUS_ERROR.
+    """
+    names = [c.name for c in tracer.channels]
+    for name, value in settings.items():
+        if name == 'trace_levels':
+            valid = type(value) is dict
+            for channel, level in (value.items() if valid else ()):
+                valid = valid and channel in names and type(level) is int and LEVEL_OFF <= level <= LEVEL_TRACE
+        elif name in tunable_settings:
+            kind, low, high = tunable_settings[name]
+            if kind is float:
+                valid = type(value) is int or type(value) is float
+            else:
+                valid = type(value) is kind
+            valid = valid and low <= value <= high
+        else:
+            valid = False
+        if not valid:
+            log_serial.warn('Rejected setting {0}', name)
+            return STATUS_ERROR
+    current = globals()
+    for name, value in settings.items():
+        if name == 'trace_levels':
+            for channel, level in value.items():
+                tracer.set_level(channel, level)
+            continue
+        value = tunable_settings[name][0](value)
+        # main.py holds its own copies of the conf.py names
+        current[name] = value
+        setattr(conf, name, value)
+    if 'trace_level' in settings:
+        tracer.set_level(None, trace_level)
+    if presence is not None:
+        presence.count = presence_debounce
+    tracer.print_level = trace_print_level
+    init_sample_buffers()
+    return STATUS_OK
+
+def handle_serial_frame(kind, payload):
+    """
+    Answers one frame from host_app.
+
+    Args:
+        kind (int): The message type.
+        payload (memoryview): The payload, valid until the next read.
 
     Returns:
         None
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create a TCP/IP socket
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Set the socket option to reuse the address
-    s.bind(('0.0.0.0', 80))  # Bind the socket to address and port
-    s.listen(5)  # Listen for incoming connections
+    if kind == MSG_MEASURE:
+        measure_phase()
+        send_frame(MSG_RESULT, measurement_json)
+    elif kind == MSG_GET_CURVE:
+        send_charge_curve()
+    elif kind == MSG_GET_HISTORY:
+        send_history(payload)
+    elif kind == MSG_GET_TRACE:
+        tracer.dump(lambda line: send_frame(MSG_LOG, line.encode()))
+        send_frame(MSG_ACK, bytes((kind, STATUS_OK)))
+    elif kind == MSG_CONFIGURE or kind == MSG_SET_WIFI or kind == MSG_CALIBRATE:
+        try:
+            settings = ujson.loads(bytes(payload))
+            if kind == MSG_CONFIGURE:
+                status = configure(settings)
+            elif kind == MSG_CALIBRATE:
+                status = calibrate(settings['step'], settings.get('ohm'))
+            else:
+                save_wifi_credentials(settings['ssid'], settings['password'])
+                status = STATUS_OK
+        except (ValueError, KeyError, TypeError, AttributeError):
+            status = STATUS_ERROR
+        send_frame(MSG_ACK, bytes((kind, status)))
+    else:
+        send_frame(MSG_ACK, bytes((kind, STATUS_UNKNOWN)))
 
-    debug("Server started. Waiting for connections...")
+async def serial_loop(stream_in=None, stream_out=None):
+    """
+    Serves host_app over the serial port as a task of the event loop. The
+    port is polled every serial_poll_ms; once it is readable exactly the
+    bytes the frame being received still needs are read, in one call,
+    straight into the decoder buffer.
 
-    inputs = [s]  # List of input sockets including the server socket
+    Args:
+        stream_in: The stream frames are read from, sys.stdin.buffer by default.
+        stream_out: The stream frames are written to, sys.stdout.buffer by default.
 
+    Returns:
+        None
+    """
+    global serial_out
+    if stream_in is None:
+        stream_in = sys.stdin.buffer
+    serial_out = stream_out if stream_out is not None else sys.stdout.buffer
+    poller = select.poll()
+    poller.register(stream_in, select.POLLIN)
+    decoder = serial_decoder
     while True:
-        readable, _, _ = select.select(inputs, [], [])  # Select readable sockets
-
-        for sock in readable:
-            if sock is s:  # If the server socket is readable, accept new connection
-                conn, addr = s.accept()  # Accept a connection
-                debug("Connection from:" + str(addr))
-                inputs.append(conn)  # Add the new connection to the list of inputs
-            else:  # If a client socket is readable, handle the request
-                request = sock.recv(1024)  # Receive data from the client
-                debug("Request:" + str(request))
-                handle_request(sock)
-                inputs.remove(sock)  # Remove the client socket from the list of inputs
-        sleep(1)  # Wait for 1 second before checking for new connections
-
-def rx_serial_thread():
-    global rx_ch
-    
-    while True:
-        if rx_ch.poll(0): #is data available? .poll(0) returns an empty list if no data is available
-            res = ""
-            while rx_ch.poll(1):
-                res+=(sys.stdin.read(1))
-            print("got:",res)
-        sleep(1)
-
-def tx_serial_thread():
-    while True:
-        # TODO serial comms
-        sleep(1)
-
-def init_serial():
-    _thread.start_new_thread(rx_serial_thread, ())
-    _thread.start_new_thread(tx_serial_thread, ())
+        if not poller.poll(0):
+            await asyncio.sleep(serial_poll_ms / 1000)
+            continue
+        decoder.commit(stream_in.readinto(decoder.space()[:decoder.wanted()]))
+        frame = decoder.next()
+        while frame is not None:
+            handle_serial_frame(frame[0], frame[1])
+            frame = decoder.next()
 
 def init_pins():
     """
@@ -231,62 +658,88 @@ def init_pins():
     # Test point 3/C
     tp3 = TestPoint(adc_tp3, tp3_pins[0], tp3_pins[1], tp3_pins[2], 'TP3')
 
-def measure_resistance_function(tp_x, tp_y, resistance):
-    adc_tpx = 0
-    adc_tpy = 0
+    init_sample_buffers()
+
+def init_sample_buffers():
+    """
+    Allocates the sample buffers and pulse sequences for the oversampling
+    depths set in conf.py. Call again after changing resistance_samples or
+    esr_samples.
+    """
+    global sample_buffer, esr_sequence, inductance_sequence, pulse_scheduler
+    global stream_buffer
+    sample_buffer = new_sample_buffer(resistance_samples)
+    stream_buffer = new_sample_buffer(stream_samples)
+    esr_sequence = PulseSequence(4 * esr_samples)
+    # The sweep packs three steps per pulse, the first rise its doubling
+    # reads and the reads of the driven end
+    inductance_sequence = PulseSequence(max(3 * inductance_widths * inductance_repeats + 1,
+                                            inductance_rise_us.bit_length() + inductance_repeats + 3))
+    if pulse_scheduler is None:
+        pulse_scheduler = PulseScheduler(pulse_timer_id)
+
+def resistance_from_readings(adc_tpy, adc_tpx, resistance, pin_resistance):
+    """
+    Computes the part resistance from the two loops of a resistance pass.
 
+    Args:
+        adc_tpy (int): TP-Y voltage with TP-X on r0 low and TP-Y on the series resistor high.
+        adc_tpx (int): TP-X voltage with TP-X on the series resistor low and TP-Y on r0 high.
+        resistance (int): The series resistor, 680 or 470000.
+        pin_resistance (float): Pin resistance of TP-X.
+
+    Returns:
+        float: The resistance in ohms, inf if the test points are open.
+    """
+    if adc_tpx <= 0:
+        # Nothing flows back, the test points are open
+        return float('inf')
+    if resistance == 680:
+        return adc_tpy * (resistance + pin_resistance) / adc_tpx - pin_resistance
+    return adc_tpy * resistance / adc_tpx
+
+def measure_resistance_function(tp_x, tp_y, resistance):
      ## Loop I, TP-Y measures now
     tp_x.set_r0_low()
     
     if resistance == 680:
-        debug('680 Low Impedance Test')
         tp_y.set_r1_high()
     else:
-        debug('470k Low Impedance Test')
         tp_y.set_r2_high()
 
-    sleep(0.005)
-    debug('High-side {0}: {1} v'.format(tp_y.get_name(), tp_y.get_v()))
-    
-    for i in range(0, 10):
-        adc_tpy += tp_y.get_v()
-        #sleep(0.005)
+    settle_time = tp_y.settle()
+    log_resistor.debug('{0} ohm, {1} settled in {2} us', resistance, tp_y.get_name(), settle_time)
+    if __debug__:
+        if log_resistor.level >= LEVEL_TRACE:
+            log_resistor.trace('High-side {0}: {1} uV', tp_y.get_name(), tp_y.get_uv())
     
-    adc_tpy = adc_tpy / 10
+    tp_y.sample(resistance_samples, sample_buffer)
+    adc_tpy = buffer_mean(sample_buffer, resistance_samples)
     
-    debug('Average voltage tpy: {0} v'.format(adc_tpy))
+    log_resistor.debug('Average voltage tpy: {0} uV', adc_tpy)
     
     # Disarming the pins
     tp_y.set_pins_floating()
     tp_x.set_pins_floating()
     ## Loop II, TP-X measures now
     if resistance == 680:
-        debug('680 Low Impedance Test')
         tp_x.set_r1_low()
     else:
-        debug('470k High Impedance Test')
         tp_x.set_r2_low()
         
     tp_y.set_r0_high()
-    sleep(0.005)
-    
-    debug('Low-side {0}: {1} v'.format(tp_x.get_name(), tp_x.get_v()))
-    
-    for i in range(0, 10):
-        adc_tpx += tp_x.get_v()
-        #sleep(0.005)
-    
-    adc_tpx = adc_tpx / 10
+    settle_time = tp_x.settle()
+    log_resistor.debug('{0} ohm, {1} settled in {2} us', resistance, tp_x.get_name(), settle_time)
+    if __debug__:
+        if log_resistor.level >= LEVEL_TRACE:
+            log_resistor.trace('Low-side {0}: {1} uV', tp_x.get_name(), tp_x.get_uv())
     
-    debug('Average voltage tpx: {0} v'.format(adc_tpx))
+    tp_x.sample(resistance_samples, sample_buffer)
+    adc_tpx = buffer_mean(sample_buffer, resistance_samples)
     
-    temp_resistance = 0
+    log_resistor.debug('Average voltage tpx: {0} uV', adc_tpx)
     
-    if resistance == 680:
-        temp_resistance = adc_tpy*(resistance+pin_res)/adc_tpx - pin_res
-    else:
-        temp_resistance = adc_tpy * resistance / adc_tpx
-        
+    temp_resistance = resistance_from_readings(adc_tpy, adc_tpx, resistance, tp_x.pin_res)
     
     # Disarming the pins
     tp_y.set_pins_floating()
@@ -294,133 +747,520 @@ def measure_resistance_function(tp_x, tp_y, resistance):
     
     return temp_resistance
 
-def measure_resistance():
-    global detected_component
-    global tp1, tp2, tp3
-    global resistor_component
+def direction_mismatch(resistance_a, resistance_b):
+    """
+    Relative disagreement between the two measurement directions.
+    """
+    if resistance_a == resistance_b:
+        return 0
+    total = resistance_a + resistance_b
+    if total == float('inf'):
+        return 1
+    return abs(resistance_a - resistance_b) * 2 / total
+
+def measure_resistance_auto(tp_x, tp_y):
+    """
+    Measures the resistance between two test points, picking the range from
+    the first 680 ohm pass.
 
-    temp_resistance1 = measure_resistance_function(tp1, tp2, 680)
-    #print(temp_resistance1)
-    
-    temp_resistance2 = measure_resistance_function(tp2, tp1, 680)
-    #print(temp_resistance2)
-    
-    temp_resistance3 = measure_resistance_function(tp1, tp2, 470000)
-    #print(temp_resistance3)
+    Parts below resistance_range_limit only need the reverse 680 ohm pass,
+    larger ones get both 470k ohm passes instead. When the two directions
+    disagree by more than resistance_mismatch_tolerance, up to
+    resistance_escalation_pairs extra pass pairs are averaged in.
+
+    Args:
+        tp_x (TestPoint): The first test point.
+        tp_y (TestPoint): The second test point.
+
+    Returns:
+        ResistanceResult: The measured value and how it was obtained.
+    """
+    start = ticks_us()
+
+    first = measure_resistance_function(tp_x, tp_y, 680)
+    passes = 1
+
+    if first < resistance_range_limit:
+        range_used = 680
+        forward = first
+        reverse = measure_resistance_function(tp_y, tp_x, 680)
+        passes += 1
+    else:
+        range_used = 470000
+        forward = measure_resistance_function(tp_x, tp_y, 470000)
+        reverse = measure_resistance_function(tp_y, tp_x, 470000)
+        passes += 2
+
+    mismatch = direction_mismatch(forward, reverse)
+    log_resistor.debug('Range {0}: {1} / {2} ohm', range_used, forward, reverse)
+
+    pairs = 1
+    escalation = 0
+    while mismatch > resistance_mismatch_tolerance and escalation < resistance_escalation_pairs:
+        forward += measure_resistance_function(tp_x, tp_y, range_used)
+        reverse += measure_resistance_function(tp_y, tp_x, range_used)
+        passes += 2
+        pairs += 1
+        escalation += 1
+        mismatch = direction_mismatch(forward, reverse)
+        log_resistor.debug('Escalation {0}: mismatch {1}', escalation, mismatch)
+
+    resistance = (forward + reverse) / (2 * pairs)
+    time_us = ticks_diff(ticks_us(), start)
+
+    return ResistanceResult(resistance, range_used, mismatch, time_us, passes)
+
+def drive_scan_config(config):
+    """
+    Drives the three test points into a scan configuration, the test point
+    that is not part of it floating.
+
+    Args:
+        config (tuple): (low_tp, low_pin, high_tp, high_pin), one test point
+            pulled low and one pulled high, each through pin 0 (shunt), 1
+            (680 ohm) or 2 (470k ohm).
+
+    Returns:
+        None
+    """
+    low_tp, low_pin, high_tp, high_pin = config
+    tps = (tp1, tp2, tp3)
     
-    temp_resistance4 = measure_resistance_function(tp2, tp1, 470000)
-    #print(temp_resistance4)
+    for index in range(3):
+        if index != low_tp and index != high_tp:
+            tps[index].drive(0, 0, 0)
+    tps[low_tp].drive(-1 if low_pin == 0 else 0, -1 if low_pin == 1 else 0, -1 if low_pin == 2 else 0)
+    tps[high_tp].drive(1 if high_pin == 0 else 0, 1 if high_pin == 1 else 0, 1 if high_pin == 2 else 0)
+
+def apply_scan_config(config, quick=False):
+    """
+    Drives the three test points into a scan configuration, waits for the
+    test point on the series resistor to settle and reads the test points
+    the resistance and diode results need.
+
+    Args:
+        config (tuple): (low_tp, low_pin, high_tp, high_pin)
+        quick (bool): Skip settling and oversampling, enough for the diode
+            test on its own.
+
+    Returns:
+        tuple: Mean voltages of TP1, TP2 and TP3 in microvolts, -1 for the
+            test points that were not read.
+    """
+    low_tp, low_pin, high_tp, high_pin = config
+    tps = (tp1, tp2, tp3)
     
-    avg_resistance1 = (temp_resistance1 + temp_resistance2) / 2
-    avg_resistance2 = (temp_resistance3 + temp_resistance4) / 2
+    drive_scan_config(config)
     
-    if avg_resistance1 < 10000:
-        resistor_component = Resistor(avg_resistance1)
-        print(avg_resistance1)
-        detected_component = detected_component | 1
+    measured = high_tp if high_pin else low_tp
+    readings = [-1, -1, -1]
+    if quick:
+        readings[measured] = tps[measured].get_uv()
     else:
-        resistor_component = Resistor(avg_resistance2)
-        print(avg_resistance2)
-        detected_component = detected_component | 1
-    
+        tps[measured].settle()
+        tps[measured].sample(resistance_samples, sample_buffer)
+        readings[measured] = buffer_mean(sample_buffer, resistance_samples)
+    # The diode test also needs the shunted side of the 680 ohm low-side
+    # states; it is driven hard, a single reading is enough
+    if low_pin == 1:
+        readings[high_tp] = tps[high_tp].get_uv()
+    return tuple(readings)
+
+def run_scan_plan(plan, readings):
+    """
+    Applies every configuration of a plan that has not been read yet.
+
+    Args:
+        plan (list): Configurations, see drive_scan_config().
+        readings (dict): Configuration -> voltages, filled in place.
+
+    Returns:
+        None
+    """
+    for config in plan:
+        if config not in readings:
+            readings[config] = apply_scan_config(config)
+
+def pair_diode(readings, x, y):
+    """
+    Diode test of a pair from the 680 ohm scan readings: one test point
+    low through 680 ohm and the other high on its shunted pin, both ways
+    round.
+
+    Returns:
+        tuple: (diode_detected, forward_voltage, flow_direction)
+    """
+    tps = (tp1, tp2, tp3)
+    flow_direction = (tps[x].get_name(), tps[y].get_name())
+    
+    # TP-X low through 680 ohm, TP-Y high
+    v = readings[(x, 1, y, 0)]
+    y_x_current_flow = v[x] > 150000
+    y_x_forward_voltage = (v[y] - v[x]) / 1000000 if y_x_current_flow else 0
+    if y_x_current_flow:
+        flow_direction = (tps[y].get_name(), tps[x].get_name())
+    
+    # TP-Y low through 680 ohm, TP-X high
+    v = readings[(y, 1, x, 0)]
+    x_y_current_flow = v[y] > 150000
+    x_y_forward_voltage = (v[x] - v[y]) / 1000000 if x_y_current_flow else 0
+    if x_y_current_flow:
+        flow_direction = (tps[x].get_name(), tps[y].get_name())
     
+    diode_detected = x_y_current_flow != y_x_current_flow
+    forward_voltage = max(x_y_forward_voltage, y_x_forward_voltage) if diode_detected else -1
+    return diode_detected, forward_voltage, flow_direction
+
+def discharge_pair(x, y):
+    """
+    Shorts all three test points low through the shunted pins for
+    probe_discharge_us and returns the charge left on the pair. The third
+    test point is included so stray charge on it cannot leak into the next
+    probe through the part.
+
+    Returns:
+        int: The higher of the two test point voltages in microvolts.
+    """
+    tps = (tp1, tp2, tp3)
+    for tp in tps:
+        tp.drive(-1, 0, 0)
+    sleep_us(probe_discharge_us)
+    return max(tps[x].get_uv(), tps[y].get_uv())
+
+def probe_config(config, dwell_us):
+    """
+    Drives a scan configuration and reads its low-side test point right
+    away and again after dwell_us, then the high-side test point once.
+
+    Args:
+        config (tuple): (low_tp, low_pin, high_tp, high_pin)
+        dwell_us (int): Time between the two low-side readings.
+
+    Returns:
+        tuple: (first, last, high) in microvolts.
+    """
+    low_tp, low_pin, high_tp, high_pin = config
+    tps = (tp1, tp2, tp3)
+    drive_scan_config(config)
+    first = tps[low_tp].get_uv()
+    sleep_us(dwell_us)
+    last = tps[low_tp].get_uv()
+    return first, last, tps[high_tp].get_uv()
+
+def probe_resistance(reading, series_resistance):
+    """
+    Resistance of a pair from a probe_config() reading, with the high side
+    on the shunted pin and series_resistance on the low side.
+    """
+    first, last, high = reading
+    if last <= 0:
+        return float('inf')
+    return (high - last) * series_resistance / last
+
+def classify_pair(x, y):
+    """
+    Cheap first-pass probe of one pair: a few single ADC readings with the
+    680 ohm resistor on the low side in both directions, plus one 470k ohm
+    reading for pairs that do not conduct.
+
+    A part that still holds charge or whose reading moves between two
+    readings is reactive, inductive if the low-side reading rises, current
+    building up in the part, rather than falls as a capacitor charges. A
+    pair conducting in one direction only (or very differently in the two)
+    is rectifying. Symmetric conduction is resistive, or a short below
+    probe_short_ohm; low estimates are held for probe_confirm_us first
+    because a large capacitor looks like a short for a while. A pair that
+    conducts on neither range is open.
+
+    Args:
+        x (int): Index of the first test point.
+        y (int): Index of the second test point.
+
+    Returns:
+        PairProbe: The class of the pair with a confidence and an estimate.
+    """
+    start = ticks_us()
+    kind = PairProbe.OPEN
+    estimate = 0
+    
+    residual = discharge_pair(x, y)
+    forward = probe_config((x, 1, y, 0), probe_dwell_us)
+    residual = max(residual, discharge_pair(x, y))
+    reverse = probe_config((y, 1, x, 0), probe_dwell_us)
+    drift = max(residual, abs(forward[0] - forward[1]), abs(reverse[0] - reverse[1]))
+    
+    forward_flow = forward[1] > probe_conduct_uv
+    reverse_flow = reverse[1] > probe_conduct_uv
+    
+    if drift > probe_reactive_uv:
+        kind = PairProbe.REACTIVE
+        confidence = min(1, drift / (4 * probe_reactive_uv))
+        rise = max(forward[1] - forward[0], reverse[1] - reverse[0])
+        if rise > probe_reactive_uv and rise > max(forward[0] - forward[1], reverse[0] - reverse[1]):
+            kind = PairProbe.INDUCTIVE
+    elif forward_flow and reverse_flow:
+        tps = (tp1, tp2, tp3)
+        forward_r = probe_resistance(forward, 680 + tps[x].pin_res)
+        reverse_r = probe_resistance(reverse, 680 + tps[y].pin_res)
+        mismatch = direction_mismatch(forward_r, reverse_r)
+        # The relative mismatch of two near-zero estimates is noise
+        if mismatch > probe_rectify_mismatch and abs(forward_r - reverse_r) > probe_confirm_ohm:
+            kind = PairProbe.RECTIFYING
+            confidence = min(1, mismatch)
+            estimate = min(forward[2] - forward[1], reverse[2] - reverse[1]) / 1000000
+        else:
+            estimate = (forward_r + reverse_r) / 2
+            kind = PairProbe.SHORT if estimate < probe_short_ohm else PairProbe.RESISTIVE
+            confidence = 1 - mismatch
+            if estimate < probe_confirm_ohm:
+                discharge_pair(x, y)
+                held = probe_config((x, 1, y, 0), probe_confirm_us)
+                drift = abs(held[0] - held[1])
+                if drift > probe_reactive_uv:
+                    kind = PairProbe.INDUCTIVE if held[1] > held[0] else PairProbe.REACTIVE
+                    confidence = min(1, drift / (4 * probe_reactive_uv))
+                    estimate = 0
+    elif forward_flow or reverse_flow:
+        kind = PairProbe.RECTIFYING
+        conducting, blocking = (forward, reverse) if forward_flow else (reverse, forward)
+        confidence = 1 - blocking[1] / conducting[1]
+        estimate = (conducting[2] - conducting[1]) / 1000000
+    else:
+        discharge_pair(x, y)
+        high = probe_config((x, 2, y, 0), probe_dwell_us)
+        if high[0] - high[1] > probe_reactive_uv:
+            kind = PairProbe.REACTIVE
+            confidence = min(1, (high[0] - high[1]) / (4 * probe_reactive_uv))
+        elif high[1] > probe_open_uv:
+            kind = PairProbe.RESISTIVE
+            confidence = min(1, high[1] / (4 * probe_open_uv))
+            estimate = probe_resistance(high, 470000)
+        else:
+            confidence = 1 - high[1] / probe_open_uv
+    
+    probe = PairProbe(x, y, kind, confidence, estimate, ticks_diff(ticks_us(), start))
+    log_probe.debug('{0}-{1}: {2}', x, y, kind)
+    log_probe.debug('confidence {0}, estimate {1}, {2} us', confidence, estimate, probe.get_time_us())
+    return probe
+
+def classify():
+    """
+    Probes every pair in scan_pair_indices and picks the most informative
+    one, see PairProbe.outranks().
 
-def capacitor_discharge(tp_x, tp_y):
-    # Safety check
+    Returns:
+        PairProbe: The probe of the chosen pair.
+    """
+    best = None
+    for x, y in scan_pair_indices:
+        probe = classify_pair(x, y)
+        if best is None or probe.outranks(best):
+            best = probe
+    for tp in (tp1, tp2, tp3):
+        tp.set_pins_floating()
+    return best
+
+def discharge_part(tp_x, tp_y, channel):
+    """
+    Discharges the part between two test points with both pulled low:
+    through the 680 ohm resistor of tp_y while the current through the
+    shunted pins would be above discharge_max_current_ua, then through the
+    shunted pins of both.
+
+    The part voltage is polled at an interval taken from its decay: the
+    last two polls give the time constant of the exponential, and from it
+    the time left until the next threshold, the path switch or
+    discharge_target_uv, which the next poll waits for. Until the voltage
+    visibly falls the interval doubles. A part that stays flat for
+    discharge_stuck_polls polls, or whose exponential needs longer than
+    discharge_timeout_us, is given up on then instead of at the timeout.
+
+    Args:
+        tp_x (TestPoint): One test point of the part.
+        tp_y (TestPoint): The other one, charged positive by the
+            capacitance measurement.
+        channel (TraceChannel): Where the progress is traced.
+
+    Returns:
+        DischargeResult: The outcome. tp_x is left low through its shunted
+            pin and tp_y through its 680 ohm resistor.
+    """
+    start = ticks_us()
     tp_x.set_r0_low()
     tp_y.set_r1_low()
+    # The readings are the part voltage divided between the two paths
+    r_x = tp_x.pin_res
+    r_y = 680 + tp_y.pin_res
+    uv_x = tp_x.get_uv()
+    uv_y = tp_y.get_uv()
+    uv = int(max(uv_x * (r_x + r_y) / r_x, uv_y * (r_x + r_y) / r_y))
+    start_uv = uv
+    if uv > discharge_max_uv:
+        channel.warn('Part charged to {0} uV, discharge it by hand', uv)
+        return DischargeResult(DischargeResult.HIGH_VOLTAGE, start_uv, uv, ticks_diff(ticks_us(), start), 0)
+    
+    fast_uv = discharge_max_current_ua * (tp_x.pin_res + tp_y.pin_res)
+    fast = False
+    status = DischargeResult.DISCHARGED
+    interval = discharge_poll_us
+    polls = 0
+    flat = 0
+    last_uv = uv
+    last_us = ticks_diff(ticks_us(), start)
+    while uv > discharge_target_uv:
+        if not fast and uv <= fast_uv:
+            # The decay gets faster, it is measured again from here
+            tp_y.drive(-1, 0, 0)
+            r_y = tp_y.pin_res
+            fast = True
+            interval = discharge_poll_us
+            last_uv = uv
+            last_us = ticks_diff(ticks_us(), start)
+            channel.debug('Discharging through the shunted pins from {0} uV', uv)
+        
+        sleep_us(interval)
+        uv_x = tp_x.get_uv()
+        uv_y = tp_y.get_uv()
+        uv = int(max(uv_x * (r_x + r_y) / r_x, uv_y * (r_x + r_y) / r_y))
+        elapsed = ticks_diff(ticks_us(), start)
+        polls += 1
+        channel.debug('Discharging: {0} uV after {1} us', uv, elapsed)
+        if uv <= discharge_target_uv:
+            break
+        
+        if last_uv - uv <= discharge_noise_uv:
+            if interval < discharge_max_poll_us:
+                interval = min(interval * 2, discharge_max_poll_us)
+                continue
+            flat += 1
+            if flat >= discharge_stuck_polls:
+                status = DischargeResult.STUCK
+                break
+            continue
+        flat = 0
+        
+        # Time constant of the exponential through the last two polls and
+        # the time it takes from here to the next threshold
+        target_uv = discharge_target_uv if fast else max(fast_uv, discharge_target_uv)
+        tau = (elapsed - last_us) / math.log(last_uv / uv)
+        remaining = tau * math.log(uv / target_uv) if uv > target_uv else 0.0
+        if elapsed + remaining > discharge_timeout_us:
+            status = DischargeResult.STUCK
+            break
+        # Aimed a little past the threshold, so it is not polled twice
+        interval = int(min(max(remaining * 1.05, discharge_poll_us), discharge_max_poll_us))
+        last_uv = uv
+        last_us = elapsed
     
-    # Testing if the would-be capacitor has any charge left
-    cap_voltage_x = tp_x.get_v()
-    cap_voltage_y = tp_y.get_v()
+    tp_y.set_r1_low()
+    result = DischargeResult(status, start_uv, uv, ticks_diff(ticks_us(), start), polls)
+    if status == DischargeResult.STUCK:
+        channel.warn('Discharge failed, {0}', result.get_summary())
+    else:
+        channel.debug('Discharge {0}', result.get_summary())
+    return result
 
-    cap_threshold_voltage = 3.2
-    if cap_voltage_x > cap_threshold_voltage or cap_voltage_y > cap_threshold_voltage:
-        debug('Capacitor has big charge. Discharge it with a screwdriver')
-        return -2
+def capture_charge_curve(tp_x, tp_y, resistance):
+    """
+    Charges the part through one of the series resistors of tp_y and records
+    the time-stamped voltage of tp_y into charge_curve until it reaches
+    charge_target_uv.
 
-    # debug('Capacitor has a small charge. Short the pins')
-    # Pin shorting through the 680 Ohm resistor
-    
-    max_count_discharge = 64
-    discharge_index = 0
-    
-    not_charging_voltage = 0
-    
-    while tp_x.get_v() > 0.16 or tp_y.get_v() > 0.16:
-        sleep(0.2)
-        
-        debug('Discharging status: TP X: {0}, TP Y: {1}'.format(tp_x.get_v(), tp_y.get_v()))
-        discharge_index+=1
-        
-        if discharge_index == 100:
-            not_charging_voltage = tp_x.get_v() + tp_y.get_v()
-        if discharge_index == 200:
-            temp_v = tp_x.get_v() + tp_y.get_v()
-            if not_charging_voltage < temp_v - 0.05:
-                debug('Discharge failed. Exiting...')
-                return -1
-        if discharge_index > max_count_discharge:
-            debug('Discharge failed. Exiting...')
-            return -1
+    Args:
+        tp_x (TestPoint): The test point held low.
+        tp_y (TestPoint): The test point charging the part.
+        resistance (int): The charge path, 680 or 470000.
 
-    return 0
+    Returns:
+        float: The fitted time constant in microseconds, -1 if the part
+            does not charge like a capacitor, -2 if no capacitor is present.
+    """
+    curve = charge_curve
+    curve.reset(resistance + tp_x.pin_res + tp_y.pin_res)
+    read = tp_y.get_uv
 
-def capacitor_charge(tp_x, tp_y):
-    pulse_time_ms = 1
-    pulse_count = 0
-    pulse_timeout = 4096
-    capacitor_target_voltage = 2.0856 #0.86 * 3.3 #2.0856 # 0.632 * 3.3 
-    # Charge the pins
-    
-    start = ticks_ms() # get millisecond counter
-    
     tp_x.set_r0_low()
-    tp_y.set_r1_high()
-    
-    # Capacitor missing
-    if tp_y.get_v() > capacitor_target_voltage:
-        tp_x.set_pins_floating()
-        tp_y.set_pins_floating()
-        debug('No capacitor detected')
-        return -2
-    
-    diode_double_check = False
-    
-    while pulse_count < pulse_timeout:
-        
-        #sleep_ms(pulse_time_ms)
-        #print(tp_x.get_v(), tp_y.get_v())
-        tp_y_v = tp_y.get_v()
-        pulse_count += 1
+    start = ticks_us()
+    if resistance == 680:
+        tp_y.set_r1_high()
+    else:
+        tp_y.set_r2_high()
+
+    rc = -1
+    last_check = 0
+    while True:
+        value = read()
+        elapsed = ticks_diff(ticks_us(), start)
         
-        debug('Charging status: TP X: {0}, TP Y: {1}'.format(tp_x.get_v(), tp_y.get_v()))
+        if __debug__:
+            if log_capacitor.level >= LEVEL_TRACE:
+                log_capacitor.trace('Charge sample: {0} us, {1} uV', elapsed, value)
         
-        if pulse_count >= 16 and (tp_y_v >= 1.9 and tp_y_v <= 1.92):
-            if not diode_double_check:
-                diode_double_check = True
+        if curve.add(elapsed, value):
+            # Buffers were decimated, the elapsed time has doubled since the
+            # last check. A capacitor keeps rising, a resistor or diode does not
+            log_capacitor.debug('Charging: {0} us, TP Y {1} uV', elapsed, value)
+            if value - last_check < charge_plateau_uv:
+                log_capacitor.debug('Charge curve flat, not a capacitor')
+                break
+            last_check = value
+
+        if value > charge_target_uv:
+            if curve.get_count() <= 1:
+                log_capacitor.debug('No capacitor detected')
+                rc = -2
             else:
-                tp_x.set_pins_floating()
-                tp_y.set_pins_floating()
-                delta = ticks_diff(ticks_ms(), start)
-                return delta
-        
-        if tp_y_v > capacitor_target_voltage:
-            tp_x.set_pins_floating()
-            tp_y.set_pins_floating()
-            delta = ticks_diff(ticks_ms(), start)
-            return delta
+                rc = 0
+            break
         
-    debug('Capacitor charge failed. Exiting...')
-    
+        if elapsed > charge_timeout_us:
+            log_capacitor.warn('Capacitor charge timed out')
+            break
+
     tp_x.set_pins_floating()
     tp_y.set_pins_floating()
     
-    return -1
+    if stream_hub.has_clients():
+        # The measurement holds the event loop, nothing published during it
+        # would be sent before it ends, so the curve goes out once, whole
+        stream_hub.publish('curve_end', ujson.dumps(curve.to_dict()))
+    
+    if rc < 0:
+        return rc
+    tau = curve.fit_time_constant(supply_uv)
+    return tau if tau > 0 else -1
+
+def capacitor_charge(tp_x, tp_y):
+    """
+    Measures the charge time constant of the part between two test points,
+    switching to the 470k ohm charge path when the 680 ohm path is too fast
+    to resolve.
+
+    Returns:
+        float: The time constant in microseconds of the charge path stored in
+            charge_curve, -1 if the charge failed, -2 if no capacitor.
+    """
+    tau = capture_charge_curve(tp_x, tp_y, 680)
+    
+    if charge_curve.get_count() < charge_min_samples:
+        log_capacitor.debug('Small capacitance, switching to the 470k charge path')
+        if not discharge_part(tp_x, tp_y, log_capacitor).is_discharged():
+            return -1
+        tau = capture_charge_curve(tp_x, tp_y, 470000)
+        if charge_curve.get_count() < charge_detect_samples:
+            log_capacitor.debug('No capacitor detected')
+            return -2
+    
+    log_capacitor.debug('Charge time constant: {0} us over {1} samples', tau, charge_curve.get_count())
+    return tau
 
-def measure_capacitor_esr(tp_x, tp_y):
+def measure_capacitor_esr(tp_x, tp_y, capacitance):
 
-    rc = capacitor_discharge(tp_x, tp_y)
+    discharge_part(tp_x, tp_y, log_capacitor)
+
+    # settle() alone reads a large capacitor's slow recharge tail as
+    # settled, wait for the time constant of the 680 ohm path first
+    recharge_us = min(int(esr_recharge_taus * capacitance * (680 + tp_y.pin_res)), esr_recharge_max_us)
 
     u_c = 0        
     u_l = 0  
@@ -429,36 +1269,47 @@ def measure_capacitor_esr(tp_x, tp_y):
     # Discharge the capacitor
     tp_x.set_r0_low()
 
-    for i in range(0, 10):
-        t_u_c = 0
-        t_u_h = 0
-        t_u_l = 0
-
-        for j in range(0, 100):
-            tp_y.set_r1_high()
-            t_u_h = t_u_h + tp_y.get_v()
-            sleep_us(4)
-            tp_y.set_r1_low()
-            sleep_us(4)
-            t_u_l = t_u_l + tp_x.get_v() - 0.14
-            # print(t_u_l)
-            tp_y.set_r1_floating()
-            t_u_c = t_u_c + tp_y.get_v()
-
-        u_c = t_u_c/100 + u_c
-        u_l = t_u_l/100 + u_l
-        u_h = t_u_h/100 + u_h
+    # Per pulse: r1 high and read Uh, r1 low, read Ul, float and read Uc
+    sequence = esr_sequence
+    sequence.clear()
+    for j in range(0, esr_samples):
+        start = j * esr_period_us
+        sequence.add(start, tp_y, (0, 1, 0), tp_y)
+        sequence.add(start + esr_high_us, tp_y, (0, -1, 0))
+        sequence.add(start + esr_high_us + esr_low_us, None, None, tp_x)
+        sequence.add(start + esr_high_us + esr_low_us, tp_y, (0, 0, 0), tp_y)
+
+    high_us = 0
+    for i in range(0, esr_cycles):
+        if not pulse_scheduler.run(sequence):
+            log_capacitor.error('ESR pulse timer did not fire')
+            return -1
+
+        u_h = sequence.get_sample_mean(0, 4) + u_h
+        u_l = sequence.get_sample_mean(2, 4) + u_l
+        u_c = sequence.get_sample_mean(3, 4) + u_c
+        high_us = sequence.get_interval_mean(0, 1, 4) + high_us
 
         tp_y.set_r1_low()
-        sleep_ms(5)
+        tp_y.settle(min_us=recharge_us)
 
-    u_c = u_c / 10
-    u_l = u_l / 10
-    u_h = u_h / 10
+    high_us = high_us / esr_cycles
+    log_capacitor.debug('ESR pulse: requested {0} us high, achieved {1} us, max step error {2} us', esr_high_us, high_us, sequence.get_max_error())
+
+    u_c = u_c / esr_cycles / 1000000
+    u_l = u_l / esr_cycles / 1000000
+    if not tp_x.is_calibrated():
+        u_l -= esr_low_offset_uv / 1000000
+    u_h = u_h / esr_cycles / 1000000
+
+    # The charge the capacitor picks up is proportional to the time r1 was
+    # actually high, scale Uc back to the requested pulse width
+    if high_us > 0:
+        u_c = u_c * esr_high_us / high_us
 
     # u_l = u_l - 1.4
     # u_l = 3.04 - u_h - u_c
-    debug('Uc: {0}, Ul: {1}, Uh: {2}'.format(u_c, u_l, u_h))
+    log_capacitor.debug('Uc: {0}, Ul: {1}, Uh: {2}', u_c, u_l, u_h)
 
     u_diff = u_h - u_l
     u_esr = u_diff - u_c
@@ -478,32 +1329,32 @@ def compute_i_q_factor(inductance, resistance, frequency):
 
 
 def measure_capacitance_test(tp_x, tp_y):
+    """
+    Measures capacitance, ESR and Q factor of the part between two test
+    points into capacitor_component.
+
+    Returns:
+        bool: True if a capacitor was measured.
+    """
     global capacitor_component
-    global detected_component
     
     # Discharge the capacitor
-    rc = capacitor_discharge(tp_x, tp_y)
-    
-    if rc == -1:
-        # treat capacitor big charge
-        return
-    elif rc == -2:
-        # treat capacitor discharge fail
-        return
+    if not discharge_part(tp_x, tp_y, log_capacitor).is_discharged():
+        return False
     
     # Charge the capacitor
-    rc = capacitor_charge(tp_x, tp_y)
-    if rc == -1:
+    tau = capacitor_charge(tp_x, tp_y)
+    if tau == -1:
         # treat capacitor charge fail
-        return
-    elif rc == -2:
+        return False
+    elif tau == -2:
         # treat capacitor not detected
-        return
+        return False
     
-    detected_component = detected_component | 2
-    capacitance = rc / 680 * 1000 # capacitance in uF
+    capacitance = tau / charge_curve.get_series_resistance() # capacitance in uF
+    log_capacitor.debug('Curve of {0} samples, stride {1}', charge_curve.get_count(), charge_curve.stride)
 
-    esr = measure_capacitor_esr(tp_x, tp_y)
+    esr = measure_capacitor_esr(tp_x, tp_y, capacitance)
 
     capacitor_component = Capacitor(capacitance)
     capacitor_component.set_esr(esr)
@@ -515,187 +1366,603 @@ def measure_capacitance_test(tp_x, tp_y):
     capacitor_component.set_df(1/q_factor)
     capacitor_component.update_data()
 
-    debug('Capacitance: {0} uF'.format(capacitance))
-    debug('Capacitor ESR: {0} R'.format(esr))
-    debug('Capacitor Q factor: {0}'.format(q_factor))
+    log_capacitor.info('Capacitance: {0} uF, ESR: {1} ohm, Q factor: {2}', capacitance, esr, q_factor)
+    return True
 
-def measure_capacitance():
-    global tp1, tp2, tp3
-    measure_capacitance_test(tp1, tp2)
-    #measure_capacitance_test(tp2, tp1)
+def rise_fit(times, values, tau):
+    """
+    Least squares fit of values = a - b * exp(-t / tau) for a given tau,
+    linear in a and b.
 
-def inductor_discharge(tp_x, tp_y):
-    # Safety check
-    tp_x.set_r0_low()
-    tp_y.set_r1_low()
-    
-    # Pin shorting through the 680 Ohm resistor
-    
-    max_count_discharge = 4
-    discharge_index = 0
+    Returns:
+        tuple: (sum of squared residuals, a, b).
+    """
+    n = len(times)
+    sf = sff = sv = sfv = 0.0
+    for i in range(n):
+        f = math.exp(-times[i] / tau)
+        sf += f
+        sff += f * f
+        sv += values[i]
+        sfv += f * values[i]
+    det = n * sff - sf * sf
+    if det <= 0:
+        return float('inf'), 0.0, 0.0
+    a = (sv * sff - sf * sfv) / det
+    c = (n * sfv - sf * sv) / det
+    sse = 0.0
+    for i in range(n):
+        r = values[i] - a - c * math.exp(-times[i] / tau)
+        sse += r * r
+    return sse, a, -c
+
+def fit_time_constant(times, values, tau_low, tau_high, iterations=30):
+    """
+    Fits values = a - b * exp(-t / tau) to a rising current: a and b by
+    rise_fit() for every tau tried, tau by golden section search over its
+    logarithm between tau_low and tau_high. b takes up the reading being
+    taken a conversion after the pulse width, so only tau and a matter.
 
-    while tp_x.get_v() > 0.16 or tp_y.get_v() > 0.16:
-        sleep(0.2)
-        
-        debug('Discharging status: TP X: {0}, TP Y: {1}'.format(tp_x.get_v(), tp_y.get_v()))
-        discharge_index+=1
-        
-        if discharge_index > max_count_discharge:
-            debug('Discharge failed. Exiting...')
-            return -1
+    Returns:
+        tuple: (tau, a, b, RMS residual).
+    """
+    golden = 0.6180339887
+    low = math.log(tau_low)
+    high = math.log(tau_high)
+    m1 = high - golden * (high - low)
+    m2 = low + golden * (high - low)
+    f1 = rise_fit(times, values, math.exp(m1))[0]
+    f2 = rise_fit(times, values, math.exp(m2))[0]
+    for _ in range(iterations):
+        if f1 < f2:
+            high = m2
+            m2, f2 = m1, f1
+            m1 = high - golden * (high - low)
+            f1 = rise_fit(times, values, math.exp(m1))[0]
+        else:
+            low = m1
+            m1, f1 = m2, f2
+            m2 = low + golden * (high - low)
+            f2 = rise_fit(times, values, math.exp(m2))[0]
+    tau = math.exp((low + high) / 2)
+    sse, a, b = rise_fit(times, values, tau)
+    return tau, a, b, math.sqrt(sse / len(times))
+
+def inductance_rise(tp_x, tp_y):
+    """
+    One long pulse from the shunted pin of tp_y, read across the 680 ohm
+    resistor of tp_x at doubling times up to inductance_rise_us, then the
+    driven end of the part inductance_repeats times.
+
+    Returns:
+        tuple: (times, readings of tp_x, mean reading of tp_y), None if the
+            timer did not fire. tp_y is left low.
+    """
+    sequence = inductance_sequence
+    sequence.clear()
+    sequence.add(0, tp_y, (1, 0, 0), tp_x)
+    offset = 1
+    while offset <= inductance_rise_us:
+        sequence.add(offset, None, None, tp_x)
+        offset *= 2
+    reads = sequence.count
+    # Right after the last read
+    for _ in range(inductance_repeats):
+        sequence.add(0, None, None, tp_y)
+    sequence.add(0, tp_y, (-1, 0, 0))
+    if not pulse_scheduler.run(sequence):
+        return None
+    times = [sequence.get_actual(i) for i in range(reads)]
+    values = [sequence.get_sample(i) for i in range(reads)]
+    driven = 0
+    for i in range(reads, reads + inductance_repeats):
+        driven += sequence.get_sample(i)
+    return times, values, driven / inductance_repeats
+
+def sweep_inductance(tp_x, tp_y, start=None):
+    """
+    Measures the inductance and series resistance of the part between two
+    test points from the rise of the current switched into it from the
+    shunted pin of tp_y, read across the 680 ohm resistor of tp_x.
+
+    inductance_rise() gives a first time constant and the settled
+    readings. Pulses of inductance_widths widths from 0 to
+    inductance_span_tau time constants are then repeated
+    inductance_repeats times each, or as often as fits into
+    inductance_average_us, widths interleaved and with
+    inductance_gap_tau time constants between pulses, packed into pulse
+    sequences of at most inductance_sequence_us. Fewer repeats are used
+    where the measurement, counted from start, would overrun
+    inductance_budget_us. The mean reading per
+    width, against the achieved mean width, is fitted with
+    fit_time_constant(): the settled current a / (680 + pin resistance)
+    and the driven end give the series resistance, the time constant times
+    the resistance of the whole loop the inductance.
 
-    return 0
+    Args:
+        tp_x (TestPoint): The test point the current is read at.
+        tp_y (TestPoint): The test point the pulses are driven from.
+        start (int): ticks_us() the measurement started at, the discharge
+            before the sweep included. Defaults to now.
+
+    Returns:
+        InductanceResult: The outcome. tp_x is left low through its 680 ohm
+            resistor and tp_y through its shunted pin.
+    """
+    if start is None:
+        start = ticks_us()
+    tp_x.set_r1_low()
+    tp_y.set_r0_low()
+    rise = inductance_rise(tp_x, tp_y)
+    if rise is None:
+        log_inductor.error('Inductance pulse timer did not fire')
+        return InductanceResult(InductanceResult.TIMER_FAILED, time_us=ticks_diff(ticks_us(), start))
+    times, values, driven_uv = rise
+    settled = values[-1]
+    rising = settled - values[0]
+    log_inductor.debug('Rise from {0} uV to {1} uV, driven end {2} uV', values[0], settled, driven_uv)
+    if settled < probe_conduct_uv or rising < inductance_min_rise * settled:
+        return InductanceResult(InductanceResult.NOT_INDUCTIVE, time_us=ticks_diff(ticks_us(), start))
+    if settled - values[-2] > inductance_min_rise * settled:
+        log_inductor.warn('Still rising after {0} us', times[-1] - times[0])
+        return InductanceResult(InductanceResult.OUT_OF_RANGE, time_us=ticks_diff(ticks_us(), start))
+    
+    # First time constant: where the distance to the settled reading has
+    # fallen to 1/e, between two of the doubling reads
+    target = rising / math.e
+    j = 1
+    while settled - values[j] > target:
+        j += 1
+    above = settled - values[j - 1]
+    below = settled - values[j]
+    crossing = times[j - 1] + (times[j] - times[j - 1]) * (above - target) / (above - below)
+    tau = max(crossing - times[0], 1)
+    # One conversion, the time the reads take back to back
+    read_us = min(times[i + 1] - times[i] for i in range(len(times) - 1))
+    
+    widths = [int(k * inductance_span_tau * tau / (inductance_widths - 1)) for k in range(inductance_widths)]
+    gap = read_us + int(inductance_gap_tau * tau)
+    round_us = sum(widths) + inductance_widths * gap
+    repeats = max(inductance_repeats, inductance_average_us // round_us)
+    # Every pulse sequence starts a 1 ms timer period after it is run, and
+    # at least the longest pulse fits into one
+    per_sequence = max(1, inductance_sequence_us // (widths[-1] + gap))
+    budget_round_us = round_us + 1000 * inductance_widths // per_sequence + 1000
+    repeats = min(repeats, (inductance_budget_us - ticks_diff(ticks_us(), start) - gap) // budget_round_us)
+    if repeats < 1:
+        log_inductor.warn('Time constant {0} us too long for the time budget', tau)
+        return InductanceResult(InductanceResult.OUT_OF_RANGE, tau_us=tau, time_us=ticks_diff(ticks_us(), start))
+    log_inductor.debug('Time constant about {0} us, widths up to {1} us, {2} repeats', tau, widths[-1], repeats)
+    sleep_us(gap)
+    
+    sums = [0] * inductance_widths
+    spans = [0] * inductance_widths
+    sequence = inductance_sequence
+    pulses = repeats * inductance_widths
+    done = 0
+    while done < pulses:
+        sequence.clear()
+        offset = 0
+        first = done
+        while done < pulses and sequence.count + 4 <= sequence.size:
+            width = widths[done % inductance_widths]
+            if offset and offset + width + gap > inductance_sequence_us:
+                break
+            sequence.add(offset, tp_y, (1, 0, 0))
+            sequence.add(offset + width, None, None, tp_x)
+            sequence.add(offset + width + 1, tp_y, (-1, 0, 0))
+            offset += width + gap
+            done += 1
+        # The last pulse decays before the next sequence
+        sequence.add(offset)
+        if not pulse_scheduler.run(sequence):
+            log_inductor.error('Inductance pulse timer did not fire')
+            return InductanceResult(InductanceResult.TIMER_FAILED, time_us=ticks_diff(ticks_us(), start))
+        for i in range(done - first):
+            k = (first + i) % inductance_widths
+            sums[k] += sequence.get_sample(3 * i + 1)
+            spans[k] += sequence.get_interval(3 * i, 3 * i + 1)
+    
+    times = [spans[k] / repeats for k in range(inductance_widths)]
+    values = [sums[k] / repeats for k in range(inductance_widths)]
+    tau_low = tau / 4
+    tau_high = tau * 4
+    tau, a, b, rms = fit_time_constant(times, values, tau_low, tau_high)
+    elapsed = ticks_diff(ticks_us(), start)
+    if a <= 0 or b <= 0 or tau < tau_low * 1.01 or tau > tau_high / 1.01:
+        log_inductor.warn('Rise does not fit, tau {0} us, a {1} uV, b {2} uV', tau, a, b)
+        return InductanceResult(InductanceResult.OUT_OF_RANGE, tau_us=tau, rms_uv=rms, pulses=pulses,
+                                time_us=elapsed)
+    
+    # The current read across 680 ohm and the pin of tp_x flows through the
+    # part from the driven end
+    sense = 680 + tp_x.pin_res
+    current = a / sense
+    resistance = max((driven_uv - a) / current, 0.0)
+    inductance = tau * (resistance + sense + tp_y.pin_res) / 1000 # inductance in mH
+    return InductanceResult(InductanceResult.MEASURED, inductance, resistance, tau, rms, pulses, elapsed)
 
 def measure_inductance_test(tp_x, tp_y):
-    global inductor_component
-    global detected_component
+    """
+    Measures inductance, series resistance and Q factor of the part between
+    two test points into inductor_component, see sweep_inductance(). The
+    outcome of the sweep is kept in inductance_result.
+
+    Returns:
+        bool: True if an inductor was measured.
+    """
+    global inductor_component, inductance_result
     
-    debug('Inductor test')
-    # Discharge the inductor
-    rc = inductor_discharge(tp_x, tp_y)
+    log_inductor.debug('Inductor test')
+    inductance_result = None
+    start = ticks_us()
+    if not discharge_part(tp_x, tp_y, log_inductor).is_discharged():
+        return False
     
-    if rc == -1:
-        # treat inductor big charge
-        return -1
+    result = sweep_inductance(tp_x, tp_y, start)
+    inductance_result = result
+    log_inductor.debug('Inductance sweep {0}', result.get_summary())
+    if not result.is_measured():
+        return False
     
-    # Charge the inductor
+    inductance = result.get_inductance()
+    resistance = result.get_resistance()
+    inductor_component = Inductor(inductance)
+    q_factor = compute_i_q_factor(inductance / 1000, resistance, 10000) if resistance > 0 else float('inf')
+    inductor_component.set_qf(q_factor)
+    inductor_component.set_df(1 / q_factor)
+    inductor_component.set_resistance(resistance)
+    log_inductor.info('Inductance: {0} mH, Q factor: {1}, resistance: {2} ohm', inductance, q_factor, resistance)
+    inductor_component.update_data()
+    return True
 
-    time_us = 10
-    sleep(0.05)
+def measure_phase(trigger='request'):
+    """
+    Classifies the part with the cheap probe and then runs only the
+    measurement its class calls for: the auto-ranging resistance for short
+    and resistive pairs, the settled diode readings for rectifying ones,
+    the charge curve and ESR for reactive ones and the pulse width sweep
+    for inductive ones, which are measured as resistors if the sweep finds
+    no inductance it can resolve. Open pairs cost nothing more.
 
-    tp_x.set_r1_low()
-    voltage = tp_x.get_v()
-    # debug("Initial voltage: {0}".format(voltage))
+    Args:
+        trigger (str): What started the measurement, see publish_measurement().
 
+    Returns:
+        Classification: The component found, also stored in classification.
+    """
+    global resistance_result, inductance_result, classification
+    global resistor_component, diode_component
+    resistance_result = None
+    inductance_result = None
+    start = ticks_us()
+    
+    probe = classify()
+    probe_time_us = ticks_diff(ticks_us(), start)
+    x, y = probe.get_pair()
+    tps = (tp1, tp2, tp3)
+    kind = probe.get_kind()
+    component = None
+    confidence = probe.get_confidence()
+    
+    if kind == PairProbe.INDUCTIVE:
+        if measure_inductance_test(tps[x], tps[y]):
+            component = 'inductor'
+        elif inductance_result is not None and inductance_result.get_status() == InductanceResult.NOT_INDUCTIVE:
+            # Too fast to resolve, what is left is the winding resistance
+            kind = PairProbe.RESISTIVE
+        else:
+            confidence = 0
+    
+    if kind == PairProbe.SHORT or kind == PairProbe.RESISTIVE:
+        resistance_result = measure_resistance_auto(tps[x], tps[y])
+        resistor_component = Resistor(resistance_result.get_resistance())
+        component = 'resistor'
+        confidence = min(confidence, 1 - min(1, resistance_result.get_mismatch()))
+    elif kind == PairProbe.RECTIFYING:
+        readings = {}
+        run_scan_plan([(x, 1, y, 0), (y, 1, x, 0)], readings)
+        diode_detected, forward_voltage, flow_direction = pair_diode(readings, x, y)
+        if diode_detected:
+            diode_component = Diode(forward_voltage, flow_direction)
+            component = 'diode'
+        else:
+            confidence = 0
+    elif kind == PairProbe.REACTIVE:
+        if measure_capacitance_test(tps[x], tps[y]):
+            component = 'capacitor'
+        else:
+            confidence = 0
+    
+    for tp in tps:
+        tp.set_pins_floating()
+    
+    classification = Classification(probe, component, confidence, probe_time_us, ticks_diff(ticks_us(), start))
+    log_main.info('Classified as {0} ({1}) in {2} us', component, confidence, classification.get_time_us())
+    publish_measurement(trigger)
+    return classification
+
+def presence_probe():
+    """
+    Cheap check which test points are connected to another one. All three
+    are shorted low for probe_discharge_us, then each in turn is pulled up
+    through its 470k ohm resistor with the two others held low and read
+    once after presence_dwell_us: three ADC readings in all. A part pulls
+    the reading below presence_threshold_uv, a diode only with its anode on
+    the pulled-up test point, so the signature also tells its direction.
 
-    tp_y.set_r0_high()
-    sleep_us(time_us)
-    tp_y.set_r0_low()
-    
-    voltage = tp_x.get_v()
+    Returns:
+        int: Bit i set if test point i conducts to another one, 0 if the
+            test points are open.
+    """
+    tps = (tp1, tp2, tp3)
+    signature = 0
+    for tp in tps:
+        tp.drive(-1, 0, 0)
+    sleep_us(probe_discharge_us)
+    for i in range(3):
+        tp = tps[i]
+        tp.drive(0, 0, 1)
+        sleep_us(presence_dwell_us)
+        if tp.get_uv() < presence_threshold_uv:
+            signature |= 1 << i
+        tp.drive(-1, 0, 0)
+    for tp in tps:
+        tp.set_pins_floating()
+    return signature
+
+def presence_poll():
+    """
+    One step of the presence detection: probes the test points and, once a
+    new state has been probed presence_debounce times in a row, measures
+    the part, or publishes an empty result when it was removed.
 
+    Returns:
+        bool: True if a change was published.
+    """
+    global classification
+    if not presence.update(presence_probe(), ticks_ms()):
+        return False
+    signature = presence.get_value()
+    log_main.info('Test points changed to {0}, seen {1} ms ago', signature,
+                  ticks_diff(ticks_ms(), presence.get_first_ms()))
+    if signature:
+        measure_phase('presence')
+    else:
+        classification = None
+        publish_measurement('presence')
+    announce_measurement()
+    return True
 
-    diff = time_us * 10**(-6)
-    #voltage = 2.05
-    inductance = - diff * 680 / math.log(1-voltage/3.3) * 1000 # inductance in mH
-    # debug("Uref: {0}, t: {1}, Inductance: {2}".format(voltage, diff, inductance))
-    detected_component = detected_component | 4
+def announce_measurement():
+    """
+    Pushes the latest measurement to the connected consumers: as a
+    measurement event to the stream clients and as an unrequested
+    MSG_RESULT to host_app. JSON API clients see the new ETag.
+    """
+    stream_hub.publish('measurement', measurement_json.decode())
+    if serial_out is not None:
+        send_frame(MSG_RESULT, measurement_json)
 
-    inductor_component = Inductor(inductance)
-    debug('Inductance: {0} mH'.format(inductance))
+def init_calibration():
+    """
+    Loads the ADC calibration of calibration_file into the test points.
+    Without one they keep the raw readings and the nominal pin_res.
+    """
+    global calibration
+    calibration = Calibration()
+    start = ticks_us()
+    if calibration.load(calibration_file):
+        apply_calibration()
+        log_main.info('ADC calibration loaded in {0} us, pin resistances {1}', ticks_diff(ticks_us(), start),
+                      [round(tp.pin_res, 1) for tp in (tp1, tp2, tp3)])
+    else:
+        log_main.info('No ADC calibration, readings uncorrected')
 
-    q_factor = compute_i_q_factor(inductance/1000, 680, 10000)
-    debug(f'Inductor Q factor: {q_factor}')
-    inductor_component.set_qf(q_factor)
-    inductor_component.set_df(1/q_factor)
-    inductor_component.set_resistance(resistor_component.get_resistance())
-    debug(f'Inductor Resistance: {resistor_component.get_resistance()}')
-    inductor_component.update_data()
+def apply_calibration():
+    """
+    Expands the knots of the calibration into the lookup tables of the
+    test points, or reverts them to raw readings if there is none.
+    """
+    tps = (tp1, tp2, tp3)
+    for i in range(3):
+        if calibration.is_valid():
+            pin_resistance, knots = calibration.points[i]
+            tps[i].set_calibration(build_table(knots), pin_resistance)
+        else:
+            tps[i].set_calibration(None, pin_res)
+
+def calibration_configs(step):
+    """
+    The drive states of a calibration step with the test points that are
+    read in each.
 
-def measure_inductance():
-    global tp1, tp2, tp3
-    measure_inductance_test(tp1, tp2)
+    Args:
+        step (str): 'open', 'short' or 'reference'.
 
-def test_diode(tp_x, tp_y):
-    diode_detected = False
-    forward_voltage = -1
-    flow_direction = (tp_x.get_name(), tp_y.get_name())
-    
-    tp_x.set_pins_floating()
-    tp_y.set_pins_floating()
-    
-    # Testing which is cathode and anode part 1
-    tp_x.set_r1_low()
-    tp_y.set_r0_high()
-    
-    y_x_current_flow = False
-    y_x_forward_voltage = 0
-    
-    if tp_x.get_v() > 0.15:
-        y_x_current_flow = True
-        y_x_forward_voltage = tp_y.get_v() - tp_x.get_v() #3.3 or tp_y.get_v for accuracy
-        flow_direction = (tp_y.get_name(), tp_x.get_name()) # current flows from y to x
-    
-    # Testing which is cathode and anode part 1
-    tp_y.set_r0_floating()
-    tp_y.set_r1_low()
-    tp_x.set_r0_high()
-    
-    x_y_current_flow = False
-    x_y_forward_voltage = 0
-    
-    if tp_y.get_v() > 0.15:
-        x_y_current_flow = True
-        x_y_forward_voltage = tp_x.get_v() - tp_y.get_v() #3.3 or tp_x.get_v for accuracy
-        flow_direction = (tp_x.get_name(), tp_y.get_name()) # current flows from x to y
-         
-    diode_detected = x_y_current_flow != y_x_current_flow
-    
-    if diode_detected:
-        forward_voltage = max(x_y_forward_voltage, y_x_forward_voltage)
-    
-    tp_x.set_pins_floating()
-    tp_y.set_pins_floating()
-    
-    return diode_detected, forward_voltage, flow_direction
-    
-def measure_semiconductors():
-    global tp1, tp2, tp3
-    global diode_component
-    global detected_component
-    
-    diode_detected = False
-    forward_voltage = -1
-    flow_direction = ('none', 'none')
+    Returns:
+        list: ((r0, r1, r2) per test point, read test point indices) pairs.
+    """
+    configs = []
+    floating = (0, 0, 0)
+    if step == 'open':
+        # Each test point on its own: the rails, 680 ohm against r0 and
+        # 470k ohm against 680 ohm in both directions
+        for i in range(3):
+            for state in ((-1, 0, 0), (1, 0, 0), (-1, 1, 0), (1, -1, 0), (0, 1, -1), (0, -1, 1)):
+                states = [floating] * 3
+                states[i] = state
+                configs.append((tuple(states), (i,)))
+    elif step == 'short':
+        # The 680 ohm resistors against each other
+        for a in (-1, 1):
+            for b in (-1, 1):
+                for c in (-1, 1):
+                    if not a == b == c:
+                        configs.append((((0, a, 0), (0, b, 0), (0, c, 0)), (0, 1, 2)))
+        # One shunted pin against one to three 680 ohm resistors, near
+        # both rails
+        for sign in (-1, 1):
+            for i in range(3):
+                for k in range(1, 4):
+                    configs.append((tuple((sign if j == i else 0, -sign if j < k else 0, 0) for j in range(3)),
+                                    (0, 1, 2)))
+        # Two shunted pins against each other, for the pin resistances
+        for i in range(3):
+            for j in range(3):
+                if i != j:
+                    configs.append((tuple((-1 if t == i else 1 if t == j else 0, 0, 0) for t in range(3)),
+                                    (0, 1, 2)))
+    else:
+        configs.append((((-1, 0, 0), (1, 0, 0), floating), (0, 1)))
+        configs.append((((1, 0, 0), (-1, 0, 0), floating), (0, 1)))
+    return configs
+
+def read_calibration_step(step):
+    """
+    Applies the configurations of a calibration step and averages
+    calibration_samples raw readings of the read test points in each.
+
+    Returns:
+        list: (states, (uv1, uv2, uv3)) per configuration, -1 for the test
+            points not read.
+    """
+    tps = (tp1, tp2, tp3)
+    tables = [(tp.table, tp.pin_res) for tp in tps]
+    for tp in tps:
+        tp.set_calibration(None, pin_res)
+    buffer = new_sample_buffer(calibration_samples)
+    readings = []
+    for states, read in calibration_configs(step):
+        for i in range(3):
+            tps[i].drive(*states[i])
+        values = [-1, -1, -1]
+        for i in read:
+            tps[i].settle()
+            tps[i].sample(calibration_samples, buffer)
+            values[i] = buffer_mean(buffer, calibration_samples)
+        readings.append((states, tuple(values)))
+    for i in range(3):
+        tps[i].set_pins_floating()
+        tps[i].set_calibration(*tables[i])
+    return readings
+
+def calibrate(step, reference_ohm=None):
+    """
+    One step of the guided ADC calibration. host_app asks for them in
+    order: 'open' with nothing on the test points, 'short' with all three
+    shorted together and 'reference' with a known resistor between TP1 and
+    TP2, which solves, stores and applies the calibration. 'clear' removes
+    it. Each step first checks the test points with presence_probe().
+
+    Args:
+        step (str): The step.
+        reference_ohm (float): The resistor of the reference step,
+            calibration_reference_ohm by default.
+
+    Returns:
+        int: STATUS_OK, or STATUS_ERROR if the test points do not look as
+            the step expects, a step before it is missing or the readings
+            do not solve into a calibration.
+    """
+    global calibration_readings
+    if step == 'clear':
+        try:
+            uos.remove(calibration_file)
+        except OSError:
+            pass
+        calibration.set_points([], [])
+        apply_calibration()
+        log_main.info('ADC calibration cleared')
+        return STATUS_OK
+    expected = {'open': 0, 'short': 0b111, 'reference': 0b011}.get(step)
+    if expected is None:
+        return STATUS_ERROR
+    signature = presence_probe()
+    if signature != expected:
+        log_main.warn('Calibration step {0} expects test points {1}, found {2}', step, expected, signature)
+        return STATUS_ERROR
+    if step == 'open':
+        calibration_readings = {}
+    elif step == 'short' and 'open' not in calibration_readings:
+        return STATUS_ERROR
+    elif step == 'reference' and 'short' not in calibration_readings:
+        return STATUS_ERROR
+    calibration_readings[step] = read_calibration_step(step)
+    log_main.info('Calibration step {0}: {1} configurations', step, len(calibration_readings[step]))
+    if step != 'reference':
+        return STATUS_OK
+    
+    if reference_ohm is None:
+        reference_ohm = calibration_reference_ohm
+    start = ticks_us()
+    pin_resistances, knots = solve(calibration_readings['open'], calibration_readings['short'],
+                                   calibration_readings['reference'], reference_ohm, pin_res, supply_uv)
+    calibration_readings = {}
+    if pin_resistances is None:
+        log_main.warn('Calibration rejected, the readings give no pin resistance or too few knots for a test point')
+        return STATUS_ERROR
+    for i in range(3):
+        if not calibration_min_pin_res <= pin_resistances[i] <= calibration_max_pin_res or len(knots[i]) < 2:
+            log_main.warn('Calibration rejected, pin resistances {0}', pin_resistances)
+            return STATUS_ERROR
+    calibration.set_points(pin_resistances, knots)
+    size = calibration.save(calibration_file)
+    apply_calibration()
+    log_main.info('ADC calibration solved in {0} us, {1} bytes, pin resistances {2}', ticks_diff(ticks_us(), start),
+                  size, [round(r, 1) for r in pin_resistances])
+    return STATUS_OK
+
+async def measurement_loop():
+    """
+    Runs the measurements as a task of the event loop. With
+    presence_enabled the test points are probed every presence_poll_ms and
+    a part is measured whenever it is inserted or changed; otherwise it is
+    measured once. The server tasks get the loop back between probes.
+    """
+    global presence
+    await asyncio.sleep(0)
+    if not presence_enabled:
+        measure_phase()
+        log_main.info('Measurement pass OK')
+        return
     
-    diode_detected, forward_voltage, flow_direction = test_diode(tp1, tp2)
+    presence = PresenceDebouncer(presence_debounce)
+    log_main.info('Waiting for parts')
+    while True:
+        presence_poll()
+        await asyncio.sleep(presence_poll_ms / 1000)
+
+async def run():
+    serial_task = None
+    if serial_enabled:
+        init_serial()
+        serial_task = asyncio.create_task(serial_loop())
     
-    if diode_detected:
-        debug('Diode detected with Vf: {0}, cathode at {1} and anode at {2}'.format(forward_voltage, flow_direction[1], flow_direction[0]))
-        detected_component = detected_component | 8
-        diode_component = Diode(forward_voltage, flow_direction)
-    else:
-        debug('Diode not detected between {0} and {1}'.format(flow_direction[1], flow_direction[0]))
+    if wifi_enabled and init_wifi():
+        await start_server()
+        asyncio.create_task(stream_voltages())
     
-    '''
-    diode_detected, forward_voltage, flow_direction = test_diode(tp1, tp3)
+    measurement_task = asyncio.create_task(measurement_loop())
     
-    if diode_detected:
-        debug('Diode detected with Vf: {0}, cathode at {1} and anode at {2}'.format(forward_voltage, flow_direction[1], flow_direction[0]))
-    else:
-        debug('Diode not detected at {0} and {1}'.format(flow_direction[1], flow_direction[0]))
-        
-    diode_detected, forward_voltage, flow_direction = test_diode(tp2, tp3)
-        
-    if diode_detected:
-        debug('Diode detected with Vf: {0}, cathode at {1} and anode at {2}'.format(forward_voltage, flow_direction[1], flow_direction[0]))
-    else:
-        debug('Diode not detected at {0} and {1}'.format(flow_direction[1], flow_direction[0]))
-    '''
-def measure_phase():
-        
-    measure_resistance()
-    #measure_inductance()
-    measure_capacitance()
-    measure_semiconductors()
+    log_main.info('Loop status OK')
     
+    await measurement_task
+    if http_server is not None:
+        await http_server.wait_closed()
+    if serial_task is not None:
+        await serial_task
+
 def main():
     global wifi_enabled
     
     init_pins()
-    debug("###################\n$ ## Init Pass: OK ##\n$ ###################\n$")
-    
-    #init_serial()
-    #debug("\n$ ###########################\n$ ## Serial Comms Pass: OK ##\n$ ###########################\n$ ")
-    
-    if wifi_enabled:
-        init_wifi()
-    
-    measure_phase()
-    
-    debug("\n$ ##########################\n$ ## Measurement Pass: OK ##\n$ ##########################\n$ ")
+    init_calibration()
+    if history_enabled:
+        init_history()
+    log_main.info('Init pass OK')
     
-    debug("\n$ #####################\n$ ## Loop Status: OK ##\n$ #####################\n$ ")
+    asyncio.run(run())
 if __name__ == "__main__":
     main()
 
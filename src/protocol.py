@@ -0,0 +1,204 @@
+"""
+Framed binary protocol between the firmware and host_app.
+
+A frame is
+
+    A5 5A | type (1) | length (2, LE) | payload (length) | crc32 (4, LE)
+
+with the CRC-32 taken over type, length and payload. The module runs
+unchanged on MicroPython and CPython; host_app imports it from src/.
+"""
+
+import struct
+from binascii import crc32
+
+SYNC0 = 0xA5
+SYNC1 = 0x5A
+HEADER_SIZE = 5
+CRC_SIZE = 4
+
+## Message types, host to device
+MSG_MEASURE = 0x01
+MSG_CONFIGURE = 0x02
+MSG_SET_WIFI = 0x03
+MSG_GET_CURVE = 0x04
+MSG_GET_HISTORY = 0x05
+# Answered with one MSG_LOG per trace record, then an ACK
+MSG_GET_TRACE = 0x06
+# JSON payload {"step": "open" | "short" | "reference" | "clear", "ohm": reference resistor}
+MSG_CALIBRATE = 0x07
+
+## Message types, device to host
+MSG_ACK = 0x80
+MSG_RESULT = 0x81
+MSG_SAMPLES = 0x82
+MSG_LOG = 0x83
+MSG_HISTORY = 0x84
+
+## ACK status codes
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_UNKNOWN = 2
+
+## Sample block channels
+CHANNEL_CURVE_TIME = 0
+CHANNEL_CURVE_VALUE = 1
+
+# Header of a MSG_SAMPLES payload: channel, flags, offset of the first
+# sample, sample count, then count int32 samples
+SAMPLES_HEADER = '<BBHH'
+SAMPLES_HEADER_SIZE = 6
+SAMPLES_LAST = 1
+
+# MSG_GET_HISTORY payload: first sequence number wanted, 0 for the newest
+# records, and the record count.
+# MSG_HISTORY payload: oldest and next sequence number of the log, then
+# the records as stored, see history.py
+HISTORY_REQUEST = '<IH'
+HISTORY_HEADER = '<II'
+HISTORY_HEADER_SIZE = 8
+
+## Aux functions
+def write_frame(stream, kind, payload=b'', body=None, body_bytes=0):
+    """
+    Writes one frame. The payload is payload followed by body; body can be
+    any buffer, e.g. an array('i'), and is written without copying.
+
+    Args:
+        stream: Anything with write().
+        kind (int): The message type.
+        payload (bytes): The first part of the payload.
+        body (buffer): Optional second part of the payload.
+        body_bytes (int): Length of body in bytes.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    length = len(payload) + body_bytes
+    header = struct.pack('<BBBH', SYNC0, SYNC1, kind, length)
+    crc = crc32(payload, crc32(memoryview(header)[2:]))
+    if body is not None:
+        crc = crc32(body, crc)
+    stream.write(header)
+    if payload:
+        stream.write(payload)
+    if body is not None:
+        stream.write(body)
+    stream.write(struct.pack('<I', crc & 0xFFFFFFFF))
+    return HEADER_SIZE + length + CRC_SIZE
+
+def write_samples(stream, channel, samples, offset, count, last):
+    """
+    Writes count int32 samples of an array('i') starting at offset as one
+    MSG_SAMPLES frame.
+    """
+    head = struct.pack(SAMPLES_HEADER, channel, SAMPLES_LAST if last else 0, offset, count)
+    return write_frame(stream, MSG_SAMPLES, head, memoryview(samples)[offset:offset + count], 4 * count)
+
+def parse_samples(payload):
+    """
+    Splits a MSG_SAMPLES payload.
+
+    Returns:
+        tuple: (channel, last, offset, samples as a tuple of ints)
+    """
+    channel, flags, offset, count = struct.unpack_from(SAMPLES_HEADER, payload, 0)
+    samples = struct.unpack_from('<' + str(count) + 'i', payload, SAMPLES_HEADER_SIZE)
+    return channel, bool(flags & SAMPLES_LAST), offset, samples
+
+## Classes
+class FrameDecoder:
+    def __init__(self, max_payload):
+        """
+        Reassembles frames from a byte stream in a fixed buffer.
+
+        Bytes are read straight into space() and announced with commit().
+        wanted() tells how many bytes complete the frame being received,
+        so a reader on a blocking stream can ask for exactly that many and
+        never per byte. Garbage between frames and frames with a bad CRC
+        are skipped.
+
+        Args:
+            max_payload (int): Largest payload accepted.
+
+        Returns:
+            None
+        """
+        self.max_payload = max_payload
+        self.size = HEADER_SIZE + max_payload + CRC_SIZE
+        self.buffer = bytearray(self.size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.frames = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def space(self):
+        """
+        The free part of the buffer to read into.
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end + self.wanted() > self.size:
+            # Move the partial frame to the front, happens at most once
+            # per frame
+            pending = self.end - self.start
+            self.buffer[0:pending] = self.buffer[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        return self.view[self.end:]
+
+    def commit(self, n):
+        if n:
+            self.end += n
+
+    def wanted(self):
+        """
+        Bytes still missing from the frame at the front of the buffer.
+        """
+        have = self.end - self.start
+        if have < HEADER_SIZE:
+            return HEADER_SIZE - have
+        length = self.buffer[self.start + 3] | (self.buffer[self.start + 4] << 8)
+        if length > self.max_payload:
+            return 1
+        return max(1, HEADER_SIZE + length + CRC_SIZE - have)
+
+    def drop(self):
+        self.start += 1
+        self.skipped += 1
+
+    def next(self):
+        """
+        Extracts the next complete frame.
+
+        Returns:
+            tuple: (type, payload memoryview), None if no frame is complete.
+                The payload stays valid until the next space() call.
+        """
+        buffer = self.buffer
+        while self.end - self.start >= 2:
+            start = self.start
+            if buffer[start] != SYNC0 or buffer[start + 1] != SYNC1:
+                self.drop()
+                continue
+            if self.end - start < HEADER_SIZE:
+                return None
+            length = buffer[start + 3] | (buffer[start + 4] << 8)
+            if length > self.max_payload:
+                self.errors += 1
+                self.drop()
+                continue
+            total = HEADER_SIZE + length + CRC_SIZE
+            if self.end - start < total:
+                return None
+            crc = struct.unpack_from('<I', buffer, start + HEADER_SIZE + length)[0]
+            if crc32(self.view[start + 2:start + HEADER_SIZE + length]) & 0xFFFFFFFF != crc:
+                self.errors += 1
+                self.drop()
+                continue
+            self.start = start + total
+            self.frames += 1
+            return buffer[start + 2], self.view[start + HEADER_SIZE:start + HEADER_SIZE + length]
+        return None
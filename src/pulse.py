@@ -0,0 +1,194 @@
+from machine import Timer, disable_irq, enable_irq
+from time import sleep_ms, ticks_us, ticks_diff
+from array import array
+import gc
+
+## Classes
+class PulseSequence:
+    def __init__(self, size):
+        """
+        Pre-allocates a sequence of timed pin-state and ADC sample steps.
+
+        Args:
+            size (int): Maximum number of steps.
+
+        Returns:
+            None
+        """
+        self.size = size
+        self.count = 0
+
+        self.offsets = array('i', bytes(4 * size))
+        self.actual = array('i', bytes(4 * size))
+        self.samples = array('i', bytes(4 * size))
+
+        self.r0 = array('b', bytes(size))
+        self.r1 = array('b', bytes(size))
+        self.r2 = array('b', bytes(size))
+        self.drive_tps = [None] * size
+        self.sample_tps = [None] * size
+
+    def clear(self):
+        self.count = 0
+
+    def add(self, offset_us, tp=None, state=None, sample=None):
+        """
+        Appends a step to the sequence.
+
+        Args:
+            offset_us (int): Requested time of the step from the sequence start.
+            tp (TestPoint): Test point to drive, or None.
+            state (tuple): (r0, r1, r2) drive state applied to tp.
+            sample (TestPoint): Test point read after driving, or None.
+
+        Returns:
+            int: The index of the step.
+        """
+        if self.count == self.size:
+            raise ValueError('Pulse sequence full')
+        i = self.count
+        self.offsets[i] = offset_us
+        self.drive_tps[i] = tp
+        if tp is not None:
+            self.r0[i], self.r1[i], self.r2[i] = state
+        self.sample_tps[i] = sample
+        self.count += 1
+        return i
+
+    def get_sample(self, i):
+        """
+        The reading of step i, corrected by the calibration of its test
+        point. The timed loop stores the raw readings.
+        """
+        return self.sample_tps[i].correct(self.samples[i])
+
+    def get_requested(self, i):
+        return self.offsets[i]
+
+    def get_actual(self, i):
+        return self.actual[i]
+
+    def get_error(self, i):
+        return self.actual[i] - self.offsets[i]
+
+    def get_max_error(self):
+        worst = 0
+        for i in range(self.count):
+            error = self.actual[i] - self.offsets[i]
+            if error > worst or -error > worst:
+                worst = abs(error)
+        return worst
+
+    def get_interval(self, first, second):
+        """
+        Achieved time between two steps, in microseconds.
+        """
+        return self.actual[second] - self.actual[first]
+
+    def get_sample_mean(self, first, stride):
+        """
+        Integer mean of the samples of every stride-th step from first on.
+        """
+        total = 0
+        n = 0
+        for i in range(first, self.count, stride):
+            total += self.sample_tps[i].correct(self.samples[i])
+            n += 1
+        return total // n if n else 0
+
+    def get_interval_mean(self, first, second, stride):
+        """
+        Mean achieved time between step first + k * stride and
+        second + k * stride, in microseconds.
+        """
+        total = 0
+        n = 0
+        for i in range(first, self.count - (second - first), stride):
+            total += self.actual[i + second - first] - self.actual[i]
+            n += 1
+        return total / n if n else 0
+
+class PulseScheduler:
+    def __init__(self, timer_id):
+        """
+        Runs pulse sequences from a one-shot hardware timer.
+
+        Args:
+            timer_id (int): The machine.Timer to use.
+
+        Returns:
+            None
+        """
+        self.timer = Timer(timer_id)
+        self.sequence = None
+        self.done = False
+
+    def run(self, sequence, timeout_ms=1000):
+        """
+        Executes a sequence and waits for it to finish.
+
+        The heap is collected first so no GC pause lands inside the
+        sequence, which then runs from the timer callback with interrupts
+        disabled. The achieved time of every step is stored in
+        sequence.actual.
+
+        Args:
+            sequence (PulseSequence): The steps to execute.
+            timeout_ms (int): How long to wait for the timer.
+
+        Returns:
+            bool: True if the sequence ran, False on timeout.
+        """
+        self.sequence = sequence
+        self.done = False
+        gc.collect()
+        self.timer.init(mode=Timer.ONE_SHOT, period=1, callback=self.fire)
+        waited = 0
+        while not self.done:
+            if waited > timeout_ms:
+                self.timer.deinit()
+                return False
+            sleep_ms(1)
+            waited += 1
+        return True
+
+    def fire(self, timer):
+        execute_sequence(self.sequence)
+        self.done = True
+
+## Aux functions
+def execute_sequence(sequence):
+    """
+    Busy-waits through the steps of a sequence, driving pins and reading the
+    ADC at the requested offsets. Does not allocate.
+
+    Args:
+        sequence (PulseSequence): The steps to execute.
+
+    Returns:
+        None
+    """
+    offsets = sequence.offsets
+    actual = sequence.actual
+    samples = sequence.samples
+    r0 = sequence.r0
+    r1 = sequence.r1
+    r2 = sequence.r2
+    drive_tps = sequence.drive_tps
+    sample_tps = sequence.sample_tps
+
+    irq_state = disable_irq()
+    start = ticks_us()
+    for i in range(sequence.count):
+        target = offsets[i]
+        now = ticks_diff(ticks_us(), start)
+        while now < target:
+            now = ticks_diff(ticks_us(), start)
+        actual[i] = now
+        tp = drive_tps[i]
+        if tp is not None:
+            tp.drive(r0[i], r1[i], r2[i])
+        tp = sample_tps[i]
+        if tp is not None:
+            samples[i] = tp.adc.read_uv()
+    enable_irq(irq_state)
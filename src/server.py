@@ -0,0 +1,314 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+STATUS_TEXT = {
+    200: 'OK',
+    204: 'No Content',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    408: 'Request Timeout',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+## Classes
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+class Request:
+    def __init__(self, method, path, query, version, headers, body, reader=None):
+        """
+        A parsed HTTP request.
+
+        Args:
+            method (str): The request method, upper case.
+            path (str): The path without the query string.
+            query (str): The query string, empty if there is none.
+            version (str): 'HTTP/1.0' or 'HTTP/1.1'.
+            headers (dict): Header values by lower case name.
+            body (bytes): The request body, empty without Content-Length.
+            reader (StreamReader): The connection, for handlers that answer
+                for as long as the client stays connected.
+
+        Returns:
+            None
+        """
+        self.method = method
+        self.path = path
+        self.query = query
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.reader = reader
+
+    def get_header(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def get_param(self, name, default=None):
+        """
+        Value of a query string parameter, without URL decoding.
+        """
+        for pair in self.query.split('&'):
+            key, _, value = pair.partition('=')
+            if key == name:
+                return value
+        return default
+
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+class Response:
+    def __init__(self, writer, keep_alive, head_only=False):
+        """
+        Writes one response to a client connection.
+
+        Args:
+            writer (StreamWriter): The connection.
+            keep_alive (bool): Keep the connection open after this response.
+            head_only (bool): Send the headers without the body (HEAD).
+
+        Returns:
+            None
+        """
+        self.writer = writer
+        self.keep_alive = keep_alive
+        self.head_only = head_only
+        self.headers = []
+        self.status = 0
+
+    def add_header(self, name, value):
+        self.headers.append((name, value))
+
+    def is_started(self):
+        return self.status != 0
+
+    def head(self, status, content_type, length):
+        """
+        Builds the status line and headers.
+
+        Args:
+            status (int): The HTTP status code.
+            content_type (str): The Content-Type, None to leave it out.
+            length (int): The Content-Length, None for a body that ends when
+                the connection closes.
+
+        Returns:
+            bytes: The encoded head, including the blank line.
+        """
+        self.status = status
+        lines = ['HTTP/1.1 {0} {1}'.format(status, STATUS_TEXT.get(status, ''))]
+        if content_type is not None:
+            lines.append('Content-Type: ' + content_type)
+        if status == 204 or status == 304:
+            # Never followed by a body, so no length either
+            pass
+        elif length is not None:
+            lines.append('Content-Length: ' + str(length))
+        else:
+            self.keep_alive = False
+        lines.append('Connection: ' + ('keep-alive' if self.keep_alive else 'close'))
+        for name, value in self.headers:
+            lines.append(name + ': ' + value)
+        lines.append('\r\n')
+        return '\r\n'.join(lines).encode()
+
+    async def send(self, status, body=b'', content_type='text/html'):
+        """
+        Sends a complete response.
+
+        Args:
+            status (int): The HTTP status code.
+            body (bytes or str): The body, str is UTF-8 encoded.
+            content_type (str): The Content-Type of the body.
+
+        Returns:
+            None
+        """
+        if isinstance(body, str):
+            body = body.encode()
+        self.writer.write(self.head(status, content_type if body else None, len(body)))
+        if body and not self.head_only and status != 204 and status != 304:
+            self.writer.write(body)
+        await self.writer.drain()
+
+    async def start(self, status, content_type, length=None):
+        """
+        Sends the head of a response whose body follows with write().
+        Without a length the connection is closed after the body.
+        """
+        self.writer.write(self.head(status, content_type, length))
+        await self.writer.drain()
+
+    async def write(self, chunk):
+        if self.head_only:
+            return
+        self.writer.write(chunk)
+        await self.writer.drain()
+
+    def feed(self, chunk):
+        """
+        Hands a body chunk to the connection without waiting for it to be
+        sent, see flush().
+        """
+        if not self.head_only:
+            self.writer.write(chunk)
+
+    async def flush(self):
+        await self.writer.drain()
+
+class HttpServer:
+    def __init__(self, max_header_bytes=2048, max_body_bytes=1024, idle_timeout_s=10, log=None):
+        """
+        A small HTTP/1.1 server on asyncio streams: concurrent connections,
+        keep-alive and handlers by path.
+
+        Args:
+            max_header_bytes (int): Largest request line plus headers.
+            max_body_bytes (int): Largest request body accepted.
+            idle_timeout_s (int): Keep-alive connections idle this long
+                are closed.
+            log (Channel): Trace channel handler errors are reported on,
+                None for none.
+
+        Returns:
+            None
+        """
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+        self.idle_timeout_s = idle_timeout_s
+        self.log = log
+        self.routes = {}
+        self.server = None
+        self.open_connections = 0
+        self.requests = 0
+
+    def route(self, path, handler, methods=('GET', 'HEAD')):
+        """
+        Registers a handler for a path.
+
+        Args:
+            path (str): The request path, without query string.
+            handler (coroutine function): Called as handler(request,
+                response); it must send exactly one response.
+            methods (tuple): The methods it answers, others get 405.
+
+        Returns:
+            None
+        """
+        self.routes[path] = (handler, methods)
+
+    async def start(self, host, port, backlog=5):
+        self.server = await asyncio.start_server(self.serve, host, port, backlog=backlog)
+
+    async def wait_closed(self):
+        await self.server.wait_closed()
+
+    def close(self):
+        self.server.close()
+
+    async def read_request(self, reader):
+        """
+        Reads and parses the next request from a connection.
+
+        Returns:
+            Request: The request, None if the client closed the connection.
+
+        Raises:
+            HttpError: The request is malformed or too large.
+        """
+        line = await asyncio.wait_for(reader.readline(), self.idle_timeout_s)
+        if not line:
+            return None
+        size = len(line)
+        parts = line.decode().split()
+        if len(parts) != 3:
+            raise HttpError(400)
+        method, target, version = parts
+        path, _, query = target.partition('?')
+
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout_s)
+            size += len(line)
+            if size > self.max_header_bytes:
+                raise HttpError(431)
+            if not line or line == b'\r\n' or line == b'\n':
+                break
+            name, separator, value = line.decode().partition(':')
+            if not separator:
+                raise HttpError(400)
+            headers[name.strip().lower()] = value.strip()
+
+        body = b''
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400)
+        if length < 0:
+            raise HttpError(400)
+        if length > self.max_body_bytes:
+            raise HttpError(413)
+        if length:
+            body = await asyncio.wait_for(reader.readexactly(length), self.idle_timeout_s)
+        return Request(method.upper(), path, query, version, headers, body, reader)
+
+    async def serve(self, reader, writer):
+        """
+        Serves the requests of one connection until the client closes it,
+        asks for Connection: close, or stays idle for idle_timeout_s.
+        """
+        self.open_connections += 1
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HttpError as error:
+                    await Response(writer, False).send(error.status, STATUS_TEXT.get(error.status, ''), 'text/plain')
+                    break
+                if request is None:
+                    break
+
+                response = Response(writer, request.keep_alive(), request.method == 'HEAD')
+                route = self.routes.get(request.path)
+                if route is None:
+                    await response.send(404, 'Not Found', 'text/plain')
+                elif request.method not in route[1]:
+                    response.add_header('Allow', ', '.join(route[1]))
+                    await response.send(405, 'Method Not Allowed', 'text/plain')
+                else:
+                    try:
+                        await route[0](request, response)
+                    except Exception as error:
+                        if self.log is not None:
+                            self.log.error('{0} {1} failed: {2}', request.method, request.path, repr(error))
+                        if response.is_started():
+                            # Part of the response is out, all that is left
+                            # is to close the connection
+                            break
+                        # The detail is in the trace, not for the client
+                        response.keep_alive = False
+                        await response.send(500, STATUS_TEXT[500], 'text/plain')
+                self.requests += 1
+                if not response.keep_alive:
+                    break
+        except (OSError, EOFError, ValueError, asyncio.TimeoutError):
+            # Client went away, sent garbage or stayed idle
+            pass
+        finally:
+            self.open_connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                # Reset by the peer, the connection is gone either way
+                pass
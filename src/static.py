@@ -0,0 +1,62 @@
+import ujson
+
+## Classes
+class StaticAssets:
+    def __init__(self, manifest_path, chunk_bytes=512, max_age_s=604800):
+        """
+        Serves the pre-gzipped assets listed in the manifest written by
+        assets/build.py.
+
+        Args:
+            manifest_path (str): The manifest.json file.
+            chunk_bytes (int): Size of the reads from flash while sending.
+            max_age_s (int): Cache-Control max-age of every asset.
+
+        Returns:
+            None
+        """
+        self.manifest_path = manifest_path
+        self.chunk_bytes = chunk_bytes
+        self.cache_control = 'public, max-age=' + str(max_age_s)
+        self.assets = {}
+
+    def load(self):
+        with open(self.manifest_path, 'r') as file:
+            self.assets = ujson.loads(file.read())
+
+    def paths(self):
+        return list(self.assets.keys())
+
+    def url(self, path):
+        """
+        The path with the asset ETag as query string, so a rebuilt asset is
+        fetched again despite the long max-age.
+        """
+        return path + '?v=' + self.assets[path]['etag']
+
+    async def serve(self, request, response):
+        """
+        HTTP handler of every asset path: 304 if the client still has the
+        current version, else the gzipped file streamed from flash.
+        """
+        asset = self.assets[request.path]
+        etag = '"' + asset['etag'] + '"'
+        response.add_header('ETag', etag)
+        response.add_header('Cache-Control', self.cache_control)
+
+        match = request.get_header('if-none-match')
+        if match is not None and (etag in match or match == '*'):
+            await response.send(304)
+            return
+
+        response.add_header('Content-Encoding', 'gzip')
+        response.add_header('Vary', 'Accept-Encoding')
+        await response.start(200, asset['type'], asset['length'])
+        if response.head_only:
+            return
+        with open(asset['file'], 'rb') as file:
+            while True:
+                chunk = file.read(self.chunk_bytes)
+                if not chunk:
+                    break
+                await response.write(chunk)
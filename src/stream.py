@@ -0,0 +1,121 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+## Classes
+class StreamClient:
+    def __init__(self, size):
+        """
+        Bounded send queue of one connected stream client. When it is full
+        the oldest frame is dropped, so a slow client only loses frames and
+        never holds up the publisher.
+
+        Args:
+            size (int): Maximum number of queued frames.
+
+        Returns:
+            None
+        """
+        self.size = size
+        self.frames = []
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self.event = asyncio.Event()
+
+    def push(self, frame):
+        if len(self.frames) >= self.size:
+            self.frames.pop(0)
+            self.dropped += 1
+        self.frames.append(frame)
+        self.event.set()
+
+    def close(self):
+        self.closed = True
+        self.event.set()
+
+    async def next(self):
+        """
+        Returns:
+            bytes: The oldest queued frame, None once the client is closed.
+        """
+        while not self.frames and not self.closed:
+            self.event.clear()
+            await self.event.wait()
+        if self.closed:
+            return None
+        self.sent += 1
+        return self.frames.pop(0)
+
+    async def watch(self, reader):
+        """
+        Closes the client when its connection ends. A stream client sends
+        nothing after its request, so the read only returns at the end.
+        """
+        try:
+            while await reader.read(64):
+                pass
+        except OSError:
+            pass
+        self.close()
+
+class StreamHub:
+    def __init__(self, queue_frames):
+        """
+        Fans Server-Sent Events out to the connected clients. Frames are
+        only sent while the event loop runs: what is published during a
+        measurement goes out after it ends, which is why a charge curve is
+        published once, whole, rather than point by point.
+
+        Args:
+            queue_frames (int): Send queue length per client.
+
+        Returns:
+            None
+        """
+        self.queue_frames = queue_frames
+        self.clients = []
+        self.published = 0
+
+    def has_clients(self):
+        return len(self.clients) > 0
+
+    def publish(self, event, data):
+        """
+        Queues an event for every client. Does not wait and does nothing
+        without clients, so it can be called from the measurement code.
+
+        Args:
+            event (str): The SSE event name.
+            data (str): The event data, a single line.
+
+        Returns:
+            None
+        """
+        if not self.clients:
+            return
+        frame = ('event: ' + event + '\ndata: ' + data + '\n\n').encode()
+        for client in self.clients:
+            client.push(frame)
+        self.published += 1
+
+    async def serve(self, request, response):
+        """
+        HTTP handler of the event stream; runs until the client goes away,
+        which the connection is watched for while no frames are sent.
+        """
+        client = StreamClient(self.queue_frames)
+        self.clients.append(client)
+        watcher = asyncio.create_task(client.watch(request.reader))
+        try:
+            response.add_header('Cache-Control', 'no-cache')
+            await response.start(200, 'text/event-stream')
+            while True:
+                frame = await client.next()
+                if frame is None:
+                    break
+                await response.write(frame)
+        finally:
+            self.clients.remove(client)
+            watcher.cancel()
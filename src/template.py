@@ -0,0 +1,128 @@
+from uos import stat
+
+## Aux functions
+def compile_template(text, static):
+    """
+    Splits a str.format style template into static byte chunks and the
+    names of the fields between them. Fields found in static are merged
+    into the chunks.
+
+    Args:
+        text (str): The template, {name} fields, {{ and }} for braces.
+        static (dict): Values that never change, by field name.
+
+    Returns:
+        tuple: (chunks, fields), len(chunks) == len(fields) + 1.
+    """
+    chunks = []
+    fields = []
+    pending = []
+    i = 0
+    while True:
+        start = text.find('{', i)
+        if start < 0:
+            pending.append(text[i:].replace('}}', '}'))
+            break
+        pending.append(text[i:start].replace('}}', '}'))
+        if text.startswith('{{', start):
+            pending.append('{')
+            i = start + 2
+            continue
+        end = text.find('}', start)
+        if end < 0:
+            raise ValueError('Unterminated template field')
+        name = text[start + 1:end]
+        if name in static:
+            pending.append(str(static[name]))
+        else:
+            chunks.append(''.join(pending).encode())
+            fields.append(name)
+            pending = []
+        i = end + 1
+    chunks.append(''.join(pending).encode())
+    return chunks, fields
+
+## Classes
+class Template:
+    def __init__(self, path, static=None):
+        """
+        A template file compiled once into static chunks and re-read only
+        when its size or modification time changes.
+
+        Args:
+            path (str): The template file.
+            static (dict): Field values merged in at compile time.
+
+        Returns:
+            None
+        """
+        self.path = path
+        self.static = static if static is not None else {}
+        self.chunks = []
+        self.fields = []
+        self.static_length = 0
+        self.stamp = None
+        self.loads = 0
+
+    def refresh(self):
+        """
+        Recompiles the template if the file changed since the last load.
+
+        Returns:
+            bool: True if the template was (re)loaded.
+        """
+        info = stat(self.path)
+        stamp = (info[6], info[8])
+        if stamp == self.stamp:
+            return False
+        with open(self.path, 'r') as file:
+            text = file.read()
+        self.chunks, self.fields = compile_template(text, self.static)
+        self.static_length = 0
+        for chunk in self.chunks:
+            self.static_length += len(chunk)
+        self.stamp = stamp
+        self.loads += 1
+        return True
+
+    def render(self, values):
+        """
+        Encodes the dynamic fields.
+
+        Args:
+            values (dict): Values of the dynamic fields, formatted with str().
+
+        Returns:
+            tuple: (encoded field values, total length of the page in bytes)
+        """
+        encoded = []
+        length = self.static_length
+        for name in self.fields:
+            value = str(values[name]).encode()
+            encoded.append(value)
+            length += len(value)
+        return encoded, length
+
+    async def send(self, response, values, status=200, content_type='text/html'):
+        """
+        Streams the page: the head with its Content-Length, then the static
+        chunks and field values one after the other, without joining them.
+
+        Args:
+            response (Response): Where the page is sent.
+            values (dict): Values of the dynamic fields.
+            status (int): The HTTP status code.
+            content_type (str): The Content-Type of the page.
+
+        Returns:
+            None
+        """
+        self.refresh()
+        encoded, length = self.render(values)
+        chunks = self.chunks
+        await response.start(status, content_type, length)
+        for i in range(len(encoded)):
+            response.feed(chunks[i])
+            response.feed(encoded[i])
+        response.feed(chunks[-1])
+        await response.flush()
@@ -0,0 +1,193 @@
+"""
+Levelled tracing into a fixed ring of binary records.
+
+A trace call checks the level of its channel first and returns at once when
+the channel is off; the message is only formatted when it is printed or
+when the ring is dumped. The ring stores the ticks, the format string id
+and up to three numeric arguments per record, strings are stored by id.
+
+Hot paths guard their trace points with
+
+    if __debug__:
+        if log_capacitor.level >= LEVEL_TRACE:
+            log_capacitor.trace(...)
+
+so a build compiled with optimisation (micropython.opt_level(1), mpy-cross
+-O1 or python -O) drops them altogether.
+"""
+
+import struct
+from time import ticks_us
+
+LEVEL_OFF = 0
+LEVEL_ERROR = 1
+LEVEL_WARN = 2
+LEVEL_INFO = 3
+LEVEL_DEBUG = 4
+LEVEL_TRACE = 5
+LEVEL_NAMES = ('off', 'error', 'warn', 'info', 'debug', 'trace')
+
+# ticks_us, format id, channel, level and string flags, three arguments
+RECORD_FORMAT = '<IHBBfff'
+RECORD_SIZE = 20
+# Strings interned for the ring, formats and string arguments together
+MAX_STRINGS = 256
+
+## Classes
+class TraceChannel:
+    def __init__(self, tracer, index, name, level):
+        """
+        The trace calls of one part of the firmware. level is read directly
+        by guarded hot paths.
+
+        Args:
+            tracer (Tracer): Where the records go.
+            index (int): Channel number stored in the records.
+            name (str): Printed with every message.
+            level (int): Most detailed level recorded, LEVEL_OFF for none.
+
+        Returns:
+            None
+        """
+        self.tracer = tracer
+        self.index = index
+        self.name = name
+        self.level = level
+
+    def error(self, message, a=None, b=None, c=None):
+        if self.level >= LEVEL_ERROR:
+            self.tracer.record(self, LEVEL_ERROR, message, a, b, c)
+
+    def warn(self, message, a=None, b=None, c=None):
+        if self.level >= LEVEL_WARN:
+            self.tracer.record(self, LEVEL_WARN, message, a, b, c)
+
+    def info(self, message, a=None, b=None, c=None):
+        if self.level >= LEVEL_INFO:
+            self.tracer.record(self, LEVEL_INFO, message, a, b, c)
+
+    def debug(self, message, a=None, b=None, c=None):
+        if self.level >= LEVEL_DEBUG:
+            self.tracer.record(self, LEVEL_DEBUG, message, a, b, c)
+
+    def trace(self, message, a=None, b=None, c=None):
+        if self.level >= LEVEL_TRACE:
+            self.tracer.record(self, LEVEL_TRACE, message, a, b, c)
+
+class Tracer:
+    def __init__(self, records=256, print_level=LEVEL_OFF, level=LEVEL_INFO, levels=None):
+        """
+        Args:
+            records (int): Records kept in the ring, the oldest is
+                overwritten first.
+            print_level (int): Records up to this level are also printed.
+            level (int): Default level of new channels.
+            levels (dict): Levels of named channels, overriding level.
+
+        Returns:
+            None
+        """
+        self.ring = bytearray(records * RECORD_SIZE)
+        self.records = records
+        self.head = 0
+        self.count = 0
+        self.print_level = print_level
+        self.default_level = level
+        self.levels = levels if levels is not None else {}
+        self.channels = []
+        self.strings = ['?']
+        self.string_ids = {'?': 0}
+        self.recorded = 0
+
+    def channel(self, name):
+        channel = TraceChannel(self, len(self.channels), name, self.levels.get(name, self.default_level))
+        self.channels.append(channel)
+        return channel
+
+    def set_level(self, name, level):
+        """
+        Changes the level of the named channel, or of all channels if name
+        is None.
+
+        Returns:
+            bool: False if there is no such channel.
+        """
+        found = False
+        for channel in self.channels:
+            if name is None or channel.name == name:
+                channel.level = level
+                found = True
+        return found
+
+    def intern(self, text):
+        index = self.string_ids.get(text)
+        if index is None:
+            if len(self.strings) >= MAX_STRINGS:
+                return 0
+            index = len(self.strings)
+            self.strings.append(text)
+            self.string_ids[text] = index
+        return index
+
+    def record(self, channel, level, message, a, b, c):
+        flags = level
+        args = [a, b, c]
+        for i in range(3):
+            value = args[i]
+            if value is None:
+                args[i] = 0.0
+            elif type(value) is not int and type(value) is not float and type(value) is not bool:
+                args[i] = self.intern(str(value))
+                flags |= 8 << i
+        struct.pack_into(RECORD_FORMAT, self.ring, self.head * RECORD_SIZE, ticks_us() & 0xFFFFFFFF,
+                         self.intern(message), channel.index, flags, args[0], args[1], args[2])
+        self.head = (self.head + 1) % self.records
+        if self.count < self.records:
+            self.count += 1
+        self.recorded += 1
+        if level <= self.print_level:
+            print('$ ' + self.format(channel.index, level, message, a, b, c))
+
+    def format(self, index, level, message, a=None, b=None, c=None):
+        try:
+            message = message.format(a, b, c)
+        except (IndexError, KeyError, ValueError, TypeError):
+            pass
+        return '{0} {1}: {2}'.format(LEVEL_NAMES[level], self.channels[index].name, message)
+
+    def format_record(self, buffer, offset):
+        ticks, message, index, flags, a, b, c = struct.unpack_from(RECORD_FORMAT, buffer, offset)
+        args = [a, b, c]
+        for i in range(3):
+            if flags & (8 << i):
+                args[i] = self.strings[int(args[i])]
+            elif abs(args[i]) < 16777216 and args[i] == int(args[i]):
+                args[i] = int(args[i])
+            elif args[i] == args[i]:
+                # The 7 digits a float32 holds
+                args[i] = float('%.7g' % args[i])
+        line = self.format(index, flags & 7, self.strings[message], args[0], args[1], args[2])
+        return '{0} {1}'.format(ticks, line)
+
+    def dump(self, handler, first=0, limit=None):
+        """
+        Calls handler(line) for the records in the ring, oldest first,
+        formatting them one at a time.
+
+        Args:
+            handler (callable): Called with each formatted record.
+            first (int): Records skipped, counted from the oldest.
+            limit (int): Most records handed to handler, all if None.
+
+        Returns:
+            int: The number of records handed to handler.
+        """
+        start = (self.head - self.count) % self.records
+        end = self.count if limit is None else min(self.count, first + limit)
+        for i in range(first, end):
+            handler(self.format_record(self.ring, ((start + i) % self.records) * RECORD_SIZE))
+        return max(0, end - first)
+
+    def clear(self):
+        self.head = 0
+        self.count = 0